@@ -0,0 +1,75 @@
+"""
+Rank query benchmark: BalanceIndex vs. counting (or sorting) every balance
+
+Usage: python benchmarks/balance_index.py [users]   (default: 1000000)
+"""
+
+import random
+import sys
+import time
+from bisect import bisect_right
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.objects.balance_index import BalanceIndex  # noqa: E402
+
+QUERIES = 100000
+SCANS = 5
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def ranks(index: BalanceIndex, balances: list):
+    return [index.rank(balance) for balance in balances]
+
+
+def updates(index: BalanceIndex, changes: list):
+    for old, new in changes:
+        index.update(old, new)
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rng = random.Random(users)
+    # Mostly small balances with a long tail, like a real economy
+    balances = [int(rng.paretovariate(1.2) * 1000) - 1000 for _ in range(users)]
+    queries = rng.choices(balances, k=QUERIES)
+
+    index = BalanceIndex()
+    _, build_ms = timed(index.build, balances)
+    _, sort_ms = timed(sorted, balances)
+
+    result, rank_ms = timed(ranks, index, queries)
+    ordered = sorted(balances)
+    for balance, rank in zip(queries[:1000], result):
+        assert rank == users - bisect_right(ordered, balance) + 1
+
+    # What a rank costs without an index: counting every balance
+    _, scan_ms = timed(
+        lambda: [sum(1 for b in balances if b > q) for q in queries[:SCANS]]
+    )
+
+    changes = []
+    current = list(balances)
+    for _ in range(QUERIES):
+        i = rng.randrange(users)
+        new = max(current[i] + rng.randint(-5000, 5000), 0)
+        changes.append((current[i], new))
+        current[i] = new
+    _, update_ms = timed(updates, index, changes)
+
+    print(f"{users} users, {QUERIES} rank queries/updates")
+    print(f"{'build':<22}{build_ms:>10.1f}ms   (sorted(): {sort_ms:.1f}ms)")
+    print(f"{'rank (index)':<22}{rank_ms * 1000 / QUERIES:>10.2f}us per query")
+    print(f"{'rank (full scan)':<22}{scan_ms * 1000 / SCANS:>10.2f}us per query")
+    print(f"{'update':<22}{update_ms * 1000 / QUERIES:>10.2f}us per update")
+    print(f"{'wide buckets':<22}{index.snapshot()['wide_buckets']:>10}")
+
+
+if __name__ == "__main__":
+    main()
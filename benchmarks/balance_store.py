@@ -0,0 +1,101 @@
+"""
+Memory and throughput benchmark: BalanceStore vs. a plain dict
+
+Usage: python benchmarks/balance_store.py [users]   (default: 1000000)
+"""
+
+import gc
+import heapq
+import random
+import sys
+import time
+import tracemalloc
+from operator import itemgetter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.objects.balance_store import BalanceStore, np  # noqa: E402
+
+OPERATIONS = 200000
+
+
+def generate(ids: list) -> dict:
+    rng = random.Random(len(ids))
+    return {user_id + 1: rng.randint(0, 10**7) for user_id in ids}
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def dict_histogram(balances: dict, bins: int):
+    values = balances.values()
+    low, high = min(values), max(values)
+    width = (high - low) / bins or 1
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return counts
+
+
+def lookups(balances, user_ids):
+    for user_id in user_ids:
+        if user_id in balances:
+            balances[user_id]
+
+
+def updates(balances, user_ids):
+    for user_id in user_ids:
+        balances[user_id] = balances[user_id] + 1
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    ids = random.Random(users).sample(range(10**17, 10**18), users)
+    sample = [user_id + 1 for user_id in random.Random(0).choices(ids, k=OPERATIONS)]
+
+    # Both are built from fresh int objects so the dict is charged for them
+    plain, dict_bytes = measure(lambda: generate(ids))
+    store, store_bytes = measure(lambda: BalanceStore(generate(ids)))
+
+    print(f"{users} users, {OPERATIONS} lookups/updates, numpy: {np is not None}")
+    print(f"{'':<18}{'dict':>12}{'BalanceStore':>14}")
+    print(
+        f"{'memory':<18}{dict_bytes / 1024 / 1024:>10.1f}MB"
+        f"{store_bytes / 1024 / 1024:>12.1f}MB"
+    )
+    rows = [
+        ("lookups", lambda b: lookups(b, sample), lambda b: lookups(b, sample)),
+        ("updates", lambda b: updates(b, sample), lambda b: updates(b, sample)),
+        (
+            "top 10",
+            lambda b: heapq.nlargest(10, b.items(), key=itemgetter(1)),
+            lambda b: b.top_k(10),
+        ),
+        ("sum", lambda b: sum(b.values()), lambda b: b.total()),
+        ("histogram(20)", lambda b: dict_histogram(b, 20), lambda b: b.histogram(20)),
+    ]
+    for name, with_dict, with_store in rows:
+        expected, dict_ms = timed(with_dict, plain)
+        result, store_ms = timed(with_store, store)
+        if name == "top 10":
+            assert [b for _, b in result] == [b for _, b in expected]
+        elif name == "sum":
+            assert result == expected
+        print(f"{name:<18}{dict_ms:>10.1f}ms{store_ms:>12.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
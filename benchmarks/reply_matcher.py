@@ -0,0 +1,110 @@
+"""
+Custom reply matching benchmark: ReplyMatcher vs. one substring search per
+trigger (what on_message used to do)
+
+Usage: python benchmarks/reply_matcher.py [triggers ...]   (default: 10 1000 50000)
+"""
+
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.objects.reply_matcher import CustomReplies  # noqa: E402
+
+MESSAGES = 2000
+MESSAGE_WORDS = 20
+CHANGES = 100
+LETTERS = string.ascii_lowercase
+
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 8)))
+
+
+def generate(count: int, rng: random.Random):
+    replies = {}
+    while len(replies) < count:
+        trigger = " ".join(word(rng) for _ in range(rng.randint(1, 3)))
+        replies[trigger] = "reply"
+    # Mostly chatter that matches nothing, the common (and slowest) case
+    messages = []
+    triggers = list(replies)
+    for i in range(MESSAGES):
+        words = [word(rng) for _ in range(MESSAGE_WORDS)]
+        if i % 10 == 0:
+            words[rng.randrange(MESSAGE_WORDS)] = rng.choice(triggers)
+        messages.append(" ".join(words))
+    return replies, messages
+
+
+def substring_loop(replies: dict, messages: list) -> list:
+    found = []
+    for message in messages:
+        for trigger in replies.keys():
+            if trigger in message:
+                found.append(trigger)
+                break
+        else:
+            found.append(None)
+    return found
+
+
+def automaton(replies: CustomReplies, messages: list) -> list:
+    return [replies.match(message) for message in messages]
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def changes(replies: CustomReplies, rng: random.Random) -> tuple:
+    """Average milliseconds of one /reply and one /noreply"""
+    added = [f"{word(rng)} {word(rng)}" for _ in range(CHANGES)]
+    started = time.perf_counter()
+    for trigger in added:
+        replies[trigger] = "reply"
+    add_ms = (time.perf_counter() - started) * 1000 / CHANGES
+    started = time.perf_counter()
+    for trigger in added:
+        del replies[trigger]
+    remove_ms = (time.perf_counter() - started) * 1000 / CHANGES
+    return add_ms, remove_ms
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10, 1000, 50000]
+    print(f"{MESSAGES} messages of {MESSAGE_WORDS} words, 1 in 10 has a trigger")
+    print(
+        f"{'triggers':>9}{'loop/msg':>12}{'matcher/msg':>13}"
+        f"{'load':>10}{'/reply':>10}{'/noreply':>10}{'nodes':>9}"
+    )
+    for count in counts:
+        rng = random.Random(count)
+        replies, messages = generate(count, rng)
+
+        # A load fills the trie, the first message links it
+        matcher, load_ms = timed(lambda: CustomReplies(replies))
+        _, link_ms = timed(matcher.match, "")
+
+        expected, loop_ms = timed(substring_loop, replies, messages)
+        result, matcher_ms = timed(automaton, matcher, messages)
+        assert result == expected
+
+        add_ms, remove_ms = changes(matcher, rng)
+        assert automaton(matcher, messages) == expected
+        print(
+            f"{count:>9}{loop_ms * 1000 / MESSAGES:>10.1f}us"
+            f"{matcher_ms * 1000 / MESSAGES:>11.1f}us"
+            f"{load_ms + link_ms:>8.0f}ms{add_ms:>8.2f}ms{remove_ms:>8.2f}ms"
+            f"{matcher.matcher.snapshot()['nodes']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Startup-time benchmark: warm-start snapshot vs. full collection scan
+
+Builds a synthetic state for each population size, then times
+- decoding every document of a full scan the way ``init_data`` does (the BSON
+  batches are pre-encoded, so network transfer is NOT included and the real
+  cold start is slower still),
+- writing the snapshot file,
+- loading the snapshot file.
+
+Usage: python benchmarks/snapshot_startup.py [users ...]   (default: 10000 100000 1000000)
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import bson
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.database import COOLDOWN_FIELDS, decode_user_settings  # noqa: E402
+from bot.objects.user_settings import UserSettings  # noqa: E402
+from bot.snapshot import SnapshotState, load_snapshot, write_snapshot  # noqa: E402
+
+ITEMS = ["Hacker's Laptop", "Nitro Boost"]
+
+
+def build_state(users: int) -> SnapshotState:
+    rng = random.Random(users)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    state = SnapshotState(now)
+    for i in range(users):
+        user_id = 100000000000000000 + i * 7919
+        state.balances[user_id] = rng.randint(0, 10**6)
+        if rng.random() < 0.1:
+            state.items[user_id] = {rng.choice(ITEMS): rng.randint(1, 5)}
+        if rng.random() < 0.3:
+            state.user_settings[user_id] = UserSettings(
+                bank_dm_enabled=rng.random() < 0.5,
+                bank_passive_enabled=rng.random() < 0.2,
+            )
+        row = [
+            (
+                int(now.timestamp()) - rng.randint(0, 86400 * 30)
+                if rng.random() < 0.2
+                else 0
+            )
+            for _ in COOLDOWN_FIELDS
+        ]
+        if any(row):
+            state.cooldowns[user_id] = row
+            state.cooldown_expires[user_id] = max(row) + 86400 * 30
+    return state
+
+
+def scan_batches(state: SnapshotState):
+    """The Users and Cooldowns documents as encoded BSON batches, in the
+    per-kind date layout the original full load decoded"""
+    users = []
+    for user_id, balance in state.balances.items():
+        doc = {"_id": user_id, "balance": balance}
+        if user_id in state.items:
+            doc["items"] = state.items[user_id]
+        if user_id in state.user_settings:
+            settings = state.user_settings[user_id]
+            doc["settings"] = {
+                "dm": settings.bank_dm_enabled,
+                "passive": settings.bank_passive_enabled,
+            }
+        users.append(bson.encode(doc))
+    cooldowns = []
+    for user_id, row in state.cooldowns.items():
+        doc = {"_id": user_id}
+        for field, claimed_at in zip(COOLDOWN_FIELDS, row):
+            if claimed_at:
+                doc[field] = datetime.fromtimestamp(claimed_at, timezone.utc)
+        cooldowns.append(bson.encode(doc))
+    return b"".join(users), b"".join(cooldowns)
+
+
+def full_scan(users_batch: bytes, cooldowns_batch: bytes):
+    """Rebuild the maps from decoded documents like init_data does"""
+    balances, items, settings = {}, {}, {}
+    cooldowns = {field: {} for field in COOLDOWN_FIELDS}
+    for doc in bson.decode_all(users_batch):
+        if "balance" in doc:
+            balances[doc["_id"]] = doc["balance"]
+        if "items" in doc:
+            items[doc["_id"]] = dict(doc["items"] or {})
+        if "settings" in doc:
+            settings[doc["_id"]] = decode_user_settings(doc["settings"] or {})
+    for doc in bson.decode_all(cooldowns_batch):
+        for field, times in cooldowns.items():
+            if doc.get(field) is not None:
+                times[doc["_id"]] = doc[field].replace(tzinfo=timezone.utc)
+    return balances
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    print(
+        f"{'users':>9} {'scan decode':>12} {'snap write':>11} "
+        f"{'snap load':>10} {'snap size':>10}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "state.snap"
+        for users in sizes:
+            state = build_state(users)
+            balances, scan_ms = timed(full_scan, *scan_batches(state))
+            _, write_ms = timed(write_snapshot, path, state)
+            loaded, load_ms = timed(load_snapshot, path)
+            assert loaded.balances == balances
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            print(
+                f"{users:>9} {scan_ms:>10.0f}ms {write_ms:>9.0f}ms "
+                f"{load_ms:>8.0f}ms {size_mb:>8.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
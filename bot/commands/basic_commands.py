@@ -497,7 +497,7 @@ https://user783667580106702848.pepich.de/""",
     async def set_custom_reply(interaction: discord.Interaction, text: str, reply: str):
         if text and reply:
             custom_replies[text] = reply
-            refresh_replies(Main.CONNSTR)
+            refresh_replies(Main.CONNSTR, text)
             embed = discord.Embed(
                 title="Success!",
                 description=f"Successfully set custom reply! Bot will now reply with '{reply}' "
@@ -522,7 +522,7 @@ https://user783667580106702848.pepich.de/""",
         for key in list(custom_replies.keys()):
             if key in text or text in key:
                 del custom_replies[key]
-                refresh_replies(Main.CONNSTR)
+                refresh_replies(Main.CONNSTR, key)
                 removed = True
                 embed = discord.Embed(
                     title="Success!",
@@ -773,7 +773,7 @@ https://user783667580106702848.pepich.de/""",
             return
 
         Main.user_settings_map[user_id] = settings
-        refresh_user_settings(Main.CONNSTR, Main.user_settings_map)
+        refresh_user_settings(Main.CONNSTR, Main.user_settings_map, user_id)
 
         await interaction.response.send_message(embed=embed)
 
@@ -2,33 +2,39 @@
 Currency/Economy slash commands
 """
 
-from datetime import datetime, timezone
 from typing import Optional
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
+from bot.cooldown_engine import (
+    cooldown,
+    cooldown_embed,
+    cooldown_engine,
+    unavailable_embed,
+)
+from bot.leaderboard_history import leaderboard_history, movement, today
+from bot.leaderboards import (
+    guild_ranking,
+    render_global_leaderboard,
+    render_history,
+    render_leaderboard,
+)
 from bot.helper import (
     get_random_color,
-    BASIC_COOLDOWN,
-    DAILY_COOLDOWN,
-    WEEKLY_COOLDOWN,
-    MONTHLY_COOLDOWN,
     get_random_work,
     get_random_integer,
     credit_balance,
-    credit_balance_for_different_user,
-    debit_balance,
-    debit_balance_for_different_user,
-    refresh_works,
-    refresh_robs,
-    refresh_dailies,
-    refresh_weeklies,
-    refresh_monthlies,
-    refresh_balances,
+    global_standing,
+    notify_balance_change,
+    open_account,
+    transfer_balance,
 )
+from bot.objects.cooldowns import DAILY, MONTHLY, ROB, WEEKLY, WORK
 from bot.objects.shop import Shop
+from bot.objects.user_locks import user_locks
+from bot.transactions import render_page, transaction_pages
 
 
 def _get_main():
@@ -38,6 +44,14 @@ def _get_main():
     return Main
 
 
+def _poor_target_embed() -> discord.Embed:
+    return discord.Embed(
+        title="Error!",
+        description="That user does not have enough money to rob!",
+        color=get_random_color(),
+    )
+
+
 def setup_currency_commands(bot: commands.Bot):
     """Setup currency/economy slash commands"""
     Main = _get_main()
@@ -52,231 +66,95 @@ def setup_currency_commands(bot: commands.Bot):
     ):
         target_user = user or interaction.user
 
-        if target_user.id not in Main.balance_map:
-            Main.balance_map[target_user.id] = 0
-            refresh_balances(Main.CONNSTR)
-
-        bal = Main.balance_map[target_user.id]
+        bal = open_account(Main.CONNSTR, target_user.id)
+        position, total, percentile = global_standing(bal)
         embed = discord.Embed(
             title=f"{target_user.display_name if interaction.guild else target_user.name}'s balance:-",
             color=get_random_color(),
         )
         embed.add_field(name="Bank", value=f":coin: {bal}")
+        embed.add_field(
+            name="Global rank",
+            value=f"#{position:,} of {total:,} (richer than {percentile:.0f}% of users)",
+        )
         await interaction.response.send_message(embed=embed)
 
     @bot.tree.command(name="daily", description="Get your daily 🪙 5000 earnings!")
+    @cooldown(DAILY)
     async def daily(interaction: discord.Interaction):
-        user_id = interaction.user.id
-
-        if user_id in Main.user_daily_times:
-            time_diff = datetime.now(timezone.utc) - Main.user_daily_times[user_id]
-            if time_diff.total_seconds() >= DAILY_COOLDOWN:
-                Main.user_daily_times[user_id] = datetime.now(timezone.utc)
-                earn = 5000
-                if await credit_balance(
-                    earn,
-                    interaction,
-                    Main.CONNSTR,
-                    Main.user_settings_map,
-                    Main.balance_map,
-                ):
-                    embed = discord.Embed(
-                        title=f"{interaction.user.display_name}'s Daily Earnings",
-                        description=f"{interaction.user.display_name} got their daily earnings: :coin: {earn}",
-                        color=get_random_color(),
-                    )
-                    await interaction.response.send_message(embed=embed)
-                refresh_dailies(Main.CONNSTR, Main.user_daily_times)
-            else:
-                left_seconds = int(DAILY_COOLDOWN - time_diff.total_seconds())
-                hours = left_seconds // 3600
-                minutes = (left_seconds % 3600) // 60
-                seconds = left_seconds % 60
-                embed = discord.Embed(
-                    title="Error!",
-                    description=f"You are currently on cooldown! You may use this command again after "
-                    f"{hours} hours, {minutes} minutes and {seconds} seconds.",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-        else:
-            Main.user_daily_times[user_id] = datetime.now(timezone.utc)
-            earn = 5000
-            if await credit_balance(
-                earn,
-                interaction,
-                Main.CONNSTR,
-                Main.user_settings_map,
-                Main.balance_map,
-            ):
-                embed = discord.Embed(
-                    title=f"{interaction.user.display_name}'s Daily Earnings",
-                    description=f"{interaction.user.display_name} got their daily earnings: :coin: {earn}",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-            refresh_dailies(Main.CONNSTR, Main.user_daily_times)
+        earn = 5000
+        if await credit_balance(
+            earn,
+            interaction,
+            Main.CONNSTR,
+            Main.user_settings_map,
+            Main.balance_map,
+            "daily",
+        ):
+            embed = discord.Embed(
+                title=f"{interaction.user.display_name}'s Daily Earnings",
+                description=f"{interaction.user.display_name} got their daily earnings: :coin: {earn}",
+                color=get_random_color(),
+            )
+            await interaction.response.send_message(embed=embed)
 
     @bot.tree.command(name="weekly", description="Get your weekly 🪙 10000 earnings!")
+    @cooldown(WEEKLY)
     async def weekly(interaction: discord.Interaction):
-        user_id = interaction.user.id
-
-        if user_id in Main.user_weekly_times:
-            time_diff = datetime.now(timezone.utc) - Main.user_weekly_times[user_id]
-            if time_diff.total_seconds() >= WEEKLY_COOLDOWN:
-                Main.user_weekly_times[user_id] = datetime.now(timezone.utc)
-                earn = 10000
-                if await credit_balance(
-                    earn,
-                    interaction,
-                    Main.CONNSTR,
-                    Main.user_settings_map,
-                    Main.balance_map,
-                ):
-                    embed = discord.Embed(
-                        title=f"{interaction.user.display_name}'s Weekly Earnings",
-                        description=f"{interaction.user.display_name} got their weekly earnings: :coin: {earn}",
-                        color=get_random_color(),
-                    )
-                    await interaction.response.send_message(embed=embed)
-                refresh_weeklies(Main.CONNSTR, Main.user_weekly_times)
-            else:
-                left_seconds = int(WEEKLY_COOLDOWN - time_diff.total_seconds())
-                days = left_seconds // (24 * 3600)
-                left_seconds = left_seconds % (24 * 3600)
-                hours = left_seconds // 3600
-                minutes = (left_seconds % 3600) // 60
-                seconds = left_seconds % 60
-                embed = discord.Embed(
-                    title="Error!",
-                    description=f"You are currently on cooldown! You may use this command again after "
-                    f"{days} days, {hours} hours, {minutes} minutes and {seconds} seconds.",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-        else:
-            Main.user_weekly_times[user_id] = datetime.now(timezone.utc)
-            earn = 10000
-            if await credit_balance(
-                earn,
-                interaction,
-                Main.CONNSTR,
-                Main.user_settings_map,
-                Main.balance_map,
-            ):
-                embed = discord.Embed(
-                    title=f"{interaction.user.display_name}'s Weekly Earnings",
-                    description=f"{interaction.user.display_name} got their weekly earnings: :coin: {earn}",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-            refresh_weeklies(Main.CONNSTR, Main.user_weekly_times)
+        earn = 10000
+        if await credit_balance(
+            earn,
+            interaction,
+            Main.CONNSTR,
+            Main.user_settings_map,
+            Main.balance_map,
+            "weekly",
+        ):
+            embed = discord.Embed(
+                title=f"{interaction.user.display_name}'s Weekly Earnings",
+                description=f"{interaction.user.display_name} got their weekly earnings: :coin: {earn}",
+                color=get_random_color(),
+            )
+            await interaction.response.send_message(embed=embed)
 
     @bot.tree.command(name="monthly", description="Get your monthly 🪙 50000 earnings!")
+    @cooldown(MONTHLY)
     async def monthly(interaction: discord.Interaction):
-        user_id = interaction.user.id
-
-        if user_id in Main.user_monthly_times:
-            time_diff = datetime.now(timezone.utc) - Main.user_monthly_times[user_id]
-            if time_diff.total_seconds() >= MONTHLY_COOLDOWN:
-                Main.user_monthly_times[user_id] = datetime.now(timezone.utc)
-                earn = 50000
-                if await credit_balance(
-                    earn,
-                    interaction,
-                    Main.CONNSTR,
-                    Main.user_settings_map,
-                    Main.balance_map,
-                ):
-                    embed = discord.Embed(
-                        title=f"{interaction.user.display_name}'s Monthly Earnings",
-                        description=f"{interaction.user.display_name} got their monthly earnings: :coin: {earn}",
-                        color=get_random_color(),
-                    )
-                    await interaction.response.send_message(embed=embed)
-                refresh_monthlies(Main.CONNSTR, Main.user_monthly_times)
-            else:
-                left_seconds = int(MONTHLY_COOLDOWN - time_diff.total_seconds())
-                days = left_seconds // (24 * 3600)
-                left_seconds = left_seconds % (24 * 3600)
-                hours = left_seconds // 3600
-                minutes = (left_seconds % 3600) // 60
-                seconds = left_seconds % 60
-                embed = discord.Embed(
-                    title="Error!",
-                    description=f"You are currently on cooldown! You may use this command again after "
-                    f"{days} days, {hours} hours, {minutes} minutes and {seconds} seconds.",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-        else:
-            Main.user_monthly_times[user_id] = datetime.now(timezone.utc)
-            earn = 50000
-            if await credit_balance(
-                earn,
-                interaction,
-                Main.CONNSTR,
-                Main.user_settings_map,
-                Main.balance_map,
-            ):
-                embed = discord.Embed(
-                    title=f"{interaction.user.display_name}'s Monthly Earnings",
-                    description=f"{interaction.user.display_name} got their monthly earnings: :coin: {earn}",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-            refresh_monthlies(Main.CONNSTR, Main.user_monthly_times)
+        earn = 50000
+        if await credit_balance(
+            earn,
+            interaction,
+            Main.CONNSTR,
+            Main.user_settings_map,
+            Main.balance_map,
+            "monthly",
+        ):
+            embed = discord.Embed(
+                title=f"{interaction.user.display_name}'s Monthly Earnings",
+                description=f"{interaction.user.display_name} got their monthly earnings: :coin: {earn}",
+                color=get_random_color(),
+            )
+            await interaction.response.send_message(embed=embed)
 
     @bot.tree.command(name="work", description="You work and gain money!")
+    @cooldown(WORK)
     async def work(interaction: discord.Interaction):
-        user_id = interaction.user.id
-
-        if user_id in Main.user_worked_times:
-            time_diff = datetime.now(timezone.utc) - Main.user_worked_times[user_id]
-            if time_diff.total_seconds() >= BASIC_COOLDOWN:
-                Main.user_worked_times[user_id] = datetime.now(timezone.utc)
-                work_msg = get_random_work()
-                earn = get_random_integer(500, 100)
-                if await credit_balance(
-                    earn,
-                    interaction,
-                    Main.CONNSTR,
-                    Main.user_settings_map,
-                    Main.balance_map,
-                ):
-                    embed = discord.Embed(
-                        title=f"{interaction.user.display_name} Worked",
-                        description=f"{interaction.user.display_name} {work_msg} :coin: {earn}",
-                        color=get_random_color(),
-                    )
-                    await interaction.response.send_message(embed=embed)
-                refresh_works(Main.CONNSTR, Main.user_worked_times)
-            else:
-                left = int(BASIC_COOLDOWN - time_diff.total_seconds())
-                embed = discord.Embed(
-                    title="Error!",
-                    description=f"You are currently on cooldown! You may use this command again after {left} seconds.",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-        else:
-            Main.user_worked_times[user_id] = datetime.now(timezone.utc)
-            work_msg = get_random_work()
-            earn = get_random_integer(500, 100)
-            if await credit_balance(
-                earn,
-                interaction,
-                Main.CONNSTR,
-                Main.user_settings_map,
-                Main.balance_map,
-            ):
-                embed = discord.Embed(
-                    title=f"{interaction.user.display_name} Worked",
-                    description=f"{interaction.user.display_name} {work_msg} :coin: {earn}",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-            refresh_works(Main.CONNSTR, Main.user_worked_times)
+        work_msg = get_random_work()
+        earn = get_random_integer(500, 100)
+        if await credit_balance(
+            earn,
+            interaction,
+            Main.CONNSTR,
+            Main.user_settings_map,
+            Main.balance_map,
+            "work",
+        ):
+            embed = discord.Embed(
+                title=f"{interaction.user.display_name} Worked",
+                description=f"{interaction.user.display_name} {work_msg} :coin: {earn}",
+                color=get_random_color(),
+            )
+            await interaction.response.send_message(embed=embed)
 
     @bot.tree.command(name="rob", description="Rob others and get money, the dark way")
     @app_commands.describe(user="The user to rob")
@@ -316,22 +194,13 @@ def setup_currency_commands(bot: commands.Bot):
             )
             return
 
-        # Check cooldown
-        if commander_id in Main.user_robbed_times:
-            time_diff = (
-                datetime.now(timezone.utc) - Main.user_robbed_times[commander_id]
+        # Check cooldown (claimed once the passive mode checks pass)
+        left = cooldown_engine.remaining(interaction, ROB)
+        if left:
+            await interaction.response.send_message(
+                embed=cooldown_embed(left), ephemeral=True
             )
-            if time_diff.total_seconds() < BASIC_COOLDOWN:
-                left = int(BASIC_COOLDOWN - time_diff.total_seconds())
-                await interaction.response.send_message(
-                    embed=discord.Embed(
-                        title="Error!",
-                        description=f"You are currently on cooldown! You may use this command again after {left} seconds.",
-                        color=get_random_color(),
-                    ),
-                    ephemeral=True,
-                )
-                return
+            return
 
         # Check passive mode
         if commander_id in Main.user_settings_map:
@@ -358,49 +227,60 @@ def setup_currency_commands(bot: commands.Bot):
                 )
                 return
 
-        # Check balance
-        if user.id not in Main.balance_map or Main.balance_map[user.id] < 1000:
+        if Main.balance_map.get(user.id, 0) < 1000:
             await interaction.response.send_message(
-                embed=discord.Embed(
-                    title="Error!",
-                    description="That user does not have enough money to rob!",
-                    color=get_random_color(),
-                ),
-                ephemeral=True,
+                embed=_poor_target_embed(), ephemeral=True
             )
             return
 
-        # Perform robbery
-        Main.user_robbed_times[commander_id] = datetime.now(timezone.utc)
-        refresh_robs(Main.CONNSTR, Main.user_robbed_times)
-
-        rob_value = get_random_integer(5000, 1000)
-        while Main.balance_map[user.id] < rob_value:
-            rob_value = get_random_integer(5000, 1000)
+        # Claim the cooldown (the balance is checked again after this round trip)
+        left = await cooldown_engine.try_claim(interaction, ROB)
+        if left is None:
+            await interaction.response.send_message(
+                embed=unavailable_embed(), ephemeral=True
+            )
+            return
+        if left:
+            await interaction.response.send_message(
+                embed=cooldown_embed(left), ephemeral=True
+            )
+            return
 
-        if await debit_balance_for_different_user(
-            rob_value,
-            user,
-            interaction,
-            Main.CONNSTR,
-            Main.user_settings_map,
-            Main.balance_map,
-        ):
-            if await credit_balance(
-                rob_value,
-                interaction,
-                Main.CONNSTR,
-                Main.user_settings_map,
-                Main.balance_map,
-            ):
-                embed = discord.Embed(
-                    title="Success!",
-                    description=f"{interaction.user.display_name} successfully robbed "
-                    f"{user.display_name}, and earned :coin: {rob_value}.",
-                    color=get_random_color(),
+        # Check balance and perform robbery
+        async with user_locks.hold(user.id, commander_id):
+            result = None
+            if Main.balance_map.get(user.id, 0) >= 1000:
+                rob_value = get_random_integer(
+                    min(5000, Main.balance_map[user.id]), 1000
+                )
+                result = transfer_balance(
+                    Main.CONNSTR,
+                    interaction.id,
+                    user.id,
+                    commander_id,
+                    rob_value,
+                    "rob",
                 )
-                await interaction.response.send_message(embed=embed)
-                refresh_balances(Main.CONNSTR)
+        if result is None:
+            await interaction.response.send_message(
+                embed=_poor_target_embed(), ephemeral=True
+            )
+            return
+
+        embed = discord.Embed(
+            title="Success!",
+            description=f"{interaction.user.display_name} successfully robbed "
+            f"{user.display_name}, and earned :coin: {rob_value}.",
+            color=get_random_color(),
+        )
+        await interaction.response.send_message(embed=embed)
+        victim_bal, robber_bal = result
+        await notify_balance_change(
+            user, Main.user_settings_map, victim_bal + rob_value, victim_bal
+        )
+        await notify_balance_change(
+            interaction.user, Main.user_settings_map, robber_bal - rob_value, robber_bal
+        )
 
     @bot.tree.command(name="give", description="Transfer money to others' accounts!")
     @app_commands.describe(
@@ -478,11 +358,12 @@ def setup_currency_commands(bot: commands.Bot):
                 )
                 return
 
-        # Check balance
-        if user_id not in Main.balance_map:
-            Main.balance_map[user_id] = 0
-
-        if amount > Main.balance_map[user_id]:
+        # Check balance and transfer money
+        async with user_locks.hold(user_id, user.id):
+            result = transfer_balance(
+                Main.CONNSTR, interaction.id, user_id, user.id, amount, "give"
+            )
+        if result is None:
             await interaction.response.send_message(
                 embed=discord.Embed(
                     title="Error!",
@@ -493,32 +374,53 @@ def setup_currency_commands(bot: commands.Bot):
             )
             return
 
-        # Transfer money
-        if await debit_balance(
-            amount, interaction, Main.CONNSTR, Main.user_settings_map, Main.balance_map
-        ):
-            if await credit_balance_for_different_user(
-                amount,
-                user,
-                interaction,
-                Main.CONNSTR,
-                Main.user_settings_map,
-                Main.balance_map,
-            ):
-                embed = discord.Embed(
-                    title="Success!",
-                    description=f"{interaction.user.display_name} successfully gave "
-                    f"{user.display_name} :coin: {amount}.",
+        embed = discord.Embed(
+            title="Success!",
+            description=f"{interaction.user.display_name} successfully gave "
+            f"{user.display_name} :coin: {amount}.",
+            color=get_random_color(),
+        )
+        await interaction.response.send_message(embed=embed)
+        giver_bal, receiver_bal = result
+        await notify_balance_change(
+            interaction.user, Main.user_settings_map, giver_bal + amount, giver_bal
+        )
+        await notify_balance_change(
+            user, Main.user_settings_map, receiver_bal - amount, receiver_bal
+        )
+
+    @bot.tree.command(
+        name="transactions", description="See how your balance changed, page by page"
+    )
+    async def transactions(interaction: discord.Interaction):
+        try:
+            # A new command always starts from the latest events
+            page = await transaction_pages.page(interaction.user.id, cached=False)
+        except Exception as e:
+            print(f"Error reading transactions: {e}")
+            await interaction.response.send_message(
+                embed=discord.Embed(
+                    title="Error!",
+                    description="Your transactions can't be loaded right now. Try again later.",
                     color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-                refresh_balances(Main.CONNSTR)
+                ),
+                ephemeral=True,
+            )
+            return
+        embed, view = render_page(page)
+        await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
     @bot.tree.command(
         name="leaderboard",
         description="Compare and check out the richest users of your server!",
     )
-    async def leaderboard(interaction: discord.Interaction):
+    @app_commands.describe(
+        history="Show the leaderboard as it was this many days ago instead"
+    )
+    async def leaderboard(
+        interaction: discord.Interaction,
+        history: Optional[app_commands.Range[int, 1, 365]] = None,
+    ):
         if not interaction.guild:
             await interaction.response.send_message(
                 embed=discord.Embed(
@@ -530,32 +432,58 @@ def setup_currency_commands(bot: commands.Bot):
             )
             return
 
-        users = []
-        for member in interaction.guild.members:
-            if not member.bot and member.id in Main.balance_map:
-                users.append((member, Main.balance_map[member.id]))
-
-        users.sort(key=lambda x: x[1], reverse=True)
-        users = users[:5]  # Top 5
+        if history is not None:
+            await interaction.response.defer()
+            embed = await render_history(interaction.guild, history)
+            await interaction.followup.send(embed=embed)
+            return
 
-        if users:
-            formatted = "\n".join(
-                [
-                    f"{i+1}) {user[0].display_name} (:coin: {user[1]})"
-                    for i, user in enumerate(users)
-                ]
-            )
-            embed = discord.Embed(
-                title=f"Top {len(users)} richest user(s) in {interaction.guild.name}:-",
-                description=formatted,
-                color=get_random_color(),
-            )
+        embed, view = render_leaderboard(interaction.guild, 0)
+        if view is None:
+            await interaction.response.send_message(embed=embed)
         else:
+            await interaction.response.send_message(embed=embed, view=view)
+
+    @bot.tree.command(
+        name="rank", description="See where you stand in this server and globally"
+    )
+    @app_commands.describe(user="The user whose rank you want to check")
+    async def rank(
+        interaction: discord.Interaction, user: Optional[discord.User] = None
+    ):
+        target_user = user or interaction.user
+        name = target_user.display_name if interaction.guild else target_user.name
+        if target_user.id not in Main.balance_map:
             embed = discord.Embed(
-                title="No one has more than :coin: 0 in this server!",
+                title="Error!",
+                description=f"{name} doesn't have a balance yet!",
                 color=get_random_color(),
             )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
+        bal = Main.balance_map[target_user.id]
+        lines = []
+        if interaction.guild:
+            ranking = guild_ranking(interaction.guild)
+            position = ranking.rank(target_user.id)
+            if position is not None:
+                line = f"#{position:,} of {len(ranking):,} in {interaction.guild.name}"
+                yesterday = await leaderboard_history.ranking(
+                    interaction.guild.id, today() - 1
+                )
+                before = yesterday.rank(target_user.id) if yesterday else None
+                if before is not None:
+                    line += f" ({movement(before, position)} since yesterday)"
+                lines.append(line)
+        position, total, _ = global_standing(bal)
+        lines.append(f"#{position:,} of {total:,} globally")
+        embed = discord.Embed(
+            title=f"{name}'s rank:-",
+            description="\n".join(lines),
+            color=get_random_color(),
+        )
+        embed.add_field(name="Bank", value=f":coin: {bal}")
         await interaction.response.send_message(embed=embed)
 
     @bot.tree.command(
@@ -564,34 +492,7 @@ def setup_currency_commands(bot: commands.Bot):
     )
     async def global_leaderboard(interaction: discord.Interaction):
         await interaction.response.defer()
-
-        users = []
-        for user_id, balance in Main.balance_map.items():
-            try:
-                user = await bot.fetch_user(user_id)
-                if not user.bot:
-                    users.append((user, balance))
-            except:
-                continue
-
-        users.sort(key=lambda x: x[1], reverse=True)
-        users = users[:5]  # Top 5
-
-        if users:
-            formatted = "\n".join(
-                [f"{i+1}) {user[0]} (:coin: {user[1]})" for i, user in enumerate(users)]
-            )
-            embed = discord.Embed(
-                title=f"Top {len(users)} richest user(s) of Maxis:-",
-                description=formatted,
-                color=get_random_color(),
-            )
-        else:
-            embed = discord.Embed(
-                title="No one has more than :coin: 0 in our database!",
-                color=get_random_color(),
-            )
-
+        embed = await render_global_leaderboard()
         await interaction.followup.send(embed=embed)
 
     @bot.tree.command(
@@ -679,7 +580,7 @@ def setup_currency_commands(bot: commands.Bot):
                     Main.balance_map,
                     Main.user_settings_map,
                     Main.CONNSTR,
-                    lambda: Shop.refresh_ownerships(Main.CONNSTR),
+                    lambda: Shop.refresh_ownerships(Main.CONNSTR, interaction.user.id),
                 )
                 return
 
@@ -701,7 +602,7 @@ def setup_currency_commands(bot: commands.Bot):
                 await shop_item.use_item(
                     interaction,
                     Shop.owned_items,
-                    lambda: Shop.refresh_ownerships(Main.CONNSTR),
+                    lambda: Shop.refresh_ownerships(Main.CONNSTR, interaction.user.id),
                 )
                 return
 
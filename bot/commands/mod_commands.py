@@ -7,7 +7,14 @@ from discord import app_commands
 from discord.ext import commands
 from typing import Optional
 
+from bot.cooldown_engine import (
+    cooldown_engine,
+    format_remaining,
+    refresh_cooldown_overrides,
+)
+from bot.database import COOLDOWN_FIELDS
 from bot.helper import get_random_color, warn_map, refresh_warns
+from bot.objects.cooldowns import LONGEST_COOLDOWN
 from bot.objects.warn import Warn
 
 
@@ -365,6 +372,7 @@ def setup_mod_commands(bot: commands.Bot):
             warn_map[server_id][user.id].new_warn(cause)
 
         warn = warn_map[server_id][user.id]
+        refresh_warns(Main.CONNSTR, server_id, user.id)
 
         embed = discord.Embed(
             title="Success!",
@@ -386,8 +394,6 @@ def setup_mod_commands(bot: commands.Bot):
         except:
             pass
 
-        refresh_warns(Main.CONNSTR)
-
     @bot.tree.command(name="clearwarns", description="Clear all warns for a user")
     @app_commands.describe(user="The user to clear warns for")
     @app_commands.default_permissions(moderate_members=True)
@@ -429,6 +435,7 @@ def setup_mod_commands(bot: commands.Bot):
 
         if server_id in warn_map and user.id in warn_map[server_id]:
             del warn_map[server_id][user.id]
+            refresh_warns(Main.CONNSTR, server_id, user.id)
             embed = discord.Embed(
                 title="Success!",
                 description=f"Successfully removed all warnings for {user}!",
@@ -443,8 +450,6 @@ def setup_mod_commands(bot: commands.Bot):
             )
             await interaction.response.send_message(embed=embed)
 
-        refresh_warns(Main.CONNSTR)
-
     @bot.tree.command(name="getwarns", description="Gets all warns for a user")
     @app_commands.describe(user="The user to get warns for")
     @app_commands.default_permissions(moderate_members=True)
@@ -499,6 +504,68 @@ def setup_mod_commands(bot: commands.Bot):
         )
         await interaction.response.send_message(embed=embed)
 
+    @bot.tree.command(
+        name="cooldown", description="Changes how long a command's cooldown lasts"
+    )
+    @app_commands.describe(
+        command="The command whose cooldown to change",
+        seconds="The new cooldown length (leave empty to reset it)",
+        role="Only change it for members with this role (optional)",
+    )
+    @app_commands.choices(
+        command=[
+            app_commands.Choice(name=field, value=kind)
+            for kind, field in enumerate(COOLDOWN_FIELDS)
+        ]
+    )
+    @app_commands.default_permissions(manage_guild=True)
+    async def set_cooldown(
+        interaction: discord.Interaction,
+        command: app_commands.Choice[int],
+        seconds: Optional[app_commands.Range[int, 0, LONGEST_COOLDOWN]] = None,
+        role: Optional[discord.Role] = None,
+    ):
+        if type(interaction.user) is discord.User or not interaction.guild:
+            await interaction.response.send_message(
+                embed=discord.Embed(
+                    title="Error!",
+                    description="This command only works in servers!",
+                    color=get_random_color(),
+                ),
+                ephemeral=True,
+            )
+            return
+
+        if not interaction.user.guild_permissions.administrator:  # type: ignore
+            await interaction.response.send_message(
+                embed=discord.Embed(
+                    title="Error!",
+                    description="You don't have admin perms, so you cannot use mod commands!",
+                    color=get_random_color(),
+                ),
+                ephemeral=True,
+            )
+            return
+
+        server_id = interaction.guild.id
+        cooldown_engine.set_override(
+            server_id, command.value, seconds, role.id if role else None
+        )
+        refresh_cooldown_overrides(Main.CONNSTR, server_id)
+
+        target = f" for {role.mention}" if role else ""
+        if seconds is None:
+            description = f"Reset the {command.name} cooldown{target} to its default."
+        else:
+            description = (
+                f"The {command.name} cooldown{target} now lasts "
+                f"{format_remaining(seconds)}."
+            )
+        embed = discord.Embed(
+            title="Success!", description=description, color=get_random_color()
+        )
+        await interaction.response.send_message(embed=embed)
+
     @bot.tree.command(name="clear", description="Clears specified number of messages")
     @app_commands.describe(amount="The number of messages to clear")
     @app_commands.default_permissions(manage_messages=True)
@@ -10,7 +10,18 @@ from bot.helper import (
     get_choice_name,
     get_random_integer,
 )
+from bot.leaderboards import (
+    CUSTOM_ID_PREFIX as LEADERBOARD_PREFIX,
+    parse_custom_id as parse_leaderboard_id,
+    render_leaderboard,
+)
 from bot.objects.shop import Shop
+from bot.transactions import (
+    CUSTOM_ID_PREFIX as TRANSACTIONS_PREFIX,
+    parse_custom_id,
+    render_page,
+    transaction_pages,
+)
 
 
 class ComponentsListener:
@@ -28,6 +39,10 @@ class ComponentsListener:
             await ComponentsListener._handle_help_category(interaction)
         elif custom_id.startswith("rps_"):
             await ComponentsListener._handle_rps(interaction, custom_id)
+        elif custom_id.startswith(f"{LEADERBOARD_PREFIX}_"):
+            await ComponentsListener._handle_leaderboard(interaction, custom_id)
+        elif custom_id.startswith(f"{TRANSACTIONS_PREFIX}_"):
+            await ComponentsListener._handle_transactions(interaction, custom_id)
         else:
             await interaction.response.send_message(
                 embed=discord.Embed(
@@ -132,6 +147,53 @@ class ComponentsListener:
         embed = await help_category(category)
         await interaction.response.edit_message(embed=embed)
 
+    @staticmethod
+    async def _handle_leaderboard(interaction: discord.Interaction, custom_id: str):
+        """Handle leaderboard page buttons"""
+        target = parse_leaderboard_id(custom_id)
+        if target is None or interaction.guild is None:
+            return
+        guild_id, page = target
+        if guild_id != interaction.guild.id:
+            return
+        embed, view = render_leaderboard(interaction.guild, page)
+        await interaction.response.edit_message(embed=embed, view=view)
+
+    @staticmethod
+    async def _handle_transactions(interaction: discord.Interaction, custom_id: str):
+        """Handle transaction history page buttons"""
+        target = parse_custom_id(custom_id)
+        if target is None:
+            return
+        user_id, cursor, older = target
+
+        if user_id != interaction.user.id:
+            await interaction.response.send_message(
+                embed=discord.Embed(
+                    title="Error!",
+                    description="You can't browse someone else's transactions!",
+                    color=get_random_color(),
+                ),
+                ephemeral=True,
+            )
+            return
+
+        try:
+            page = await transaction_pages.page(user_id, cursor, older)
+        except Exception as e:
+            print(f"Error reading transactions: {e}")
+            await interaction.response.send_message(
+                embed=discord.Embed(
+                    title="Error!",
+                    description="Your transactions can't be loaded right now. Try again later.",
+                    color=get_random_color(),
+                ),
+                ephemeral=True,
+            )
+            return
+        embed, view = render_page(page)
+        await interaction.response.edit_message(embed=embed, view=view)
+
     @staticmethod
     async def _handle_rps(interaction: discord.Interaction, custom_id: str):
         """Handle RPS button clicks"""
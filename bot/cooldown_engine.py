@@ -0,0 +1,265 @@
+"""
+Declarative cooldowns for Maxis commands
+
+``@cooldown(KIND)`` checks and claims a cooldown before a slash command runs
+and answers with the time left instead while it is still running. The time is
+read once, and only the touched user's row is written.
+
+Claims are made on the database in one conditional update, so several bot
+processes sharing it can't both claim the same cooldown. The user cache is a
+read-through cache of the stored rows: a cooldown it knows to be running is
+refused without a round trip, anything else is claimed on the server and the
+stored row is cached again.
+
+Cooldown lengths default to the ones in ``bot.objects.cooldowns`` and can be
+overridden per guild and per role. Overrides are resolved per guild when they
+change, so a command in a guild without any costs one dict lookup.
+"""
+
+import functools
+from typing import Dict, List, Optional, Tuple
+
+import discord
+
+from bot.database import (
+    COOLDOWN_FIELDS,
+    GUILDS_COLLECTION,
+    claim_cooldown,
+    decode_cooldown_overrides,
+    encode_cooldown_overrides,
+)
+from bot.helper import get_random_color, stage_write
+from bot.objects.cooldowns import (
+    BASIC_COOLDOWN,
+    DAILY_COOLDOWN,
+    MONTHLY_COOLDOWN,
+    WEEKLY_COOLDOWN,
+    now_epoch,
+)
+from bot.objects.user_cache import user_cache
+from bot.persistence import storage
+
+# Cooldown length of each kind, in the order of a cooldown row
+DEFAULT_DURATIONS = (
+    BASIC_COOLDOWN,
+    BASIC_COOLDOWN,
+    DAILY_COOLDOWN,
+    WEEKLY_COOLDOWN,
+    MONTHLY_COOLDOWN,
+)
+
+
+def format_remaining(seconds: int) -> str:
+    """Human readable time left, e.g. 2 hours, 0 minutes and 5 seconds"""
+    units = (("days", 86400), ("hours", 3600), ("minutes", 60), ("seconds", 1))
+    parts = []
+    for name, size in units:
+        value, seconds = divmod(seconds, size)
+        if value or parts or size == 1:
+            parts.append(f"{value} {name}")
+    if len(parts) == 1:
+        return parts[0]
+    return ", ".join(parts[:-1]) + " and " + parts[-1]
+
+
+class GuildCooldowns:
+    """Cooldown lengths in effect in one guild"""
+
+    __slots__ = ("durations", "roles")
+
+    def __init__(self, guild: Dict[int, int], roles: Dict[int, Dict[int, int]]):
+        self.durations = tuple(
+            guild.get(kind, default) for kind, default in enumerate(DEFAULT_DURATIONS)
+        )
+        # Per kind: (role id, seconds) of the roles overriding it, shortest first
+        self.roles: List[List[Tuple[int, int]]] = [
+            sorted(
+                (
+                    (role_id, lengths[kind])
+                    for role_id, lengths in roles.items()
+                    if kind in lengths
+                ),
+                key=lambda rule: rule[1],
+            )
+            for kind in range(len(COOLDOWN_FIELDS))
+        ]
+
+
+class CooldownEngine:
+    """Cooldown lengths with their overrides, and claims against the user cache"""
+
+    def __init__(self):
+        self.settings: Optional[str] = None
+        # Overrides as configured (by kind index), per guild
+        self.guild_overrides: Dict[int, Dict[int, int]] = {}
+        self.role_overrides: Dict[int, Dict[int, Dict[int, int]]] = {}
+        self._guilds: Dict[int, GuildCooldowns] = {}
+        self.claims = 0
+        self.conflicts = 0
+        # Claims refused because the database couldn't be reached
+        self.unavailable = 0
+
+    def configure(self, settings: str):
+        self.settings = settings
+
+    def load(self, guild_id: int, data: dict):
+        """Set a guild's overrides from their stored form"""
+        guild, roles = decode_cooldown_overrides(data)
+        self.guild_overrides[guild_id] = guild
+        self.role_overrides[guild_id] = roles
+        self._resolve(guild_id)
+
+    def clear(self):
+        self.guild_overrides.clear()
+        self.role_overrides.clear()
+        self._guilds.clear()
+
+    def set_override(
+        self,
+        guild_id: int,
+        kind: int,
+        seconds: Optional[int],
+        role_id: Optional[int] = None,
+    ):
+        """Override a cooldown's length in a guild, or for one of its roles.
+        ``None`` goes back to the default."""
+        if role_id is None:
+            lengths = self.guild_overrides.setdefault(guild_id, {})
+        else:
+            roles = self.role_overrides.setdefault(guild_id, {})
+            lengths = roles.setdefault(role_id, {})
+        if seconds is None:
+            lengths.pop(kind, None)
+        else:
+            lengths[kind] = seconds
+        if role_id is not None and not lengths:
+            del self.role_overrides[guild_id][role_id]
+        self._resolve(guild_id)
+
+    def _resolve(self, guild_id: int):
+        guild = self.guild_overrides.get(guild_id) or {}
+        roles = self.role_overrides.get(guild_id) or {}
+        if guild or roles:
+            self._guilds[guild_id] = GuildCooldowns(guild, roles)
+        else:
+            self._guilds.pop(guild_id, None)
+            self.guild_overrides.pop(guild_id, None)
+            self.role_overrides.pop(guild_id, None)
+
+    def duration(self, kind: int, guild_id: Optional[int], member) -> int:
+        """Length of a cooldown for a user in a guild (or in DMs)"""
+        guild = self._guilds.get(guild_id) if guild_id else None
+        if guild is None:
+            return DEFAULT_DURATIONS[kind]
+        rules = guild.roles[kind]
+        if rules and isinstance(member, discord.Member):
+            for role_id, seconds in rules:
+                if member.get_role(role_id) is not None:
+                    return seconds
+        return guild.durations[kind]
+
+    def _duration_for(self, interaction: discord.Interaction, kind: int) -> int:
+        return self.duration(kind, interaction.guild_id, interaction.user)
+
+    async def try_claim(
+        self, interaction: discord.Interaction, kind: int
+    ) -> Optional[int]:
+        """Claim a cooldown for the interaction's user if it is over. Returns 0
+        if claimed, else the seconds left, or None if the database couldn't
+        be reached (nothing is claimed then)."""
+        user_id = interaction.user.id
+        duration = self._duration_for(interaction, kind)
+        now = now_epoch()
+        left = user_cache.remaining(user_id, kind, duration, now)
+        if left:
+            return left
+
+        try:
+            # Waits out a full queue: only the database can claim atomically
+            # across processes, so there is no local fallback
+            claimed, row, expires = await storage.run(
+                claim_cooldown, self.settings, user_id, kind, duration, now, wait=True
+            )
+        except Exception as e:
+            print(f"Error claiming cooldown: {e}")
+            self.unavailable += 1
+            return None
+
+        user_cache.store_cooldowns(user_id, row, expires)
+        if claimed:
+            self.claims += 1
+            return 0
+        # Claimed by another process since this one cached the row
+        self.conflicts += 1
+        return max(user_cache.remaining(user_id, kind, duration, now), 1)
+
+    def remaining(self, interaction: discord.Interaction, kind: int) -> int:
+        """Seconds until the interaction's user can claim a cooldown again"""
+        return user_cache.remaining(
+            interaction.user.id, kind, self._duration_for(interaction, kind)
+        )
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "claims": self.claims,
+            "conflicts": self.conflicts,
+            "unavailable": self.unavailable,
+            "guilds_with_overrides": len(self._guilds),
+        }
+
+
+cooldown_engine = CooldownEngine()
+
+
+def cooldown_embed(left: int) -> discord.Embed:
+    return discord.Embed(
+        title="Error!",
+        description="You are currently on cooldown! You may use this command again "
+        f"after {format_remaining(left)}.",
+        color=get_random_color(),
+    )
+
+
+def unavailable_embed() -> discord.Embed:
+    return discord.Embed(
+        title="Error!",
+        description="Cooldowns can't be checked right now, please try again in "
+        "a moment.",
+        color=get_random_color(),
+    )
+
+
+def cooldown(kind: int, ephemeral: bool = False):
+    """Run a slash command only if its cooldown can be claimed, and claim it"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction: discord.Interaction, *args, **kwargs):
+            left = await cooldown_engine.try_claim(interaction, kind)
+            if left is None:
+                await interaction.response.send_message(
+                    embed=unavailable_embed(), ephemeral=True
+                )
+                return
+            if left:
+                await interaction.response.send_message(
+                    embed=cooldown_embed(left), ephemeral=ephemeral
+                )
+                return
+            return await func(interaction, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def refresh_cooldown_overrides(settings: str, guild_id: int):
+    """Refresh the given guild's cooldown overrides in database"""
+    guild = cooldown_engine.guild_overrides.get(guild_id)
+    roles = cooldown_engine.role_overrides.get(guild_id)
+    if guild or roles:
+        encoded = encode_cooldown_overrides(guild or {}, roles or {})
+        stage_write(settings, GUILDS_COLLECTION, guild_id, {"cooldowns": encoded})
+    else:
+        stage_write(settings, GUILDS_COLLECTION, guild_id, unset_fields=["cooldowns"])
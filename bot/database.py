@@ -0,0 +1,607 @@
+"""
+MongoDB schema and document helpers for Maxis
+
+Every user, guild and custom reply is stored in its own document so that a
+mutation only ever rewrites the keys that changed:
+
+- ``Users``:     ``{"_id": user_id, "balance": int, "items": {name: count}, "settings": {"dm": bool, "passive": bool}}``
+- ``Cooldowns``: ``{"_id": user_id, "t": [work, rob, daily, weekly, monthly], "expires": date}`` (epoch seconds, 0 if never claimed)
+- ``Guilds``:    ``{"_id": guild_id, "warns": {"<user_id>": {"id": int, "warns": int, "causes": [str]}},
+  "cooldowns": {"guild": {kind: seconds}, "roles": {"<role_id>": {kind: seconds}}}}``
+- ``Replies``:   ``{"_id": trigger, "reply": str}``
+- ``Ledger``:    ``{"_id": interaction_id, "kind": str, "users": [user_id], "amounts": [int], "closing": [int], "at": date}``
+  (one append-only event per balance change: the signed amount and closing balance of each user it moved)
+- ``LedgerCheckpoints``: ``{"_id": user_id, "balance": int, "events": int, "at": date}`` (ledger events folded by compaction)
+- ``LeaderboardHistory``: ``{"_id": "<board>:<day>", "board": guild_id (0: global), "day": int, "key": bool, "users": [user_id],
+  "balances": [int], "dropped": [user_id]}`` (a daily top-N, days since the epoch; keyframes hold every entry in rank order
+  with each balance stored as the difference to the one before, the other days only the balance changes since the day
+  before and the users who left)
+
+Every write also stamps an ``updated`` date so changes since a point in time
+can be fetched without scanning a whole collection. Cooldowns documents are
+deleted by a TTL index once ``expires`` (the end of their last cooldown) passes.
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.monitoring import ConnectionPoolListener
+
+from bot.objects.user_settings import UserSettings
+from bot.objects.warn import Warn
+
+DATABASE_NAME = "UnknownDatabase"
+LEGACY_COLLECTION = "UnknownCollection"
+USERS_COLLECTION = "Users"
+COOLDOWNS_COLLECTION = "Cooldowns"
+GUILDS_COLLECTION = "Guilds"
+REPLIES_COLLECTION = "Replies"
+LEDGER_COLLECTION = "Ledger"
+LEDGER_CHECKPOINTS_COLLECTION = "LedgerCheckpoints"
+LEADERBOARD_HISTORY_COLLECTION = "LeaderboardHistory"
+
+# Connection pool tuning (overridable through configure_pool)
+MAX_POOL_SIZE = 20
+MIN_POOL_SIZE = 2
+MAX_IDLE_TIME_MS = 300000
+WAIT_QUEUE_TIMEOUT_MS = 10000
+
+# Collections that are reconciled by their ``updated`` stamp on a warm start
+STAMPED_COLLECTIONS = (USERS_COLLECTION, COOLDOWNS_COLLECTION, GUILDS_COLLECTION)
+
+# Cooldown kinds in the order of a Cooldowns row (same as the legacy document names)
+COOLDOWN_FIELDS = ("work", "rob", "daily", "weekly", "monthly")
+
+# Every day divisible by this is a leaderboard history keyframe, so reading a
+# day never replays more than this many documents
+KEYFRAME_DAYS = 7
+
+
+class PoolStats(ConnectionPoolListener):
+    """Connection pool counters, fed by pymongo's pool monitoring events"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkout_started = threading.local()
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkins = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.pool_clears = 0
+
+    @property
+    def in_use(self) -> int:
+        return self.checkouts - self.checkins
+
+    @property
+    def open_connections(self) -> int:
+        return self.connections_created - self.connections_closed
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "in_use": self.in_use,
+                "open_connections": self.open_connections,
+                "avg_wait_ms": (
+                    self.total_wait_seconds / self.checkouts * 1000
+                    if self.checkouts
+                    else 0.0
+                ),
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "pool_clears": self.pool_clears,
+                "max_pool_size": MAX_POOL_SIZE,
+            }
+
+    def _record_wait(self) -> float:
+        started = getattr(self._checkout_started, "value", None)
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._checkout_started.value = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._record_wait()
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checkins += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+pool_stats = PoolStats()
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+
+def configure_pool(
+    max_pool_size: Optional[int] = None, min_pool_size: Optional[int] = None
+):
+    """Override the pool size limits (must be called before the first query)"""
+    global MAX_POOL_SIZE, MIN_POOL_SIZE
+    if max_pool_size is not None:
+        MAX_POOL_SIZE = max_pool_size
+    if min_pool_size is not None:
+        MIN_POOL_SIZE = min_pool_size
+
+
+def get_client(settings: str) -> MongoClient:
+    """Get the process-wide MongoDB client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    settings,
+                    maxPoolSize=MAX_POOL_SIZE,
+                    minPoolSize=MIN_POOL_SIZE,
+                    maxIdleTimeMS=MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+                    retryWrites=True,
+                    event_listeners=[pool_stats],
+                )
+    return _client
+
+
+def get_database(settings: str):
+    """Get the bot's database on the shared client"""
+    return get_client(settings)[DATABASE_NAME]
+
+
+def close_client():
+    """Close the shared client (it is recreated on next use)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def ensure_indexes(db):
+    """Create the indexes the bot's queries rely on (no-op if they exist)"""
+    for collection in STAMPED_COLLECTIONS:
+        db[collection].create_index("updated")
+    db[COOLDOWNS_COLLECTION].create_index("expires", expireAfterSeconds=0)
+    # A user's events by time (multikey: an event is indexed under each user)
+    db[LEDGER_COLLECTION].create_index([("users", 1), ("at", -1), ("_id", -1)])
+    db[LEDGER_COLLECTION].create_index("at")
+    # A board's snapshots by day, and every board's snapshots of a day
+    db[LEADERBOARD_HISTORY_COLLECTION].create_index([("board", 1), ("day", 1)])
+    db[LEADERBOARD_HISTORY_COLLECTION].create_index("day")
+
+
+def server_time(settings: str) -> datetime:
+    """Current time according to the database server"""
+    local_time = get_database(settings).command("hello")["localTime"]
+    return local_time.replace(tzinfo=timezone.utc)
+
+
+def encode_user_settings(user_settings: UserSettings) -> dict:
+    """Convert user settings into their stored form"""
+    return {
+        "dm": user_settings.bank_dm_enabled,
+        "passive": user_settings.bank_passive_enabled,
+    }
+
+
+def decode_user_settings(data: dict) -> UserSettings:
+    """Build user settings from their stored form"""
+    return UserSettings(
+        bank_dm_enabled=data["dm"] if "dm" in data else True,
+        bank_passive_enabled=data["passive"] if "passive" in data else False,
+    )
+
+
+def encode_cooldowns(row: List[int], expires: int) -> dict:
+    """Convert a user's cooldown row and its end time into their stored form"""
+    return {"t": list(row), "expires": datetime.fromtimestamp(expires, timezone.utc)}
+
+
+def decode_cooldowns(data: dict) -> Tuple[List[int], int]:
+    """Build a cooldown row and its end time (0 if unknown) from their stored
+    form (or the older per-kind dates)"""
+    expires = data.get("expires")
+    expires = int(expires.replace(tzinfo=timezone.utc).timestamp()) if expires else 0
+    if "t" in data:
+        return list(data["t"]), expires
+    row = []
+    for field in COOLDOWN_FIELDS:
+        value = data.get(field)
+        row.append(int(value.replace(tzinfo=timezone.utc).timestamp()) if value else 0)
+    return row, expires
+
+
+def claim_cooldown(
+    settings: str, user_id: int, kind: int, duration: int, now: int
+) -> Tuple[bool, List[int], int]:
+    """Claim a cooldown in one conditional update, so that processes sharing
+    the database can't both claim it.
+
+    Returns whether it was claimed, and the stored row and its end time.
+    """
+    collection = get_database(settings)[COOLDOWNS_COLLECTION]
+    ends_at = datetime.fromtimestamp(now + duration, timezone.utc)
+    row = {
+        "$map": {
+            "input": {"$range": [0, len(COOLDOWN_FIELDS)]},
+            "as": "kind",
+            "in": {
+                "$cond": [
+                    {"$eq": ["$$kind", kind]},
+                    now,
+                    {"$ifNull": [{"$arrayElemAt": ["$t", "$$kind"]}, 0]},
+                ]
+            },
+        }
+    }
+    try:
+        # No match (claimed too recently) makes the upsert collide on _id
+        doc = collection.find_one_and_update(
+            {"_id": user_id, f"t.{kind}": {"$not": {"$gt": now - duration}}},
+            [
+                {
+                    "$set": {
+                        "t": row,
+                        "expires": {
+                            "$max": [{"$ifNull": ["$expires", ends_at]}, ends_at]
+                        },
+                        "updated": "$$NOW",
+                    }
+                }
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return (True, *decode_cooldowns(doc))
+    except DuplicateKeyError:
+        doc = collection.find_one({"_id": user_id}) or {}
+        return (False, *decode_cooldowns(doc))
+
+
+def encode_cooldown_overrides(
+    guild: Dict[int, int], roles: Dict[int, Dict[int, int]]
+) -> dict:
+    """Convert a guild's cooldown lengths (by kind index) into their stored form"""
+    return {
+        "guild": {COOLDOWN_FIELDS[kind]: seconds for kind, seconds in guild.items()},
+        "roles": {
+            str(role_id): {
+                COOLDOWN_FIELDS[kind]: seconds for kind, seconds in lengths.items()
+            }
+            for role_id, lengths in roles.items()
+        },
+    }
+
+
+def decode_cooldown_overrides(
+    data: dict,
+) -> Tuple[Dict[int, int], Dict[int, Dict[int, int]]]:
+    """Build a guild's cooldown lengths and per-role lengths from their stored form"""
+
+    def lengths(stored: dict) -> Dict[int, int]:
+        return {
+            COOLDOWN_FIELDS.index(field): seconds
+            for field, seconds in (stored or {}).items()
+            if field in COOLDOWN_FIELDS
+        }
+
+    roles = {
+        int(role_id): lengths(stored)
+        for role_id, stored in (data.get("roles") or {}).items()
+    }
+    return lengths(data.get("guild")), roles
+
+
+def encode_ledger_event(
+    kind: str, changes: List[Tuple[int, int, int]], at: datetime
+) -> dict:
+    """Convert an economy event into its stored form. ``changes`` holds the
+    (user id, signed amount, closing balance) of each user it moved."""
+    return {
+        "kind": kind,
+        "users": [user_id for user_id, _, _ in changes],
+        "amounts": [amount for _, amount, _ in changes],
+        "closing": [closing for _, _, closing in changes],
+        "at": at,
+    }
+
+
+def find_ledger_page(
+    settings: str,
+    user_id: int,
+    cursor: Optional[Tuple[int, int]],
+    older: bool,
+    limit: int,
+) -> List[dict]:
+    """Up to ``limit`` of a user's ledger events past a keyset cursor, the
+    ``(at in epoch ms, _id)`` of an event: older ones newest first, or newer
+    ones oldest first. No cursor starts from the newest event."""
+    query: dict = {"users": user_id}
+    if cursor is not None:
+        at = datetime.fromtimestamp(cursor[0] / 1000, timezone.utc)
+        past = "$lt" if older else "$gt"
+        query["$or"] = [
+            {"at": {past: at}},
+            {"at": at, "_id": {past: cursor[1]}},
+        ]
+    direction = -1 if older else 1
+    events = get_database(settings)[LEDGER_COLLECTION].find(query, {"updated": 0})
+    return list(events.sort([("at", direction), ("_id", direction)]).limit(limit))
+
+
+def compact_ledger(db, before: datetime) -> int:
+    """Fold the ledger events older than ``before`` into one checkpoint per
+    user (their last closing balance and event count), then drop them.
+    Returns the number of events dropped."""
+    old = {"at": {"$lt": before}}
+    db[LEDGER_COLLECTION].aggregate(
+        [
+            {"$match": old},
+            {"$sort": {"at": 1}},
+            {
+                "$project": {
+                    "at": 1,
+                    "change": {"$zip": {"inputs": ["$users", "$closing"]}},
+                }
+            },
+            {"$unwind": "$change"},
+            {
+                "$group": {
+                    "_id": {"$arrayElemAt": ["$change", 0]},
+                    "balance": {"$last": {"$arrayElemAt": ["$change", 1]}},
+                    "events": {"$sum": 1},
+                    "at": {"$last": "$at"},
+                }
+            },
+            {
+                "$merge": {
+                    "into": LEDGER_CHECKPOINTS_COLLECTION,
+                    "whenMatched": [
+                        {
+                            "$set": {
+                                "balance": "$$new.balance",
+                                "events": {"$add": ["$events", "$$new.events"]},
+                                "at": "$$new.at",
+                            }
+                        }
+                    ],
+                    "whenNotMatched": "insert",
+                }
+            },
+        ]
+    )
+    return db[LEDGER_COLLECTION].delete_many(old).deleted_count
+
+
+def encode_leaderboard_snapshot(
+    board: int,
+    day: int,
+    ranking: List[Tuple[int, int]],
+    previous: Optional[List[Tuple[int, int]]],
+) -> dict:
+    """Convert a board's (user id, balance) ranking of a day into its stored
+    form: a delta against ``previous`` (the day before), or a keyframe if that
+    is None"""
+    doc = {"_id": f"{board}:{day}", "board": board, "day": day}
+    if previous is None:
+        balances = [balance for _, balance in ranking]
+        doc["key"] = True
+        doc["users"] = [user_id for user_id, _ in ranking]
+        doc["balances"] = balances[:1] + [
+            balance - before for before, balance in zip(balances, balances[1:])
+        ]
+        return doc
+
+    before = dict(previous)
+    changed = [
+        (user_id, balance - before.get(user_id, 0))
+        for user_id, balance in ranking
+        if before.get(user_id) != balance
+    ]
+    now = {user_id for user_id, _ in ranking}
+    doc["key"] = False
+    doc["users"] = [user_id for user_id, _ in changed]
+    doc["balances"] = [change for _, change in changed]
+    doc["dropped"] = [user_id for user_id in before if user_id not in now]
+    return doc
+
+
+def replay_leaderboard_history(
+    docs: Iterable[dict],
+) -> Iterator[Tuple[int, List[Tuple[int, int]]]]:
+    """Decode one board's snapshot documents, oldest first, into the (day,
+    ranking) of every day that can be rebuilt from a keyframe before it"""
+    balances: Optional[Dict[int, int]] = None
+    day = None
+    for doc in docs:
+        if doc["key"]:
+            balances = {}
+            running = 0
+            for user_id, difference in zip(doc["users"], doc["balances"]):
+                running += difference
+                balances[user_id] = running
+        elif balances is not None and doc["day"] == day + 1:
+            for user_id in doc.get("dropped") or ():
+                balances.pop(user_id, None)
+            for user_id, change in zip(doc["users"], doc["balances"]):
+                balances[user_id] = balances.get(user_id, 0) + change
+        else:
+            # A day is missing, nothing can be rebuilt until the next keyframe
+            balances = None
+        day = doc["day"]
+        if balances is not None:
+            yield day, sorted(balances.items(), key=lambda item: (-item[1], item[0]))
+
+
+def find_leaderboard_history(
+    settings: str, board: int, first: int, last: int
+) -> List[dict]:
+    """A board's snapshot documents needed to rebuild the days ``first`` to
+    ``last``, oldest first (one range scan of the ``board, day`` index)"""
+    query = {
+        "board": board,
+        "day": {"$gte": first - first % KEYFRAME_DAYS, "$lte": last},
+    }
+    docs = get_database(settings)[LEADERBOARD_HISTORY_COLLECTION].find(query)
+    return list(docs.sort("day", 1))
+
+
+def find_leaderboard_days(settings: str, first: int, last: int) -> List[dict]:
+    """Every board's snapshot documents of the days ``first`` to ``last``,
+    oldest first"""
+    query = {"day": {"$gte": first, "$lte": last}}
+    docs = get_database(settings)[LEADERBOARD_HISTORY_COLLECTION].find(query)
+    return list(docs.sort("day", 1))
+
+
+def write_leaderboard_snapshots(settings: str, docs: List[dict]):
+    """Store snapshot documents, replacing any of the same board and day"""
+    if docs:
+        get_database(settings)[LEADERBOARD_HISTORY_COLLECTION].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+            ordered=False,
+        )
+
+
+def prune_leaderboard_history(settings: str, before: int) -> int:
+    """Drop the snapshots of days before the keyframe at or before day
+    ``before``, so every day left can still be rebuilt. Returns the number of
+    documents dropped."""
+    before -= before % KEYFRAME_DAYS
+    collection = get_database(settings)[LEADERBOARD_HISTORY_COLLECTION]
+    return collection.delete_many({"day": {"$lt": before}}).deleted_count
+
+
+def encode_warn(warn: Warn) -> dict:
+    """Convert a warn into its stored form"""
+    return {"id": warn.user_id, "warns": warn.warns, "causes": list(warn.warn_causes)}
+
+
+def decode_warn(data: dict) -> Warn:
+    """Build a warn from its stored form"""
+    warn = Warn()
+    warn.user_id = data.get("id") or 0
+    warn.warns = data.get("warns") or 0
+    warn.warn_causes = data.get("causes") or []
+    return warn
+
+
+def _legacy_operations(doc: dict) -> Dict[str, List[UpdateOne]]:
+    """Translate one legacy whole-map document into per-key upserts"""
+    doc_name = doc["name"]
+    keys = doc.get("key") or []
+    vals = doc.get("val") or []
+    ops: Dict[str, List[UpdateOne]] = {}
+
+    def add(collection: str, _id, update: dict):
+        ops.setdefault(collection, []).append(
+            UpdateOne({"_id": _id}, update, upsert=True)
+        )
+
+    for i in range(len(keys)):
+        key, val = keys[i], vals[i]
+        if doc_name == "reply":
+            add(REPLIES_COLLECTION, key, {"$set": {"reply": val}})
+        elif doc_name == "balance":
+            add(USERS_COLLECTION, key, {"$set": {"balance": val}})
+        elif doc_name == "usersettings":
+            add(USERS_COLLECTION, key, {"$set": {"settings": val or {}}})
+        elif doc_name == "item":
+            val = val or {}
+            item_keys = val.get("key") or []
+            item_vals = val.get("val") or []
+            items = {item_keys[j]: item_vals[j] for j in range(len(item_keys))}
+            add(USERS_COLLECTION, key, {"$set": {"items": items}})
+        elif doc_name in COOLDOWN_FIELDS:
+            add(COOLDOWNS_COLLECTION, key, {"$set": {doc_name: val}})
+        elif doc_name == "warn":
+            val = val or {}
+            user_keys = val.get("key") or []
+            user_vals = val.get("val") or []
+            warns = {str(user_keys[j]): user_vals[j] for j in range(len(user_keys))}
+            add(GUILDS_COLLECTION, key, {"$set": {"warns": warns}})
+    return ops
+
+
+def migrate_cooldown_documents(db, longest_cooldown: int) -> int:
+    """Rewrite per-kind cooldown dates into compact rows, on the server.
+
+    Documents without an end time get the latest claim plus the longest
+    cooldown, so the TTL index can remove them. Returns the number of
+    rewritten documents.
+    """
+    row = [
+        {
+            "$ifNull": [
+                {"$toLong": {"$divide": [{"$toLong": f"${field}"}, 1000]}},
+                0,
+            ]
+        }
+        for field in COOLDOWN_FIELDS
+    ]
+    ends_at = {"$add": [{"$max": "$t"}, longest_cooldown]}
+    result = db[COOLDOWNS_COLLECTION].update_many(
+        {"expires": {"$exists": False}},
+        [
+            {"$set": {"t": {"$ifNull": ["$t", row]}, "updated": "$$NOW"}},
+            {"$set": {"expires": {"$toDate": {"$multiply": [ends_at, 1000]}}}},
+            {"$unset": list(COOLDOWN_FIELDS)},
+        ],
+    )
+    return result.modified_count
+
+
+def migrate_legacy_documents(db) -> int:
+    """Split the old single-document maps into per-key documents.
+
+    Migrated legacy documents are flagged rather than deleted, so they are kept
+    as a backup but never applied twice. Returns the number of migrated maps.
+    """
+    legacy = db[LEGACY_COLLECTION]
+    migrated = 0
+    for doc in legacy.find({"migrated": {"$ne": True}}):
+        for collection, operations in _legacy_operations(doc).items():
+            db[collection].bulk_write(operations, ordered=False)
+        legacy.update_one({"_id": doc["_id"]}, {"$set": {"migrated": True}})
+        migrated += 1
+    return migrated
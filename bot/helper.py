@@ -3,31 +3,59 @@ Helper utility functions for Maxis
 """
 
 import random
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Tuple
 from enum import Enum
 
 import discord
-import pymongo
 
+from bot.database import (
+    USERS_COLLECTION,
+    COOLDOWNS_COLLECTION,
+    GUILDS_COLLECTION,
+    LEDGER_COLLECTION,
+    REPLIES_COLLECTION,
+    encode_ledger_event,
+    encode_user_settings,
+    encode_warn,
+)
+from bot.objects.balance_index import BalanceIndex
+from bot.objects.balance_store import BalanceStore
+from bot.objects.top_balances import TopBalances
+
+# Cooldown lengths are defined next to the cooldown table
+from bot.objects.cooldowns import (
+    BASIC_COOLDOWN,
+    DAILY_COOLDOWN,
+    MONTHLY_COOLDOWN,
+    WEEKLY_COOLDOWN,
+)
+from bot.objects.guild_rankings import guild_rankings
+from bot.objects.reply_matcher import CustomReplies
+from bot.objects.user_cache import user_cache
+from bot.objects.user_locks import user_locks
 from bot.objects.user_settings import UserSettings
 from bot.objects.warn import Warn
+from bot.persistence import flusher
 
 # Constants
 VERSION = "5.0.0"
-BASIC_COOLDOWN = 30
-DAILY_COOLDOWN = 86400
-WEEKLY_COOLDOWN = 604800
-MONTHLY_COOLDOWN = 2592000
 
 # Paths
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 RESOURCES_DIR = PROJECT_ROOT / "resources"
 
 # Maps (will be initialized from database)
-custom_replies: Dict[str, str] = {}
-balance_map: Dict[int, int] = {}
+custom_replies = CustomReplies()
+balance_map = BalanceStore()
+# Highest balances, updated whenever a balance is written
+top_balances = TopBalances(balance_map)
+balance_index = BalanceIndex()
+# Outcome of recent transfers by idempotency key, so a retry is not applied twice
+recent_transfers: "OrderedDict[int, Optional[Tuple[int, int]]]" = OrderedDict()
+MAX_RECENT_TRANSFERS = 10000
 warn_map: Dict[int, Dict[int, Warn]] = {}
 
 # Work messages
@@ -111,267 +139,205 @@ def get_random_work() -> str:
     return random.choice(WORKS)
 
 
-def refresh_replies(settings: str):
-    """Refresh custom replies in database"""
-
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
-
-            doc = {
-                "name": "reply",
-                "key": list(custom_replies.keys()),
-                "val": list(custom_replies.values()),
-            }
-
-            if collection.count_documents({"name": "reply"}) > 0:
-                collection.replace_one({"name": "reply"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing replies: {e}")
-
-    import threading
-
-    threading.Thread(target=refresh, daemon=True).start()
-
-
-def refresh_user_settings(settings: str, user_settings_map: Dict[int, UserSettings]):
-    """Refresh user settings in database"""
-
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
-
-            settings_list = []
-            for user_settings in user_settings_map.values():
-                settings_list.append(
-                    {
-                        "dm": user_settings.bank_dm_enabled,
-                        "passive": user_settings.bank_passive_enabled,
-                    }
-                )
-
-            doc = {
-                "name": "usersettings",
-                "key": list(user_settings_map.keys()),
-                "val": settings_list,
-            }
-
-            if collection.count_documents({"name": "usersettings"}) > 0:
-                collection.replace_one({"name": "usersettings"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing user settings: {e}")
-
-    import threading
-
-    threading.Thread(target=refresh, daemon=True).start()
-
-
-def refresh_balances(settings: str):
-    """Refresh balances in database"""
-
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
-
-            doc = {
-                "name": "balance",
-                "key": list(balance_map.keys()),
-                "val": list(balance_map.values()),
-            }
-
-            if collection.count_documents({"name": "balance"}) > 0:
-                collection.replace_one({"name": "balance"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing balances: {e}")
-
-    import threading
-
-    threading.Thread(target=refresh, daemon=True).start()
-
-
-def refresh_works(settings: str, user_worked_times: Dict[int, datetime]):
-    """Refresh work times in database"""
-
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
-
-            dates = [dt for dt in user_worked_times.values()]
-            doc = {"name": "work", "key": list(user_worked_times.keys()), "val": dates}
-
-            if collection.count_documents({"name": "work"}) > 0:
-                collection.replace_one({"name": "work"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing works: {e}")
-
-    import threading
-
-    threading.Thread(target=refresh, daemon=True).start()
-
-
-def refresh_robs(settings: str, user_robbed_times: Dict[int, datetime]):
-    """Refresh rob times in database"""
-
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
-
-            dates = [dt for dt in user_robbed_times.values()]
-            doc = {"name": "rob", "key": list(user_robbed_times.keys()), "val": dates}
-
-            if collection.count_documents({"name": "rob"}) > 0:
-                collection.replace_one({"name": "rob"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing robs: {e}")
-
-    import threading
-
-    threading.Thread(target=refresh, daemon=True).start()
-
-
-def refresh_dailies(settings: str, user_daily_times: Dict[int, datetime]):
-    """Refresh daily times in database"""
-
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
-
-            dates = [dt for dt in user_daily_times.values()]
-            doc = {"name": "daily", "key": list(user_daily_times.keys()), "val": dates}
-
-            if collection.count_documents({"name": "daily"}) > 0:
-                collection.replace_one({"name": "daily"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing dailies: {e}")
-
-    import threading
-
-    threading.Thread(target=refresh, daemon=True).start()
-
-
-def refresh_weeklies(settings: str, user_weekly_times: Dict[int, datetime]):
-    """Refresh weekly times in database"""
-
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
-
-            dates = [dt for dt in user_weekly_times.values()]
-            doc = {
-                "name": "weekly",
-                "key": list(user_weekly_times.keys()),
-                "val": dates,
-            }
-
-            if collection.count_documents({"name": "weekly"}) > 0:
-                collection.replace_one({"name": "weekly"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing weeklies: {e}")
-
-    import threading
+def stage_write(
+    settings: str,
+    collection: str,
+    _id,
+    set_fields: Optional[dict] = None,
+    unset_fields: Iterable[str] = (),
+    delete: bool = False,
+):
+    """Queue changes of one document for the write-behind flusher"""
+    if flusher.settings is None:
+        flusher.settings = settings
+    flusher.stage(collection, _id, set_fields, unset_fields, delete)
+
+
+def refresh_replies(settings: str, *triggers: str):
+    """Refresh the given custom replies in database"""
+    for trigger in triggers:
+        if trigger in custom_replies:
+            stage_write(
+                settings,
+                REPLIES_COLLECTION,
+                trigger,
+                {"reply": custom_replies[trigger]},
+            )
+        else:
+            stage_write(settings, REPLIES_COLLECTION, trigger, delete=True)
+
+
+def refresh_user_settings(
+    settings: str, user_settings_map: Dict[int, UserSettings], *user_ids: int
+):
+    """Refresh the given users' settings in database"""
+    for user_id in user_ids:
+        if user_id in user_settings_map:
+            stage_write(
+                settings,
+                USERS_COLLECTION,
+                user_id,
+                {"settings": encode_user_settings(user_settings_map[user_id])},
+            )
 
-    threading.Thread(target=refresh, daemon=True).start()
 
+def index_balance(user_id: int, old: Optional[int], new: int):
+    """Update the rankings after a user's balance changed (``old`` is None for
+    a new account)"""
+    top_balances.update(user_id, new)
+    guild_rankings.update(user_id, new)
+    balance_index.update(old, new)
 
-def refresh_monthlies(settings: str, user_monthly_times: Dict[int, datetime]):
-    """Refresh monthly times in database"""
 
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
+def global_standing(balance: int) -> Tuple[int, int, float]:
+    """Rank, number of users and percentile of a balance among all users"""
+    if not balance_index.ready:
+        # Built at boot (see init_data), this only happens outside the bot
+        balance_index.build(balance_map.columns()[1])
+    return (
+        balance_index.rank(balance),
+        len(balance_index),
+        balance_index.percentile(balance),
+    )
 
-            dates = [dt for dt in user_monthly_times.values()]
-            doc = {
-                "name": "monthly",
-                "key": list(user_monthly_times.keys()),
-                "val": dates,
-            }
 
-            if collection.count_documents({"name": "monthly"}) > 0:
-                collection.replace_one({"name": "monthly"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing monthlies: {e}")
+def refresh_balances(settings: str, *user_ids: int):
+    """Refresh the given users' balances in database"""
+    for user_id in user_ids:
+        if user_id in balance_map:
+            stage_write(
+                settings, USERS_COLLECTION, user_id, {"balance": balance_map[user_id]}
+            )
 
-    import threading
 
-    threading.Thread(target=refresh, daemon=True).start()
+def open_account(settings: str, user_id: int) -> int:
+    """A user's balance, starting them at 0 if they have none yet"""
+    if user_id not in balance_map:
+        balance_map[user_id] = 0
+        index_balance(user_id, None, 0)
+        refresh_balances(settings, user_id)
+    return balance_map[user_id]
+
+
+def stage_balance_event(
+    settings: str, key: int, kind: str, changes: List[Tuple[int, int, int]]
+):
+    """Queue new balances together with the ledger event that explains them.
+    ``changes`` holds the (user id, signed amount, closing balance) of each
+    user; everything is staged (and journaled) as one unit."""
+    if flusher.settings is None:
+        flusher.settings = settings
+    for user_id, amount, closing in changes:
+        index_balance(user_id, closing - amount, closing)
+    # Stored with millisecond precision, so truncate now to page through it
+    at = datetime.now(timezone.utc)
+    at = at.replace(microsecond=at.microsecond // 1000 * 1000)
+    flusher.stage_many(
+        [
+            (USERS_COLLECTION, user_id, {"balance": closing}, (), False)
+            for user_id, _, closing in changes
+        ]
+        + [
+            (
+                LEDGER_COLLECTION,
+                key,
+                encode_ledger_event(kind, changes, at),
+                (),
+                False,
+            )
+        ]
+    )
 
 
-def refresh_warns(settings: str):
-    """Refresh warns in database"""
+def transfer_balance(
+    settings: str,
+    key: int,
+    from_id: int,
+    to_id: int,
+    amount: int,
+    kind: str,
+) -> Optional[Tuple[int, int]]:
+    """Move money between two users as one unit.
+
+    Both balances change without yielding to other coroutines, and both
+    balance writes plus a ledger entry are staged (and journaled) together,
+    so a crash can't apply only one side. ``key`` (the interaction id) makes
+    retries safe: a key that was seen before returns its first outcome
+    without moving money again. Returns the closing balances of the sender
+    and the receiver, or None if the sender can't afford it.
+    """
+    if key in recent_transfers:
+        return recent_transfers[key]
+
+    from_balance = balance_map.get(from_id, 0)
+    result = None
+    if 0 < amount <= from_balance:
+        result = (from_balance - amount, open_account(settings, to_id) + amount)
+        balance_map[from_id], balance_map[to_id] = result
+        stage_balance_event(
+            settings,
+            key,
+            kind,
+            [(from_id, -amount, result[0]), (to_id, amount, result[1])],
+        )
 
-    def refresh():
-        try:
-            client = pymongo.MongoClient(settings)
-            db = client["UnknownDatabase"]
-            collection = db["UnknownCollection"]
+    recent_transfers[key] = result
+    if len(recent_transfers) > MAX_RECENT_TRANSFERS:
+        recent_transfers.popitem(last=False)
+    return result
 
-            docs = []
-            for map_val in warn_map.values():
-                warns = []
-                for warn in map_val.values():
-                    warns.append(
-                        {
-                            "id": warn.user_id,
-                            "warns": warn.warns,
-                            "causes": warn.warn_causes,
-                        }
-                    )
-                docs.append({"key": list(map_val.keys()), "val": warns})
-
-            doc = {"name": "warn", "key": list(warn_map.keys()), "val": docs}
 
-            if collection.count_documents({"name": "warn"}) > 0:
-                collection.replace_one({"name": "warn"}, doc)
-            else:
-                collection.insert_one(doc)
-            client.close()
-        except Exception as e:
-            print(f"Error refreshing warns: {e}")
+async def notify_balance_change(
+    user: discord.abc.User,
+    user_settings_map: Dict[int, UserSettings],
+    old_bal: int,
+    new_bal: int,
+):
+    """DM a user the details of a balance change, if they enabled it"""
+    if (
+        user.id not in user_settings_map
+        or not user_settings_map[user.id].bank_dm_enabled
+    ):
+        return
+    try:
+        embed = discord.Embed(
+            title="Successfully updated account! Details:-",
+            color=get_random_color(),
+        )
+        embed.add_field(name="Opening Balance", value=f":coin: {old_bal}")
+        if new_bal >= old_bal:
+            embed.add_field(name="Deposited", value=f":coin: {new_bal - old_bal}")
+        else:
+            embed.add_field(name="Withdrawn", value=f":coin: {old_bal - new_bal}")
+        embed.add_field(name="Closing Balance", value=f":coin: {new_bal}")
+        await user.send(embed=embed)
+    except Exception as e:
+        print(f"Error sending DM: {e}")
+
+
+def refresh_cooldown_times(settings: str, user_id: int, *kinds: int):
+    """Refresh only the given claim times of a user's cooldowns in database"""
+    row = user_cache.cooldown_row(user_id)
+    stage_write(
+        settings,
+        COOLDOWNS_COLLECTION,
+        user_id,
+        {f"t.{kind}": row[kind] for kind in kinds},
+    )
 
-    import threading
 
-    threading.Thread(target=refresh, daemon=True).start()
+def refresh_warns(settings: str, server_id: int, *user_ids: int):
+    """Refresh the given users' warns of one server in database"""
+    server_warns = warn_map.get(server_id, {})
+    fields_set = {}
+    fields_unset = []
+    for user_id in user_ids:
+        if user_id in server_warns:
+            fields_set[f"warns.{user_id}"] = encode_warn(server_warns[user_id])
+        else:
+            fields_unset.append(f"warns.{user_id}")
+    if fields_set or fields_unset:
+        stage_write(settings, GUILDS_COLLECTION, server_id, fields_set, fields_unset)
 
 
 async def credit_balance(
@@ -380,43 +346,18 @@ async def credit_balance(
     settings: str,
     user_settings_map: Dict[int, UserSettings],
     balance_map: Dict[int, int],
+    kind: str = "credit",
 ) -> bool:
     """Credit balance to user's account"""
-    if interaction.user.id not in balance_map:
-        balance_map[interaction.user.id] = 0
-        refresh_balances(settings)
-
-    old_bal = balance_map[interaction.user.id]
-    if credit_amount > 0:
-        new_bal = old_bal + credit_amount
-        balance_map[interaction.user.id] = new_bal
-
-        if (
-            interaction.user.id in user_settings_map
-            and user_settings_map[interaction.user.id].bank_dm_enabled
-        ):
-            try:
-                embed = discord.Embed(
-                    title="Successfully updated account! Details:-",
-                    color=get_random_color(),
-                )
-                embed.add_field(name="Opening Balance", value=f":coin: {old_bal}")
-                embed.add_field(name="Deposited", value=f":coin: {credit_amount}")
-                embed.add_field(name="Closing Balance", value=f":coin: {new_bal}")
-                await interaction.user.send(embed=embed)
-            except Exception as e:
-                print(f"Error sending DM: {e}")
-
-        refresh_balances(settings)
-        return True
-    else:
-        embed = discord.Embed(
-            title="Error!",
-            description="Value should be more than 0.",
-            color=get_random_color(),
-        )
-        await interaction.response.send_message(embed=embed)
-    return False
+    return await credit_balance_for_different_user(
+        credit_amount,
+        interaction.user,
+        interaction,
+        settings,
+        user_settings_map,
+        balance_map,
+        kind,
+    )
 
 
 async def credit_balance_for_different_user(
@@ -426,99 +367,88 @@ async def credit_balance_for_different_user(
     settings: str,
     user_settings_map: Dict[int, UserSettings],
     balance_map: Dict[int, int],
+    kind: str = "credit",
 ) -> bool:
     """Credit balance to user's account"""
-    if user.id not in balance_map:
-        balance_map[user.id] = 0
-        refresh_balances(settings)
+    async with user_locks.hold(user.id):
+        old_bal = open_account(settings, user.id)
+        if credit_amount > 0:
+            new_bal = old_bal + credit_amount
+            balance_map[user.id] = new_bal
+            stage_balance_event(
+                settings, interaction.id, kind, [(user.id, credit_amount, new_bal)]
+            )
 
-    old_bal = balance_map[user.id]
     if credit_amount > 0:
-        new_bal = old_bal + credit_amount
-        balance_map[user.id] = new_bal
-
-        if user.id in user_settings_map and user_settings_map[user.id].bank_dm_enabled:
-            try:
-                embed = discord.Embed(
-                    title="Successfully updated account! Details:-",
-                    color=get_random_color(),
-                )
-                embed.add_field(name="Opening Balance", value=f":coin: {old_bal}")
-                embed.add_field(name="Deposited", value=f":coin: {credit_amount}")
-                embed.add_field(name="Closing Balance", value=f":coin: {new_bal}")
-                await user.send(embed=embed)
-            except Exception as e:
-                print(f"Error sending DM: {e}")
-
-        refresh_balances(settings)
+        await notify_balance_change(user, user_settings_map, old_bal, new_bal)
         return True
-    else:
-        embed = discord.Embed(
-            title="Error!",
-            description="Value should be more than 0.",
-            color=get_random_color(),
-        )
-        await interaction.response.send_message(embed=embed)
+    embed = discord.Embed(
+        title="Error!",
+        description="Value should be more than 0.",
+        color=get_random_color(),
+    )
+    await interaction.response.send_message(embed=embed)
     return False
 
 
+async def _debit(
+    debit_amount: int,
+    user: discord.abc.User,
+    interaction: discord.Interaction,
+    settings: str,
+    user_settings_map: Dict[int, UserSettings],
+    balance_map: Dict[int, int],
+    kind: str,
+) -> Optional[int]:
+    """Debit balance under the user's lock. Returns the balance it had if it
+    was debited, else None."""
+    async with user_locks.hold(user.id):
+        old_bal = open_account(settings, user.id)
+        if not 0 < debit_amount <= old_bal:
+            return None
+        new_bal = old_bal - debit_amount
+        balance_map[user.id] = new_bal
+        stage_balance_event(
+            settings, interaction.id, kind, [(user.id, -debit_amount, new_bal)]
+        )
+
+    await notify_balance_change(user, user_settings_map, old_bal, new_bal)
+    return old_bal
+
+
 async def debit_balance(
     debit_amount: int,
     interaction: discord.Interaction,
     settings: str,
     user_settings_map: Dict[int, UserSettings],
     balance_map: Dict[int, int],
+    kind: str = "debit",
 ) -> bool:
     """Debit balance from user's account"""
-    if interaction.user.id not in balance_map:
-        balance_map[interaction.user.id] = 0
-        refresh_balances(settings)
-
-    old_bal = balance_map[interaction.user.id]
-    if debit_amount > 0:
-        if debit_amount <= old_bal:
-            new_bal = old_bal - debit_amount
-            balance_map[interaction.user.id] = new_bal
-
-            if (
-                interaction.user.id in user_settings_map
-                and user_settings_map[interaction.user.id].bank_dm_enabled
-            ):
-                try:
-                    embed = discord.Embed(
-                        title="Successfully updated account! Details:-",
-                        color=get_random_color(),
-                    )
-                    embed.add_field(name="Opening Balance", value=f":coin: {old_bal}")
-                    embed.add_field(name="Withdrawn", value=f":coin: {debit_amount}")
-                    embed.add_field(name="Closing Balance", value=f":coin: {new_bal}")
-                    await interaction.user.send(embed=embed)
-                except Exception as e:
-                    print(f"Error sending DM: {e}")
-
-            refresh_balances(settings)
-            return True
-        elif old_bal == 0:
-            embed = discord.Embed(
-                title="Error!",
-                description="You can't withdraw, because you have no money!",
-                color=get_random_color(),
-            )
-            await interaction.response.send_message(embed=embed)
-        else:
-            embed = discord.Embed(
-                title="Error!",
-                description="You can't withdraw more than you have in your bank!",
-                color=get_random_color(),
-            )
-            await interaction.response.send_message(embed=embed)
-    else:
-        embed = discord.Embed(
-            title="Error!",
-            description="Value should be more than 0.",
-            color=get_random_color(),
+    if (
+        await _debit(
+            debit_amount,
+            interaction.user,
+            interaction,
+            settings,
+            user_settings_map,
+            balance_map,
+            kind,
         )
-        await interaction.response.send_message(embed=embed)
+        is not None
+    ):
+        return True
+
+    if debit_amount <= 0:
+        description = "Value should be more than 0."
+    elif balance_map[interaction.user.id] == 0:
+        description = "You can't withdraw, because you have no money!"
+    else:
+        description = "You can't withdraw more than you have in your bank!"
+    embed = discord.Embed(
+        title="Error!", description=description, color=get_random_color()
+    )
+    await interaction.response.send_message(embed=embed)
     return False
 
 
@@ -529,55 +459,31 @@ async def debit_balance_for_different_user(
     settings: str,
     user_settings_map: Dict[int, UserSettings],
     balance_map: Dict[int, int],
+    kind: str = "debit",
 ) -> bool:
     """Debit balance from user's account"""
-    if user.id not in balance_map:
-        balance_map[user.id] = 0
-        refresh_balances(settings)
-
-    old_bal = balance_map[user.id]
-    if debit_amount > 0:
-        if debit_amount <= old_bal:
-            new_bal = old_bal - debit_amount
-            balance_map[user.id] = new_bal
+    if (
+        await _debit(
+            debit_amount,
+            user,
+            interaction,
+            settings,
+            user_settings_map,
+            balance_map,
+            kind,
+        )
+        is not None
+    ):
+        return True
 
-            if (
-                user.id in user_settings_map
-                and user_settings_map[user.id].bank_dm_enabled
-            ):
-                try:
-                    embed = discord.Embed(
-                        title="Successfully updated account! Details:-",
-                        color=get_random_color(),
-                    )
-                    embed.add_field(name="Opening Balance", value=f":coin: {old_bal}")
-                    embed.add_field(name="Withdrawn", value=f":coin: {debit_amount}")
-                    embed.add_field(name="Closing Balance", value=f":coin: {new_bal}")
-                    await user.send(embed=embed)
-                except Exception as e:
-                    print(f"Error sending DM: {e}")
-
-            refresh_balances(settings)
-            return True
-        elif old_bal == 0:
-            embed = discord.Embed(
-                title="Error!",
-                description="He can't withdraw, because he has no money!",
-                color=get_random_color(),
-            )
-            await interaction.response.send_message(embed=embed)
-        else:
-            embed = discord.Embed(
-                title="Error!",
-                description="He can't withdraw more than he has in his bank!",
-                color=get_random_color(),
-            )
-            await interaction.response.send_message(embed=embed)
+    if debit_amount <= 0:
+        description = "Value should be more than 0."
+    elif balance_map[user.id] == 0:
+        description = "He can't withdraw, because he has no money!"
     else:
-        embed = discord.Embed(
-            title="Error!",
-            description="Value should be more than 0.",
-            color=get_random_color(),
-        )
-        await interaction.response.send_message(embed=embed)
+        description = "He can't withdraw more than he has in his bank!"
+    embed = discord.Embed(
+        title="Error!", description=description, color=get_random_color()
+    )
+    await interaction.response.send_message(embed=embed)
     return False
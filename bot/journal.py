@@ -0,0 +1,218 @@
+"""
+Local write-ahead journal for Maxis
+
+Every document change staged for the database is appended here first, so
+changes that have not reached MongoDB yet survive a crash or a database
+outage. Records are BSON documents written back to back into numbered
+segment files. A segment is deleted once every change in it has been
+confirmed by MongoDB.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import bson
+from bson.errors import InvalidBSON
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".bson"
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 0.2
+
+
+class JournalRecord:
+    """One staged document change read back from the journal"""
+
+    __slots__ = ("seq", "collection", "_id", "set_fields", "unset_fields", "delete")
+
+    def __init__(
+        self,
+        seq: int,
+        collection: str,
+        _id,
+        set_fields: Dict[str, Any],
+        unset_fields: List[str],
+        delete: bool,
+    ):
+        self.seq = seq
+        self.collection = collection
+        self._id = _id
+        self.set_fields = set_fields
+        self.unset_fields = unset_fields
+        self.delete = delete
+
+
+class Journal:
+    """Append-only, segment-rotated journal of staged document changes"""
+
+    def __init__(
+        self,
+        directory: Path,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+    ):
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.last_seq = 0
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._segment_number = 0
+        self._segment_bytes = 0
+        self._segment_last_seq = 0
+        # Closed segments: (number, last seq in it)
+        self._closed: List[Tuple[int, int]] = []
+        self._unsynced = False
+        self.appended = 0
+        self.syncs = 0
+        self.last_sync_time = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self._fd is not None
+
+    def _segment_path(self, number: int) -> Path:
+        return self.directory / f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"
+
+    def _segment_numbers(self) -> List[int]:
+        numbers = []
+        for path in self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"):
+            try:
+                numbers.append(int(path.stem[len(SEGMENT_PREFIX) :]))
+            except ValueError:
+                continue
+        return sorted(numbers)
+
+    def _read_segment(self, number: int) -> Iterator[JournalRecord]:
+        path = self._segment_path(number)
+        with open(path, "rb") as f:
+            try:
+                for doc in bson.decode_file_iter(f):
+                    yield JournalRecord(
+                        doc["s"],
+                        doc["c"],
+                        doc["i"],
+                        {field: value for field, value in doc.get("set", [])},
+                        list(doc.get("unset", [])),
+                        doc.get("d", False),
+                    )
+            except InvalidBSON:
+                # A torn write at the end of the last segment before a crash
+                print(f"Journal segment {path.name} ends with a partial record")
+
+    def open(self) -> List[JournalRecord]:
+        """Open the journal and return the records not yet confirmed"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        records = []
+        with self._lock:
+            self._closed = []
+            for number in self._segment_numbers():
+                segment_last_seq = 0
+                for record in self._read_segment(number):
+                    records.append(record)
+                    segment_last_seq = record.seq
+                    self.last_seq = max(self.last_seq, record.seq)
+                self._closed.append((number, segment_last_seq))
+                self._segment_number = number
+            self._open_segment(self._segment_number + 1)
+        return records
+
+    def _open_segment(self, number: int):
+        """Start a new segment file (caller holds the lock)"""
+        self._segment_number = number
+        self._segment_bytes = 0
+        self._segment_last_seq = 0
+        self._fd = os.open(
+            self._segment_path(number), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600
+        )
+
+    def _rotate(self):
+        """Close the active segment and open the next one (caller holds the lock)"""
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._closed.append((self._segment_number, self._segment_last_seq))
+        self._open_segment(self._segment_number + 1)
+
+    def append(
+        self,
+        collection: str,
+        _id,
+        set_fields: Dict[str, Any],
+        unset_fields: Iterable[str],
+        delete: bool,
+    ) -> int:
+        """Write one change to the journal and return its sequence number"""
+        with self._lock:
+            self.last_seq += 1
+            data = bson.encode(
+                {
+                    "s": self.last_seq,
+                    "c": collection,
+                    "i": _id,
+                    "set": [[field, value] for field, value in set_fields.items()],
+                    "unset": list(unset_fields),
+                    "d": delete,
+                }
+            )
+            os.write(self._fd, data)
+            self._segment_bytes += len(data)
+            self._segment_last_seq = self.last_seq
+            self._unsynced = True
+            self.appended += 1
+            if self._segment_bytes >= self.segment_size:
+                self._rotate()
+            return self.last_seq
+
+    def sync(self):
+        """Flush appended records to disk (batched by the caller's interval)"""
+        with self._lock:
+            if not self._unsynced or self._fd is None:
+                return
+            os.fsync(self._fd)
+            self._unsynced = False
+            self.syncs += 1
+            self.last_sync_time = time.time()
+
+    def checkpoint(self, seq: int):
+        """Drop every segment whose changes up to ``seq`` are in the database"""
+        with self._lock:
+            if self._fd is None:
+                return
+            if self._segment_last_seq and self._segment_last_seq <= seq:
+                self._rotate()
+            remaining = []
+            for number, last_seq in self._closed:
+                if last_seq <= seq:
+                    try:
+                        self._segment_path(number).unlink()
+                    except FileNotFoundError:
+                        pass
+                else:
+                    remaining.append((number, last_seq))
+            self._closed = remaining
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "last_seq": self.last_seq,
+            "appended": self.appended,
+            "syncs": self.syncs,
+            "segments": len(self._closed) + (1 if self._fd is not None else 0),
+        }
+
+    def close(self):
+        """Sync and close the active segment"""
+        with self._lock:
+            if self._fd is None:
+                return
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            if self._segment_last_seq == 0:
+                # Nothing was written to it
+                self._segment_path(self._segment_number).unlink(missing_ok=True)
+            else:
+                self._closed.append((self._segment_number, self._segment_last_seq))
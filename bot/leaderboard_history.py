@@ -0,0 +1,237 @@
+"""
+Leaderboard history for Maxis
+
+Once a day the global top balances and the top of every guild's ranking are
+recorded, so ``/leaderboard history`` and ``/rank`` can show how ranks moved
+and the web server can serve long-term rich lists. Each snapshot only stores
+what changed since the day before, with a full keyframe once a week (see the
+``LeaderboardHistory`` schema in ``bot.database``).
+
+A day is rebuilt from the ``board, day`` index by replaying at most a week
+of documents, never the whole history, and rebuilt days are cached.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import discord
+
+from bot.database import (
+    KEYFRAME_DAYS,
+    encode_leaderboard_snapshot,
+    find_leaderboard_days,
+    find_leaderboard_history,
+    prune_leaderboard_history,
+    replay_leaderboard_history,
+    write_leaderboard_snapshots,
+)
+from bot.helper import balance_map, top_balances
+from bot.objects.guild_rankings import guild_rankings
+from bot.persistence import storage
+
+GLOBAL_BOARD = 0
+GLOBAL_SIZE = 100
+GUILD_SIZE = 25
+CACHE_SIZE = 5000
+
+EPOCH = date(1970, 1, 1)
+
+
+def day_number(moment: datetime) -> int:
+    """Days since the epoch of a (UTC) moment"""
+    return (moment.astimezone(timezone.utc).date() - EPOCH).days
+
+
+def today() -> int:
+    return day_number(datetime.now(timezone.utc))
+
+
+def day_date(day: int) -> date:
+    return EPOCH + timedelta(days=day)
+
+
+def movement(before: Optional[int], now: Optional[int]) -> str:
+    """How a rank changed, e.g. ``up 3``"""
+    if before is None:
+        return "new"
+    if now is None:
+        return "gone"
+    if before == now:
+        return "no change"
+    return f"up {before - now}" if now < before else f"down {now - before}"
+
+
+class HistoricRanking:
+    """A board's top users on one day, highest first"""
+
+    __slots__ = ("entries", "_positions")
+
+    def __init__(self, entries: List[Tuple[int, int]]):
+        self.entries = entries
+        self._positions = {user_id: i for i, (user_id, _) in enumerate(entries)}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based position of a user, or None if they weren't on the board"""
+        position = self._positions.get(user_id)
+        return position + 1 if position is not None else None
+
+    def balance(self, user_id: int) -> Optional[int]:
+        position = self._positions.get(user_id)
+        return self.entries[position][1] if position is not None else None
+
+
+def collect_boards(guilds: Iterable[discord.Guild]) -> Dict[int, List[Tuple[int, int]]]:
+    """Today's (user id, balance) top of the global board and every guild"""
+    boards = {GLOBAL_BOARD: top_balances.top(GLOBAL_SIZE)}
+    for guild in guilds:
+        ranking = guild_rankings.get(guild.id)
+        if ranking is not None:
+            top = ranking.page(0, GUILD_SIZE)
+        else:
+            # Same order as a ranking, without keeping one for the guild
+            top = sorted(
+                (
+                    (member.id, balance_map[member.id])
+                    for member in guild.members
+                    if not member.bot and member.id in balance_map
+                ),
+                key=lambda item: (-item[1], item[0]),
+            )[:GUILD_SIZE]
+        if top:
+            boards[guild.id] = top
+    return boards
+
+
+class LeaderboardHistory:
+    """Records daily snapshots and reads them back, with a cache of rebuilt
+    days. Reads block, so the bot runs them on the storage pool; the web
+    server calls them from its own threads."""
+
+    def __init__(self):
+        self.settings: Optional[str] = None
+        self._lock = threading.Lock()
+        # (board, day) -> ranking, or None if the day wasn't recorded
+        self._cache: "OrderedDict[Tuple[int, int], Optional[HistoricRanking]]" = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.documents_read = 0
+        self.recorded = 0
+
+    def configure(self, settings: str):
+        self.settings = settings
+
+    def _cached(self, board: int, day: int):
+        """(True, ranking or None) on a hit, (False, None) on a miss"""
+        with self._lock:
+            if (board, day) not in self._cache:
+                return False, None
+            self._cache.move_to_end((board, day))
+            self.hits += 1
+            return True, self._cache[board, day]
+
+    def _store(self, board: int, day: int, ranking: Optional[HistoricRanking]):
+        with self._lock:
+            self._cache[board, day] = ranking
+            self._cache.move_to_end((board, day))
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def load_range(
+        self, board: int, first: int, last: int
+    ) -> Dict[int, HistoricRanking]:
+        """A board's rankings of the days ``first`` to ``last`` that were
+        recorded (blocking)"""
+        found: Dict[int, HistoricRanking] = {}
+        missing = []
+        for day in range(first, last + 1):
+            hit, ranking = self._cached(board, day)
+            if not hit:
+                missing.append(day)
+            elif ranking is not None:
+                found[day] = ranking
+        if not missing:
+            return found
+
+        with self._lock:
+            self.misses += 1
+        docs = find_leaderboard_history(self.settings, board, missing[0], missing[-1])
+        with self._lock:
+            self.documents_read += len(docs)
+        rebuilt = {
+            day: HistoricRanking(entries)
+            for day, entries in replay_leaderboard_history(docs)
+            if missing[0] <= day <= missing[-1]
+        }
+        for day in missing:
+            self._store(board, day, rebuilt.get(day))
+        found.update((day, rebuilt[day]) for day in missing if day in rebuilt)
+        return found
+
+    def load(self, board: int, day: int) -> Optional[HistoricRanking]:
+        """A board's ranking of a day, None if it wasn't recorded (blocking)"""
+        return self.load_range(board, day, day).get(day)
+
+    async def ranking(self, board: int, day: int) -> Optional[HistoricRanking]:
+        hit, ranking = self._cached(board, day)
+        if hit:
+            return ranking
+        return await storage.run(
+            self.load, board, day, key=("leaderboard-history", board, day)
+        )
+
+    def record(
+        self,
+        day: int,
+        boards: Dict[int, List[Tuple[int, int]]],
+        keep_days: float = 0,
+    ) -> int:
+        """Store the boards' rankings of a day unless it was recorded already,
+        then drop snapshots older than ``keep_days`` (0 keeps them). Returns
+        the number of snapshots stored (blocking)."""
+        # Everything needed to rebuild each board's day before, in one query
+        yesterday = day - 1
+        docs = find_leaderboard_days(
+            self.settings, yesterday - yesterday % KEYFRAME_DAYS, day
+        )
+        if any(doc["day"] == day for doc in docs):
+            return 0
+        by_board: Dict[int, List[dict]] = {}
+        for doc in docs:
+            by_board.setdefault(doc["board"], []).append(doc)
+
+        snapshots = []
+        for board, ranking in boards.items():
+            # Keyframe days, and days after a gap, are stored in full
+            before = None
+            if day % KEYFRAME_DAYS:
+                rebuilt = dict(replay_leaderboard_history(by_board.get(board, ())))
+                before = rebuilt.get(yesterday)
+            snapshots.append(encode_leaderboard_snapshot(board, day, ranking, before))
+        write_leaderboard_snapshots(self.settings, snapshots)
+        for board, ranking in boards.items():
+            self._store(board, day, HistoricRanking(list(ranking)))
+        self.recorded += len(snapshots)
+
+        if keep_days > 0:
+            prune_leaderboard_history(self.settings, day - int(keep_days))
+        return len(snapshots)
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "cached_days": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "documents_read": self.documents_read,
+            "recorded": self.recorded,
+        }
+
+
+leaderboard_history = LeaderboardHistory()
@@ -0,0 +1,325 @@
+"""
+Leaderboard pages for Maxis
+
+``/leaderboard`` pages through a guild's ranking ten members at a time with
+Prev/Next buttons, and ``/rank`` looks a member up in it. The ranking is
+built from the member list the first time a guild needs it and maintained
+incrementally afterwards (see ``bot.objects.guild_rankings``). The page
+number travels in the buttons' custom ids. ``/globalleaderboard`` shows the
+first users of the global top balances, and ``/leaderboard history`` a
+recorded day of a guild (see ``bot.leaderboard_history``).
+
+Rendered embeds are cached until a position they show changes: the rankings
+report which positions moved on every balance change and membership change,
+and only the pages covering them are dropped. Cached pages also expire after
+a while so renamed users show up.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import discord
+
+from bot.helper import balance_map, get_random_color, top_balances
+from bot.leaderboard_history import day_date, leaderboard_history, movement, today
+from bot.objects.guild_rankings import GuildRanking, guild_rankings
+from bot.user_resolver import user_resolver
+
+PAGE_SIZE = 10
+GLOBAL_SIZE = 5
+# Top balances looked through for GLOBAL_SIZE (non-bot, existing) users
+GLOBAL_CANDIDATES = 25
+
+CUSTOM_ID_PREFIX = "leaderboard"
+
+DEFAULT_MAX_PAGES = 5000
+DEFAULT_MAX_AGE = 600.0
+
+
+class LeaderboardCache:
+    """Rendered leaderboard embeds, dropped when what they show changes"""
+
+    def __init__(self):
+        self.max_pages = DEFAULT_MAX_PAGES
+        self.max_age = DEFAULT_MAX_AGE
+        # guild id -> page -> (rendered at, embed), least recently used first
+        self._guilds: "OrderedDict[int, Dict[int, Tuple[float, discord.Embed]]]" = (
+            OrderedDict()
+        )
+        self._pages = 0
+        # (rendered at, embed, last top balances position it looked at)
+        self._global: Optional[Tuple[float, discord.Embed, float]] = None
+        # Bumped whenever the global board is dropped, so a render that was
+        # overtaken by a balance change while resolving users isn't stored
+        self._global_version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.rebuild_ms = 0.0
+        self.last_rebuild_ms = 0.0
+
+    def clear(self):
+        self._guilds.clear()
+        self._pages = 0
+        self._global = None
+        self._global_version += 1
+
+    def _fresh(self, rendered_at: float) -> bool:
+        return time.monotonic() - rendered_at < self.max_age
+
+    def _rebuilt(self, started: float):
+        self.misses += 1
+        self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+        self.rebuild_ms += self.last_rebuild_ms
+
+    def page(self, guild_id: int, page: int) -> Optional[discord.Embed]:
+        pages = self._guilds.get(guild_id)
+        entry = pages.get(page) if pages is not None else None
+        if entry is None or not self._fresh(entry[0]):
+            return None
+        self._guilds.move_to_end(guild_id)
+        self.hits += 1
+        return entry[1]
+
+    def store_page(
+        self, guild_id: int, page: int, embed: discord.Embed, started: float
+    ):
+        """Keep a page rendered since ``started`` (a perf_counter reading)"""
+        self._rebuilt(started)
+        pages = self._guilds.setdefault(guild_id, {})
+        self._guilds.move_to_end(guild_id)
+        if page not in pages:
+            self._pages += 1
+        pages[page] = (time.monotonic(), embed)
+        while self._pages > self.max_pages and len(self._guilds) > 1:
+            _, dropped = self._guilds.popitem(last=False)
+            self._pages -= len(dropped)
+
+    def guild_changed(self, guild_id: int, first: int, last: Optional[int]):
+        """Drop the pages showing positions first to last of a guild's
+        ranking, or every page if its size changed (the page count did)"""
+        pages = self._guilds.get(guild_id)
+        if not pages:
+            return
+        if last is None:
+            dropped = list(pages)
+        else:
+            dropped = [
+                page
+                for page in range(first // PAGE_SIZE, last // PAGE_SIZE + 1)
+                if page in pages
+            ]
+        for page in dropped:
+            del pages[page]
+        self._pages -= len(dropped)
+        self.invalidations += len(dropped)
+
+    def global_board(self) -> Optional[discord.Embed]:
+        if self._global is None or not self._fresh(self._global[0]):
+            return None
+        self.hits += 1
+        return self._global[1]
+
+    def global_version(self) -> int:
+        return self._global_version
+
+    def store_global(
+        self, embed: discord.Embed, reach: float, version: int, started: float
+    ):
+        """Keep the global board, which looked at the top balances up to
+        position ``reach``, unless it changed since ``version``"""
+        self._rebuilt(started)
+        if version == self._global_version:
+            self._global = (time.monotonic(), embed, reach)
+
+    def global_changed(self, first: int, last: Optional[int]):
+        """Drop the global board if a position it looked at changed. A render
+        in progress has no board cached yet but looks at most at the first
+        GLOBAL_CANDIDATES positions, so a change there also makes it stale."""
+        dropped = self._global is not None and first <= self._global[2]
+        if dropped:
+            self._global = None
+            self.invalidations += 1
+        if dropped or first < GLOBAL_CANDIDATES:
+            self._global_version += 1
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        lookups = self.hits + self.misses
+        return {
+            "guilds": len(self._guilds),
+            "pages": self._pages,
+            "global": self._global is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "rebuild_ms_avg": self.rebuild_ms / self.misses if self.misses else 0.0,
+            "rebuild_ms_last": self.last_rebuild_ms,
+        }
+
+
+leaderboard_cache = LeaderboardCache()
+
+
+def guild_ranking(guild: discord.Guild) -> GuildRanking:
+    """A guild's ranking, built from its members if it has none yet"""
+    ranking = guild_rankings.get(guild.id)
+    if ranking is None:
+        ranking = guild_rankings.build(
+            guild.id,
+            (
+                (member.id, balance_map[member.id])
+                for member in guild.members
+                if not member.bot and member.id in balance_map
+            ),
+        )
+    return ranking
+
+
+def _name(guild: discord.Guild, user_id: int) -> str:
+    member = guild.get_member(user_id)
+    return member.display_name if member is not None else f"<@{user_id}>"
+
+
+def _render_page(
+    guild: discord.Guild, ranking: GuildRanking, page: int, pages: int
+) -> discord.Embed:
+    start = page * PAGE_SIZE
+    formatted = "\n".join(
+        f"{start + i + 1}) {_name(guild, user_id)} (:coin: {balance})"
+        for i, (user_id, balance) in enumerate(ranking.page(start, PAGE_SIZE))
+    )
+    embed = discord.Embed(
+        title=f"Richest users in {guild.name}:-",
+        description=formatted,
+        color=get_random_color(),
+    )
+    embed.set_footer(text=f"Page {page + 1} of {pages}")
+    return embed
+
+
+def _navigation(guild_id: int, page: int, pages: int) -> discord.ui.View:
+    view = discord.ui.View()
+    view.add_item(
+        discord.ui.Button(
+            label="Prev",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"{CUSTOM_ID_PREFIX}_{guild_id}_{page - 1}",
+            disabled=page == 0,
+        )
+    )
+    view.add_item(
+        discord.ui.Button(
+            label="Next",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"{CUSTOM_ID_PREFIX}_{guild_id}_{page + 1}",
+            disabled=page == pages - 1,
+        )
+    )
+    return view
+
+
+def render_leaderboard(
+    guild: discord.Guild, page: int
+) -> Tuple[discord.Embed, Optional[discord.ui.View]]:
+    """The embed and navigation buttons of a leaderboard page (0-based)"""
+    ranking = guild_ranking(guild)
+    if not len(ranking):
+        embed = discord.Embed(
+            title="No one has more than :coin: 0 in this server!",
+            color=get_random_color(),
+        )
+        return embed, None
+
+    pages = (len(ranking) + PAGE_SIZE - 1) // PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    embed = leaderboard_cache.page(guild.id, page)
+    if embed is None:
+        started = time.perf_counter()
+        embed = _render_page(guild, ranking, page, pages)
+        leaderboard_cache.store_page(guild.id, page, embed, started)
+    return embed, _navigation(guild.id, page, pages)
+
+
+async def render_global_leaderboard() -> discord.Embed:
+    """The embed of the global leaderboard"""
+    embed = leaderboard_cache.global_board()
+    if embed is not None:
+        return embed
+
+    started = time.perf_counter()
+    version = leaderboard_cache.global_version()
+    # Walk down the top balances until enough (non-bot, existing) users are
+    # found, resolving only as many as are still missing at a time
+    users = []
+    candidates = top_balances.top(GLOBAL_CANDIDATES)
+    reach = -1
+    while reach + 1 < len(candidates) and len(users) < GLOBAL_SIZE:
+        batch = candidates[reach + 1 : reach + 1 + GLOBAL_SIZE - len(users)]
+        resolved = await user_resolver.resolve_many(user_id for user_id, _ in batch)
+        for user_id, balance in batch:
+            reach += 1
+            user = resolved[user_id]
+            if user is not None and not user.bot:
+                users.append((user, balance))
+    if len(users) < GLOBAL_SIZE:
+        # Anyone entering the top balances would be shown
+        reach = float("inf")
+
+    if users:
+        formatted = "\n".join(
+            f"{i + 1}) {user} (:coin: {balance})"
+            for i, (user, balance) in enumerate(users)
+        )
+        embed = discord.Embed(
+            title=f"Top {len(users)} richest user(s) of Maxis:-",
+            description=formatted,
+            color=get_random_color(),
+        )
+    else:
+        embed = discord.Embed(
+            title="No one has more than :coin: 0 in our database!",
+            color=get_random_color(),
+        )
+    leaderboard_cache.store_global(embed, reach, version, started)
+    return embed
+
+
+async def render_history(guild: discord.Guild, days_ago: int) -> discord.Embed:
+    """The embed of a guild's leaderboard as recorded ``days_ago`` days ago,
+    with how each member moved since"""
+    day = today() - days_ago
+    past = await leaderboard_history.ranking(guild.id, day)
+    if past is None or not len(past):
+        return discord.Embed(
+            title="Error!",
+            description=f"No leaderboard was recorded on {day_date(day):%B %d, %Y}.",
+            color=get_random_color(),
+        )
+
+    ranking = guild_ranking(guild)
+    formatted = "\n".join(
+        f"{i + 1}) {_name(guild, user_id)} (:coin: {balance}): "
+        + movement(i + 1, ranking.rank(user_id))
+        for i, (user_id, balance) in enumerate(past.entries[:PAGE_SIZE])
+    )
+    embed = discord.Embed(
+        title=f"Richest users in {guild.name} on {day_date(day):%B %d, %Y}:-",
+        description=formatted,
+        color=get_random_color(),
+    )
+    embed.set_footer(text="Movement is up to now")
+    return embed
+
+
+def parse_custom_id(custom_id: str) -> Optional[Tuple[int, int]]:
+    """The guild id and page a navigation button points at"""
+    parts = custom_id.split("_")
+    if len(parts) != 3:
+        return None
+    try:
+        return int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
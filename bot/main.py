@@ -2,20 +2,59 @@
 Main bot file - Entry point for Maxis
 """
 
+import asyncio
 import os
 import sys
-from datetime import datetime, timezone
-from typing import Dict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, MutableMapping, Optional, Tuple
 from dotenv import load_dotenv
 
 import discord
 from discord.ext import commands
-from pymongo import MongoClient
 
-from bot.helper import custom_replies, balance_map, warn_map, get_random_color
+from bot.database import (
+    USERS_COLLECTION,
+    COOLDOWNS_COLLECTION,
+    COOLDOWN_FIELDS,
+    GUILDS_COLLECTION,
+    REPLIES_COLLECTION,
+    close_client,
+    compact_ledger,
+    configure_pool,
+    decode_warn,
+    encode_cooldown_overrides,
+    encode_warn,
+    ensure_indexes,
+    get_database,
+    migrate_cooldown_documents,
+    migrate_legacy_documents,
+    server_time,
+)
+from bot.helper import (
+    PROJECT_ROOT,
+    custom_replies,
+    balance_map,
+    balance_index,
+    top_balances,
+    warn_map,
+    get_random_color,
+)
+from bot.cooldown_engine import cooldown_engine
+from bot.objects.cooldowns import BASIC_COOLDOWN, LONGEST_COOLDOWN
+from bot.objects.guild_rankings import guild_rankings
 from bot.objects.user_settings import UserSettings
-from bot.objects.warn import Warn
 from bot.objects.shop import Shop
+from bot.objects.user_cache import UserRecord, user_cache
+from bot.objects.user_locks import user_locks
+from bot.journal import Journal
+from bot.leaderboard_history import collect_boards, leaderboard_history, today
+from bot.leaderboards import leaderboard_cache
+from bot.persistence import BackpressurePolicy, flusher, storage
+from bot.snapshot import SnapshotState, load_snapshot, write_snapshot
+from bot.transactions import transaction_pages
+from bot.user_resolver import user_resolver
 
 # Ensure the module isn't loaded twice when executed with `python -m bot.main`, resulting in duplicate stale state
 sys.modules.setdefault("bot.main", sys.modules[__name__])
@@ -27,14 +66,56 @@ load_dotenv()
 TOKEN = os.getenv("TOKEN", "null")
 CONNSTR = os.getenv("CONNSTR", "null")
 PORT = int(os.getenv("PORT", "8080"))
-
-# Global state
-user_worked_times: Dict[int, datetime] = {}
-user_robbed_times: Dict[int, datetime] = {}
-user_daily_times: Dict[int, datetime] = {}
-user_weekly_times: Dict[int, datetime] = {}
-user_monthly_times: Dict[int, datetime] = {}
-user_settings_map: Dict[int, UserSettings] = {}
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "5"))
+MAX_PENDING_WRITES = int(os.getenv("MAX_PENDING_WRITES", "10000"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "4"))
+STORAGE_MAX_QUEUE = int(os.getenv("STORAGE_MAX_QUEUE", "100"))
+STORAGE_BACKPRESSURE = os.getenv("STORAGE_BACKPRESSURE", "drop_superseded")
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", str(PROJECT_ROOT / "data" / "journal"))
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", str(PROJECT_ROOT / "data" / "state.snap"))
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "900"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))
+USER_LOCK_STRIPES = int(os.getenv("USER_LOCK_STRIPES", "256"))
+LEDGER_RETENTION_DAYS = float(os.getenv("LEDGER_RETENTION_DAYS", "30"))
+USER_FETCH_CONCURRENCY = int(os.getenv("USER_FETCH_CONCURRENCY", "10"))
+USER_FETCH_TTL = float(os.getenv("USER_FETCH_TTL", "3600"))
+LEADERBOARD_HISTORY_DAYS = float(os.getenv("LEADERBOARD_HISTORY_DAYS", "365"))
+
+# Seconds between attempts to load the data at boot
+DATA_RETRY_INTERVAL = 10
+# Seconds between ledger compactions
+LEDGER_COMPACT_INTERVAL = 3600
+# Seconds past midnight (UTC) the daily leaderboard snapshot is taken
+LEADERBOARD_HISTORY_DELAY = 60
+
+# Margin for clock differences between replica set members when reconciling
+SNAPSHOT_CLOCK_SKEW = timedelta(seconds=60)
+
+# Global state (per-user records are loaded on demand by the user cache)
+user_settings_map: MutableMapping[int, UserSettings] = user_cache.view("settings")
+
+# Documents updated at or after this time are fetched at boot (None: everything)
+data_since: Optional[datetime] = None
+# Milliseconds spent on each part of the startup load
+startup_timings: Dict[str, float] = {}
+
+# All database access shares one pooled client
+configure_pool(max_pool_size=MONGO_MAX_POOL_SIZE, min_pool_size=MONGO_MIN_POOL_SIZE)
+
+# Persist changes in the background, at most once per document per interval
+flusher.configure(CONNSTR, interval=FLUSH_INTERVAL, max_pending=MAX_PENDING_WRITES)
+flusher.journal = Journal(JOURNAL_DIR)
+storage.max_workers = STORAGE_WORKERS
+storage.max_queue = STORAGE_MAX_QUEUE
+storage.policy = BackpressurePolicy(STORAGE_BACKPRESSURE)
+user_cache.configure(CONNSTR, max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+cooldown_engine.configure(CONNSTR)
+transaction_pages.configure(CONNSTR)
+leaderboard_history.configure(CONNSTR)
+user_locks.configure(USER_LOCK_STRIPES)
 
 # Bot intents
 intents = discord.Intents.default()
@@ -49,6 +130,7 @@ intents.members = True
 
 # Create bot instance (no prefix needed since we're using slash commands only)
 bot = commands.Bot(command_prefix=">", intents=intents)
+user_resolver.configure(bot, concurrency=USER_FETCH_CONCURRENCY, ttl=USER_FETCH_TTL)
 
 
 # Make these accessible to other modules
@@ -56,171 +138,395 @@ class Main:
     CONNSTR = CONNSTR
     balance_map = balance_map
     user_settings_map = user_settings_map
-    user_worked_times = user_worked_times
-    user_robbed_times = user_robbed_times
-    user_daily_times = user_daily_times
-    user_weekly_times = user_weekly_times
-    user_monthly_times = user_monthly_times
+    startup_timings = startup_timings
+
+
+def replay_journal():
+    """Write changes that had not reached the database before the last shutdown"""
+    records = flusher.journal.open()
+    if not records:
+        return
+
+    for record in records:
+        flusher.stage(
+            record.collection,
+            record._id,
+            record.set_fields,
+            record.unset_fields,
+            record.delete,
+            journal=False,
+        )
+    if flusher.flush():
+        print(f"Replayed {len(records)} journaled change(s) into the database.")
+    else:
+        print(f"Database unreachable, {len(records)} journaled change(s) still queued.")
+
+
+def apply_snapshot(snapshot: SnapshotState):
+    """Replace the in-memory state with a snapshot's"""
+    custom_replies.clear()
+    custom_replies.update(snapshot.replies)
+    custom_replies.matcher.link()
+    warn_map.clear()
+    warn_map.update(snapshot.warns)
+    balance_map.clear()
+    balance_map.update(snapshot.balances)
+
+    # The snapshot holds the records that were cached, they start out warm
+    records: Dict[int, Tuple[UserRecord, List[int], int]] = {}
+    for user_id, user_settings in snapshot.user_settings.items():
+        records[user_id] = (
+            UserRecord({"settings": user_settings}),
+            snapshot.cooldowns.get(user_id, [0] * len(COOLDOWN_FIELDS)),
+            snapshot.cooldown_expires.get(user_id, 0),
+        )
+        if user_id in snapshot.items:
+            records[user_id][0].values["items"] = snapshot.items[user_id]
+    user_cache.clear()
+    user_cache.prime(records)
+
+
+def apply_unconfirmed():
+    """Apply the changes the database hasn't confirmed yet (the replayed
+    journal) to the loaded state, which may predate them"""
+    for user_id, changes in flusher.unconfirmed(USERS_COLLECTION).items():
+        doc = {"_id": user_id}
+        if user_id in balance_map:
+            doc["balance"] = balance_map[user_id]
+        for change in changes:
+            doc = change.apply(doc)
+        if "balance" in doc:
+            balance_map[user_id] = doc["balance"]
+        else:
+            balance_map.pop(user_id, None)
+        # Loading the record again applies the same changes
+        user_cache.invalidate(user_id)
+    for user_id in flusher.unconfirmed(COOLDOWNS_COLLECTION):
+        user_cache.invalidate(user_id)
+
+    for guild_id, changes in flusher.unconfirmed(GUILDS_COLLECTION).items():
+        doc = {
+            "_id": guild_id,
+            "warns": {
+                str(user_id): encode_warn(warn)
+                for user_id, warn in warn_map.get(guild_id, {}).items()
+            },
+            "cooldowns": encode_cooldown_overrides(
+                cooldown_engine.guild_overrides.get(guild_id) or {},
+                cooldown_engine.role_overrides.get(guild_id) or {},
+            ),
+        }
+        for change in changes:
+            doc = change.apply(doc)
+        warns = {
+            int(user_id): decode_warn(warn_data or {})
+            for user_id, warn_data in (doc.get("warns") or {}).items()
+        }
+        if warns:
+            warn_map[guild_id] = warns
+        else:
+            warn_map.pop(guild_id, None)
+        cooldown_engine.load(guild_id, doc.get("cooldowns") or {})
+
+    for trigger, changes in flusher.unconfirmed(REPLIES_COLLECTION).items():
+        doc = {"_id": trigger}
+        if trigger in custom_replies:
+            doc["reply"] = custom_replies[trigger]
+        for change in changes:
+            doc = change.apply(doc)
+        if "reply" in doc:
+            custom_replies[trigger] = doc["reply"]
+        elif trigger in custom_replies:
+            del custom_replies[trigger]
+
+
+def capture_snapshot(stamp: datetime) -> SnapshotState:
+    """Copy the in-memory state (call from the event loop)"""
+    snapshot = SnapshotState(stamp)
+    snapshot.replies = dict(custom_replies)
+    snapshot.warns = {
+        guild_id: dict(guild_warns) for guild_id, guild_warns in warn_map.items()
+    }
+    snapshot.balances = balance_map.copy()
+    for user_id, record in user_cache.cached_items():
+        values = record.values
+        snapshot.user_settings[user_id] = values["settings"]
+        if "items" in values:
+            snapshot.items[user_id] = dict(values["items"])
+        if record.slot >= 0:
+            slot = record.slot
+            snapshot.cooldowns[user_id] = user_cache.cooldowns.row(slot)
+            snapshot.cooldown_expires[user_id] = user_cache.cooldowns.expires[slot]
+    return snapshot
+
+
+def save_snapshot() -> bool:
+    """Write a snapshot of the current state (blocking, used at shutdown)"""
+    try:
+        # Stamped before copying, so every later write is newer than the stamp
+        stamp = server_time(CONNSTR)
+        size = write_snapshot(SNAPSHOT_PATH, capture_snapshot(stamp))
+        print(f"Saved snapshot ({size / 1024 / 1024:.1f} MiB).")
+        return True
+    except Exception as e:
+        print(f"Error saving snapshot: {e}")
+        return False
+
+
+async def snapshot_loop():
+    """Refresh the warm-start snapshot periodically"""
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            stamp = await storage.run(server_time, CONNSTR, key="snapshot-stamp")
+            snapshot = capture_snapshot(stamp)
+            await storage.run(write_snapshot, SNAPSHOT_PATH, snapshot, key="snapshot")
+        except Exception as e:
+            print(f"Error saving snapshot: {e}")
+
+
+def compact_old_ledger_events() -> int:
+    """Fold the ledger events past the retention period into checkpoints
+    (blocking)"""
+    before = server_time(CONNSTR) - timedelta(days=LEDGER_RETENTION_DAYS)
+    return compact_ledger(get_database(CONNSTR), before)
+
+
+async def ledger_compaction_loop():
+    """Compact the ledger periodically, so it only holds recent events"""
+    while True:
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+        try:
+            compacted = await storage.run(
+                compact_old_ledger_events, key="ledger-compaction"
+            )
+            if compacted:
+                print(f"Compacted {compacted} ledger event(s) into checkpoints.")
+        except Exception as e:
+            print(f"Error compacting ledger: {e}")
+
+
+async def leaderboard_history_loop():
+    """Record the leaderboards once a day (and on start if today's are missing)"""
+    await bot.wait_until_ready()
+    while True:
+        try:
+            recorded = await storage.run(
+                leaderboard_history.record,
+                today(),
+                collect_boards(bot.guilds),
+                LEADERBOARD_HISTORY_DAYS,
+                key="leaderboard-history",
+            )
+            if recorded:
+                print(f"Recorded {recorded} leaderboard snapshot(s).")
+        except Exception as e:
+            print(f"Error recording leaderboard history: {e}")
+        now = datetime.now(timezone.utc)
+        midnight = datetime.combine(now.date(), datetime.min.time(), timezone.utc)
+        next_run = midnight + timedelta(days=1, seconds=LEADERBOARD_HISTORY_DELAY)
+        await asyncio.sleep((next_run - now).total_seconds())
+
+
+def load_replies(db, query: dict):
+    """Load custom replies (always in full, they can be deleted outright)"""
+    custom_replies.clear()
+    for doc in db[REPLIES_COLLECTION].find():
+        custom_replies[doc["_id"]] = doc["reply"]
+    custom_replies.matcher.link()
+
+
+def load_cooldown_overrides(db, query: dict):
+    """Load every guild's cooldown overrides (always in full, there are few)"""
+    cooldown_engine.clear()
+    for doc in db[GUILDS_COLLECTION].find(
+        {"cooldowns": {"$exists": True}}, {"cooldowns": 1}
+    ):
+        cooldown_engine.load(doc["_id"], doc["cooldowns"] or {})
+
+
+def load_guilds(db, query: dict):
+    """Load each guild's warns"""
+    for doc in db[GUILDS_COLLECTION].find(query, {"warns": 1}):
+        warn_map[doc["_id"]] = {
+            int(user_id): decode_warn(warn_data or {})
+            for user_id, warn_data in (doc.get("warns") or {}).items()
+        }
+
+
+def load_users(db, query: dict):
+    """Load every balance (other user data is loaded on demand)"""
+    for doc in db[USERS_COLLECTION].find(query, {"balance": 1}):
+        user_id = doc["_id"]
+        if "balance" in doc:
+            balance_map[user_id] = doc["balance"]
+        else:
+            balance_map.pop(user_id, None)
+        if query:
+            # Changed since the snapshot, reload the record on next use
+            user_cache.invalidate(user_id)
+
+
+def load_cooldowns(db, query: dict):
+    """Drop cached records whose cooldowns changed since the snapshot"""
+    if not query:
+        return
+    for doc in db[COOLDOWNS_COLLECTION].find(query, {"_id": 1}):
+        user_id = doc["_id"]
+        user_cache.invalidate(user_id)
+
 
+# Sections run on worker threads (large, decoding-heavy) and inline (small).
+# Each one only touches its own maps, so they can load concurrently.
+THREADED_SECTIONS = {"users": load_users, "cooldowns": load_cooldowns}
+INLINE_SECTIONS = {
+    "replies": load_replies,
+    "guilds": load_guilds,
+    "cooldown_overrides": load_cooldown_overrides,
+}
 
-def init_data():
-    """Initialize data from MongoDB"""
+
+def _timed_section(name: str, func, db, query: dict) -> bool:
+    started = time.perf_counter()
+    try:
+        func(db, query)
+        return True
+    except Exception as e:
+        print(f"Error loading {name}: {e}")
+        return False
+    finally:
+        startup_timings[name] = (time.perf_counter() - started) * 1000
+
+
+def init_data() -> bool:
+    """Initialize data from the local snapshot and MongoDB. Returns False if
+    neither could provide the balances (nothing may be served then)."""
+    global data_since
+    started = time.perf_counter()
+    # Read before touching the database, it is all there is if that is down
+    snapshot = load_snapshot(SNAPSHOT_PATH)
+    startup_timings["snapshot"] = (time.perf_counter() - started) * 1000
     try:
-        client = MongoClient(CONNSTR)
-        db = client["UnknownDatabase"]
-        collection = db["UnknownCollection"]
-
-        for doc in collection.find():
-            doc_name = doc["name"]
-
-            if doc_name == "reply":
-                custom_replies.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    custom_replies[keys[i]] = vals[i]
-
-            elif doc_name == "warn":
-                warn_map.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    server_id = keys[i] or 0
-                    warns_data = vals[i] or {}
-                    warns_dict = {}
-                    keys_inner = warns_data["key"] or []
-                    vals_inner = warns_data["val"] or []
-                    for i in range(len(keys_inner)):
-                        user_id = keys_inner[i] or 0
-                        warn_data = vals_inner[i] or {}
-                        warn = Warn()
-                        warn.user_id = warn_data["id"] or 0
-                        warn.warns = warn_data["warns"] or 0
-                        warn.warn_causes = warn_data["causes"] or []
-                        warns_dict[user_id] = warn
-                    warn_map[server_id] = warns_dict
-
-            elif doc_name == "balance":
-                balance_map.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    balance_map[keys[i]] = vals[i]
-
-            elif doc_name == "item":
-                Shop.owned_items.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    user_id = keys[i] or 0
-                    items_data = vals[i] or {}
-                    item_keys = items_data["key"] or []
-                    item_vals = items_data["val"] or []
-                    items_dict = {}
-                    for j in range(len(item_keys)):
-                        items_dict[item_keys[j]] = item_vals[j]
-                    Shop.owned_items[user_id] = items_dict
-
-            elif doc_name == "work":
-                user_worked_times.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    user_worked_times[keys[i]] = vals[i]
-                    user_worked_times[keys[i]] = user_worked_times[keys[i]].replace(
-                        tzinfo=timezone.utc
-                    )
-
-            elif doc_name == "rob":
-                user_robbed_times.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    user_robbed_times[keys[i]] = vals[i]
-                    user_robbed_times[keys[i]] = user_robbed_times[keys[i]].replace(
-                        tzinfo=timezone.utc
-                    )
-
-            elif doc_name == "daily":
-                user_daily_times.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    user_daily_times[keys[i]] = vals[i]
-                    user_daily_times[keys[i]] = user_daily_times[keys[i]].replace(
-                        tzinfo=timezone.utc
-                    )
-
-            elif doc_name == "weekly":
-                user_weekly_times.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    user_weekly_times[keys[i]] = vals[i]
-                    user_weekly_times[keys[i]] = user_weekly_times[keys[i]].replace(
-                        tzinfo=timezone.utc
-                    )
-
-            elif doc_name == "monthly":
-                user_monthly_times.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    user_monthly_times[keys[i]] = vals[i]
-                    user_monthly_times[keys[i]] = user_monthly_times[keys[i]].replace(
-                        tzinfo=timezone.utc
-                    )
-
-            elif doc_name == "usersettings":
-                continue  # Handled in init_user_settings()
-
-            else:
-                print(f"Unknown document '{doc_name}' found! Skipping")
-
-        client.close()
-        print("Retrieved all data.")
+        db = get_database(CONNSTR)
+        ensure_indexes(db)
+
+        migrated = migrate_legacy_documents(db)
+        if migrated:
+            print(f"Migrated {migrated} legacy document(s) to per-key documents.")
+        rewritten = migrate_cooldown_documents(db, LONGEST_COOLDOWN)
+        if rewritten:
+            print(f"Rewrote {rewritten} cooldown document(s) as compact rows.")
+            migrated += rewritten
+
+        # Start from the snapshot and fetch only documents changed since it
+        if snapshot is not None and not migrated:
+            apply_snapshot(snapshot)
+            data_since = snapshot.stamp - SNAPSHOT_CLOCK_SKEW
+        else:
+            warn_map.clear()
+            balance_map.clear()
+            user_cache.clear()
+            data_since = None
+        query = {} if data_since is None else {"updated": {"$gte": data_since}}
+
+        with ThreadPoolExecutor(
+            max_workers=len(THREADED_SECTIONS), thread_name_prefix="loader"
+        ) as pool:
+            threaded = {
+                name: pool.submit(_timed_section, name, func, db, query)
+                for name, func in THREADED_SECTIONS.items()
+            }
+            failed = [
+                name
+                for name, func in INLINE_SECTIONS.items()
+                if not _timed_section(name, func, db, query)
+            ]
+        failed += [name for name, future in threaded.items() if not future.result()]
+        if failed:
+            raise RuntimeError(f"could not load {', '.join(failed)}")
     except Exception as e:
         print(f"Error initializing data: {e}")
+        if snapshot is None:
+            return False
+        # The snapshot holds this bot's last saved state, the journal the
+        # changes made since (applied below, written once the database is back)
+        print("Database unreachable, starting from the local snapshot.")
+        apply_snapshot(snapshot)
+        data_since = snapshot.stamp - SNAPSHOT_CLOCK_SKEW
+    apply_unconfirmed()
+
+    # Balances were loaded in bulk, rank them again on first use
+    top_balances.clear()
+    guild_rankings.clear()
+    leaderboard_cache.clear()
+    # Except the global rank index: building it takes a while at a million
+    # users and would stall the first /balance
+    section_started = time.perf_counter()
+    balance_index.build(balance_map.columns()[1])
+    startup_timings["balance_index"] = (time.perf_counter() - section_started) * 1000
+    startup_timings["total"] = (time.perf_counter() - started) * 1000
+    print(
+        "Retrieved all data ("
+        + ", ".join(f"{name} {ms:.0f} ms" for name, ms in startup_timings.items())
+        + ")."
+    )
+    return True
 
 
-def init_user_settings():
-    """Initialize user settings from MongoDB"""
+async def prefetch_users(interaction: discord.Interaction) -> bool:
+    """Load the records of the users an interaction is about before handling
+    it. Returns False if they could not be loaded."""
+    user_ids = {interaction.user.id}
+    data = interaction.data or {}
+    for user_id in data.get("resolved", {}).get("users", {}):
+        user_ids.add(int(user_id))
     try:
-        client = MongoClient(CONNSTR)
-        db = client["UnknownDatabase"]
-        collection = db["UnknownCollection"]
-
-        for doc in collection.find():
-            if doc["name"] == "usersettings":
-                user_settings_map.clear()
-                keys = doc["key"] or []
-                vals = doc["val"] or []
-                for i in range(len(keys)):
-                    user_id = keys[i]
-                    settings_data = vals[i]
-                    user_settings_map[user_id] = UserSettings(
-                        bank_dm_enabled=(
-                            settings_data["dm"] if "dm" in settings_data else True
-                        ),
-                        bank_passive_enabled=(
-                            settings_data["passive"]
-                            if "passive" in settings_data
-                            else False
-                        ),
-                    )
-
-        client.close()
-        print("Retrieved all user settings.")
+        await user_cache.prefetch(user_ids)
+        return True
     except Exception as e:
-        print(f"Error initializing user settings: {e}")
+        print(f"Error prefetching users: {e}")
+        return False
+
+
+async def refuse_if_unavailable(interaction: discord.Interaction) -> bool:
+    """Answer an interaction that can't be served right now. Returns True if
+    it was refused."""
+    if flusher.over_limit:
+        # Too many changes wait for the database, don't pile up more
+        message = "The database is catching up, please try again in a moment."
+    elif not await prefetch_users(interaction):
+        # Loading the records later would block the event loop
+        message = "Your data couldn't be loaded, please try again in a moment."
+    else:
+        return False
+    await interaction.response.send_message(message, ephemeral=True)
+    return True
+
+
+async def interaction_check(interaction: discord.Interaction) -> bool:
+    """Runs before every slash command"""
+    return not await refuse_if_unavailable(interaction)
+
 
+async def user_cache_loop():
+    """Evict idle user records even when nothing new is loaded, and free
+    cooldown rows that have ended"""
+    while True:
+        await asyncio.sleep(min(USER_CACHE_TTL, BASIC_COOLDOWN))
+        user_cache.sweep()
 
-async def init_user_settings_async():
-    """Initialize user settings for all guild members"""
-    for guild in bot.guilds:
-        async for member in guild.fetch_members(limit=None):
-            if not member.bot and member.id not in user_settings_map:
-                user_settings_map[member.id] = UserSettings()
+
+@bot.event
+async def setup_hook():
+    """Called once the event loop is running, before connecting to Discord"""
+    # Database work runs on a fixed-size pool driven from the event loop
+    storage.start()
+    if SNAPSHOT_INTERVAL > 0:
+        asyncio.create_task(snapshot_loop())
+    asyncio.create_task(user_cache_loop())
+    if LEDGER_RETENTION_DAYS > 0:
+        asyncio.create_task(ledger_compaction_loop())
+    asyncio.create_task(leaderboard_history_loop())
 
 
 @bot.event
@@ -231,12 +537,6 @@ async def on_ready():
     # Initialize shop
     Shop.init_shop()
 
-    # Initialize user settings from database
-    init_user_settings()
-
-    # Initialize user settings for all guild members
-    await init_user_settings_async()
-
     # Sync slash commands
     try:
         synced = await bot.tree.sync()
@@ -276,17 +576,48 @@ from bot.helper import custom_replies
 
 
 # Register event handlers
+def is_ranked_member(guild_id: int, user_id: int) -> bool:
+    """Whether a user belongs on a guild's leaderboard"""
+    guild = bot.get_guild(guild_id)
+    member = guild.get_member(user_id) if guild is not None else None
+    return member is not None and not member.bot
+
+
+guild_rankings.is_member = is_ranked_member
+guild_rankings.on_change = leaderboard_cache.guild_changed
+top_balances.on_change = leaderboard_cache.global_changed
+
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    """Add the member to the server's leaderboard"""
+    if not member.bot:
+        balance = balance_map.get(member.id)
+        guild_rankings.add_member(member.guild.id, member.id, balance)
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    """Take the member off the server's leaderboard"""
+    guild_rankings.remove_member(member.guild.id, member.id)
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    """Drop the leaderboard of a server the bot left"""
+    guild_rankings.drop_guild(guild.id)
+
+
 @bot.event
 async def on_message(message: discord.Message):
     """Handle custom replies for non-command messages"""
     if message.author.bot:
         return
 
-    # Check for custom replies
-    for reply_key in custom_replies.keys():
-        if reply_key in message.content:
-            await message.channel.send(custom_replies[reply_key])
-            break
+    # Check for custom replies (every trigger in one pass over the message)
+    trigger = custom_replies.match(message.content)
+    if trigger is not None:
+        await message.channel.send(custom_replies[trigger])
 
     # Check for bot mentions
     if message.mentions:
@@ -303,6 +634,12 @@ async def on_message(message: discord.Message):
 
 @bot.event
 async def on_interaction(interaction: discord.Interaction):
+    if interaction.type in (
+        discord.InteractionType.component,
+        discord.InteractionType.modal_submit,
+    ):
+        if await refuse_if_unavailable(interaction):
+            return
     if interaction.type == discord.InteractionType.component:
         await ComponentsListener.on_interaction(interaction)
     elif interaction.type == discord.InteractionType.modal_submit:
@@ -311,6 +648,7 @@ async def on_interaction(interaction: discord.Interaction):
 
 # Setup slash commands
 setup_slash_commands(bot)
+bot.tree.interaction_check = interaction_check
 
 
 def cleanup_temp_files():
@@ -345,8 +683,19 @@ if __name__ == "__main__":
     # Clean up temporary files
     cleanup_temp_files()
 
-    # Initialize data from database
-    init_data()
+    # Apply journaled changes, then initialize data from database
+    replay_journal()
+    # Never serve from empty balances: without a snapshot to fall back on,
+    # wait for the database
+    while not init_data():
+        print(f"No balances to start from, retrying in {DATA_RETRY_INTERVAL}s.")
+        time.sleep(DATA_RETRY_INTERVAL)
 
     # Run bot (web server and Admes server will start in on_ready event)
-    bot.run(TOKEN)
+    try:
+        bot.run(TOKEN)
+    finally:
+        # Write any changes that have not been flushed yet
+        storage.shutdown()
+        save_snapshot()
+        close_client()
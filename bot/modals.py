@@ -28,6 +28,7 @@ class ModalsListener:
                 Main.CONNSTR,
                 Main.user_settings_map,
                 Main.balance_map,
+                "hack_loss",
             ):
                 embed = discord.Embed(
                     title="Failure!",
@@ -63,6 +64,7 @@ class ModalsListener:
                     Main.CONNSTR,
                     Main.user_settings_map,
                     Main.balance_map,
+                    "hack_loss",
                 ):
                     embed = discord.Embed(
                         title="Failure!",
@@ -83,6 +85,7 @@ class ModalsListener:
                         Main.CONNSTR,
                         Main.user_settings_map,
                         Main.balance_map,
+                        "hack_win",
                     ):
                         embed = discord.Embed(
                             title="Success!",
@@ -97,6 +100,7 @@ class ModalsListener:
                         Main.CONNSTR,
                         Main.user_settings_map,
                         Main.balance_map,
+                        "hack_loss",
                     ):
                         embed = discord.Embed(
                             title="Failure!",
@@ -111,6 +115,7 @@ class ModalsListener:
                     Main.CONNSTR,
                     Main.user_settings_map,
                     Main.balance_map,
+                    "hack_loss",
                 ):
                     embed = discord.Embed(
                         title="Failure!",
@@ -0,0 +1,149 @@
+"""
+Order statistics over every balance for Maxis
+
+Answers "rank #1,204 of 980,000" and "richer than 93% of users" without
+sorting the economy. Balances are counted in buckets that are exact below
+2048 and cover 1/1024 of a power of two above it (about 55k buckets for the
+whole int64 range), and a Fenwick tree over the bucket counts gives the
+number of balances below any bucket in O(log buckets). Wide buckets also
+keep their balances sorted, so ranks inside a bucket are exact as well.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, Optional
+
+# Balances below this have a bucket each, above it buckets hold 1/1024 of a
+# power of two
+SUB_BITS = 10
+EXACT_LIMIT = 2 << SUB_BITS
+BUCKETS = ((63 - SUB_BITS - 1) << SUB_BITS) + EXACT_LIMIT
+
+
+def bucket_of(balance: int) -> int:
+    if balance < EXACT_LIMIT:
+        return max(balance, 0)
+    shift = balance.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (balance >> shift)
+
+
+class BalanceIndex:
+    """Counts of balances per bucket, with a Fenwick tree over them"""
+
+    def __init__(self):
+        self.clear()
+        self.builds = 0
+        self.updates = 0
+
+    def __len__(self) -> int:
+        return self.total
+
+    def clear(self):
+        """Forget every balance (call ``build`` before using it again)"""
+        self._tree = [0] * BUCKETS
+        self._counts = [0] * BUCKETS
+        # Sorted balances of the buckets wider than one value
+        self._wide: Dict[int, array] = {}
+        self.total = 0
+        self.ready = False
+
+    def build(self, balances: Iterable[int]):
+        """Count every balance at once (a full scan)"""
+        self.clear()
+        counts, wide = self._counts, self._wide
+        for balance in sorted(balances):
+            bucket = bucket_of(balance)
+            counts[bucket] += 1
+            if balance >= EXACT_LIMIT:
+                # Sorted input, so appending keeps each bucket sorted
+                wide.setdefault(bucket, array("q")).append(balance)
+        # Linear-time Fenwick construction from the counts
+        tree = self._tree
+        tree[:] = counts
+        for i in range(BUCKETS):
+            parent = i | (i + 1)
+            if parent < BUCKETS:
+                tree[parent] += tree[i]
+        self.total = sum(counts)
+        self.ready = True
+        self.builds += 1
+
+    def _add(self, bucket: int, delta: int):
+        self._counts[bucket] += delta
+        tree = self._tree
+        while bucket < BUCKETS:
+            tree[bucket] += delta
+            bucket |= bucket + 1
+
+    def _below(self, bucket: int) -> int:
+        """Balances in the buckets before ``bucket``"""
+        count = 0
+        tree = self._tree
+        bucket -= 1
+        while bucket >= 0:
+            count += tree[bucket]
+            bucket = (bucket & (bucket + 1)) - 1
+        return count
+
+    def add(self, balance: int):
+        bucket = bucket_of(balance)
+        self._add(bucket, 1)
+        if balance >= EXACT_LIMIT:
+            insort(self._wide.setdefault(bucket, array("q")), balance)
+        self.total += 1
+
+    def remove(self, balance: int):
+        bucket = bucket_of(balance)
+        self._add(bucket, -1)
+        if balance >= EXACT_LIMIT:
+            values = self._wide[bucket]
+            del values[bisect_left(values, balance)]
+            if not values:
+                del self._wide[bucket]
+        self.total -= 1
+
+    def update(self, old: Optional[int], new: int):
+        """Record a balance change (``old`` is None for a new account)"""
+        if not self.ready:
+            return
+        self.updates += 1
+        if old is not None:
+            self.remove(old)
+        self.add(new)
+
+    def count_below(self, balance: int) -> int:
+        """Number of balances lower than ``balance``"""
+        bucket = bucket_of(balance)
+        below = self._below(bucket)
+        if balance >= EXACT_LIMIT:
+            below += bisect_left(self._wide.get(bucket, ()), balance)
+        return below
+
+    def count_above(self, balance: int) -> int:
+        """Number of balances higher than ``balance``"""
+        bucket = bucket_of(balance)
+        above = self.total - self._below(bucket + 1)
+        if balance >= EXACT_LIMIT:
+            values = self._wide.get(bucket, ())
+            above += len(values) - bisect_right(values, balance)
+        return above
+
+    def rank(self, balance: int) -> int:
+        """1-based rank of a balance, highest first (ties share a rank)"""
+        return self.count_above(balance) + 1
+
+    def percentile(self, balance: int) -> float:
+        """Share of the other users with a lower balance, in percent"""
+        if self.total <= 1:
+            return 100.0
+        return self.count_below(balance) * 100 / (self.total - 1)
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "balances": self.total,
+            "ready": self.ready,
+            "wide_buckets": len(self._wide),
+            "builds": self.builds,
+            "updates": self.updates,
+        }
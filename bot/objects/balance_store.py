@@ -0,0 +1,186 @@
+"""
+Compact balance storage for Maxis
+
+Balances are kept in two parallel int64 arrays (user ids sorted, balances in
+the same order) instead of a dict of Python ints, which takes about 16 bytes
+per user instead of 100+. Users not in the arrays yet go to a small overflow
+dict that is merged in once it grows. Aggregates (top-k, sum, histogram)
+run over the arrays directly, with NumPy when it is installed.
+"""
+
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional
+    np = None
+
+# Overflow entries that trigger a merge into the arrays (at least)
+MIN_MERGE_SIZE = 1024
+
+
+class BalanceStore(MutableMapping):
+    """Dict-like ``user id -> balance`` map backed by int64 arrays"""
+
+    def __init__(self, balances: Optional[Dict[int, int]] = None):
+        self._ids = array("q")
+        self._values = array("q")
+        self._overflow: Dict[int, int] = {}
+        if balances:
+            self.update(balances)
+
+    @classmethod
+    def from_columns(cls, ids: array, values: array) -> "BalanceStore":
+        """Build a store from id-sorted columns without copying them"""
+        store = cls()
+        store._ids = ids
+        store._values = values
+        return store
+
+    def columns(self) -> Tuple[array, array]:
+        """The id-sorted id and balance columns (do not modify them)"""
+        self._merge()
+        return self._ids, self._values
+
+    def copy(self) -> "BalanceStore":
+        ids, values = self.columns()
+        return BalanceStore.from_columns(ids[:], values[:])
+
+    def _index(self, user_id: int) -> int:
+        """Slot of a user in the arrays, or -1"""
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        if i < len(ids) and ids[i] == user_id:
+            return i
+        return -1
+
+    def _merge(self):
+        """Move the overflow entries into the sorted arrays"""
+        if not self._overflow:
+            return
+        ids, values = self._ids, self._values
+        merged_ids = array("q")
+        merged_values = array("q")
+        start = 0
+        for user_id in sorted(self._overflow):
+            end = bisect_left(ids, user_id, start)
+            merged_ids += ids[start:end]
+            merged_values += values[start:end]
+            merged_ids.append(user_id)
+            merged_values.append(self._overflow[user_id])
+            start = end
+        merged_ids += ids[start:]
+        merged_values += values[start:]
+        self._ids = merged_ids
+        self._values = merged_values
+        self._overflow.clear()
+
+    def __contains__(self, user_id) -> bool:
+        if user_id in self._overflow:
+            return True
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        return i < len(ids) and ids[i] == user_id
+
+    def __getitem__(self, user_id: int) -> int:
+        if user_id in self._overflow:
+            return self._overflow[user_id]
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        if i < len(ids) and ids[i] == user_id:
+            return self._values[i]
+        raise KeyError(user_id)
+
+    def __setitem__(self, user_id: int, balance: int):
+        i = self._index(user_id)
+        if i >= 0:
+            self._values[i] = balance
+            return
+        self._overflow[user_id] = balance
+        if len(self._overflow) >= max(MIN_MERGE_SIZE, len(self._ids) // 16):
+            self._merge()
+
+    def __delitem__(self, user_id: int):
+        if user_id in self._overflow:
+            del self._overflow[user_id]
+            return
+        i = self._index(user_id)
+        if i < 0:
+            raise KeyError(user_id)
+        del self._ids[i]
+        del self._values[i]
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self._ids
+        yield from list(self._overflow)
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._overflow)
+
+    def items(self) -> Iterable[Tuple[int, int]]:
+        self._merge()
+        return zip(self._ids, self._values)
+
+    def clear(self):
+        self._ids = array("q")
+        self._values = array("q")
+        self._overflow.clear()
+
+    def update(self, other=(), **kwargs):
+        if not self and isinstance(other, BalanceStore) and not kwargs:
+            ids, values = other.columns()
+            self._ids, self._values = ids[:], values[:]
+        elif not self and isinstance(other, dict) and not kwargs:
+            # Bulk load: sort once instead of inserting one by one
+            self._overflow = dict(other)
+            self._merge()
+        else:
+            super().update(other, **kwargs)
+
+    def total(self) -> int:
+        """Sum of all balances"""
+        return sum(self._values) + sum(self._overflow.values())
+
+    def top_k(self, k: int) -> List[Tuple[int, int]]:
+        """The ``k`` highest (user id, balance) pairs, highest first"""
+        self._merge()
+        n = len(self._values)
+        k = min(k, n)
+        if k <= 0:
+            return []
+        if np is not None:
+            values = np.frombuffer(self._values, dtype=np.int64)
+            top = np.argpartition(values, n - k)[n - k :]
+            slots = top[np.argsort(values[top], kind="stable")[::-1]].tolist()
+            del values, top
+        else:
+            slots = heapq.nlargest(k, range(n), key=self._values.__getitem__)
+        return [(self._ids[i], self._values[i]) for i in slots]
+
+    def histogram(self, bins: int = 10) -> Tuple[List[int], List[float]]:
+        """Counts of balances in ``bins`` equal-width bins, and the bin edges.
+
+        Like ``numpy.histogram``, every bin is half-open except the last.
+        """
+        self._merge()
+        if not self._values:
+            return [0] * bins, [float(i) for i in range(bins + 1)]
+        if np is not None:
+            counts, edges = np.histogram(
+                np.frombuffer(self._values, dtype=np.int64), bins=bins
+            )
+            return counts.tolist(), edges.tolist()
+
+        ordered = sorted(self._values)
+        low, high = ordered[0], ordered[-1]
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        width = (high - low) / bins
+        edges = [low + width * i for i in range(bins)] + [float(high)]
+        starts = [bisect_left(ordered, edge) for edge in edges[:-1]]
+        starts.append(bisect_right(ordered, edges[-1]))
+        counts = [starts[i + 1] - starts[i] for i in range(bins)]
+        return counts, edges
@@ -0,0 +1,171 @@
+"""
+Cooldown table for Maxis
+
+Claim times of every cooldown kind are stored as integer epoch seconds in one
+int64 column per kind (struct of arrays). A user owns one row (slot) across
+all columns while any of their cooldowns can still block them, so checking
+and claiming a cooldown is a couple of array index operations. A time of 0
+means the cooldown was never claimed.
+
+Every row also records when its last cooldown ends. A min-heap ordered by
+that time lets ``expire`` free the rows that can no longer block anything
+without scanning the table; freed slots are reused, and the columns are
+compacted once most of them are free.
+"""
+
+import heapq
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bot.database import COOLDOWN_FIELDS
+
+# Cooldown kinds, indexes into a row (same order as COOLDOWN_FIELDS)
+WORK, ROB, DAILY, WEEKLY, MONTHLY = range(len(COOLDOWN_FIELDS))
+
+# Cooldown lengths in seconds
+BASIC_COOLDOWN = 30
+DAILY_COOLDOWN = 86400
+WEEKLY_COOLDOWN = 604800
+MONTHLY_COOLDOWN = 2592000
+LONGEST_COOLDOWN = MONTHLY_COOLDOWN
+
+# Bytes of one row: a column per kind, its end time and its owner
+ROW_BYTES = (len(COOLDOWN_FIELDS) + 2) * 8
+
+# Compact the columns when at least this many slots (and half of them) are free
+MIN_COMPACT_SLOTS = 1024
+
+
+def now_epoch() -> int:
+    return int(time.time())
+
+
+class CooldownTable:
+    """Slot-addressed claim times, one int64 column per cooldown kind"""
+
+    def __init__(self):
+        self.clear()
+        self.expired = 0
+        self.compactions = 0
+        # Bytes of free slots dropped by compactions
+        self.compacted_bytes = 0
+
+    def __len__(self) -> int:
+        """Slots in use"""
+        return len(self.owners) - len(self._free)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.owners)
+
+    def allocate(
+        self, owner: int, row: Optional[Sequence[int]] = None, expires: int = 0
+    ) -> int:
+        """Take a free slot for ``owner`` and fill it with ``row`` (or zeros)"""
+        row = row or (0,) * len(COOLDOWN_FIELDS)
+        if self._free:
+            slot = self._free.pop()
+            for column, value in zip(self.columns, row):
+                column[slot] = value
+            self.owners[slot] = owner
+            self.expires[slot] = expires
+        else:
+            slot = len(self.owners)
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            self.owners.append(owner)
+            self.expires.append(expires)
+        if expires:
+            heapq.heappush(self._heap, (expires, slot))
+        return slot
+
+    def release(self, slot: int) -> Tuple[List[int], int]:
+        """Free a slot, returning the row it held and when it ends"""
+        row, expires = self.row(slot), self.expires[slot]
+        for column in self.columns:
+            column[slot] = 0
+        self.owners[slot] = 0
+        self.expires[slot] = 0
+        self._free.append(slot)
+        return row, expires
+
+    def clear(self):
+        self.columns = [array("q") for _ in COOLDOWN_FIELDS]
+        self.owners = array("q")
+        self.expires = array("q")
+        self._free: List[int] = []
+        self._heap: List[Tuple[int, int]] = []
+
+    def row(self, slot: int) -> List[int]:
+        return [column[slot] for column in self.columns]
+
+    def get(self, slot: int, kind: int) -> int:
+        return self.columns[kind][slot]
+
+    def set(self, slot: int, kind: int, claimed_at: int):
+        self.columns[kind][slot] = claimed_at
+
+    def store(self, slot: int, row: Sequence[int], expires: int):
+        """Overwrite a row and its end time"""
+        for column, value in zip(self.columns, row):
+            column[slot] = value
+        if expires != self.expires[slot]:
+            self.expires[slot] = expires
+            heapq.heappush(self._heap, (expires, slot))
+
+    def extend(self, slot: int, ends_at: int):
+        """Keep a row until at least ``ends_at``"""
+        if ends_at > self.expires[slot]:
+            self.expires[slot] = ends_at
+            heapq.heappush(self._heap, (ends_at, slot))
+
+    def remaining(self, slot: int, kind: int, duration: int, now: int) -> int:
+        """Seconds until the cooldown can be claimed again (0 if it can now)"""
+        claimed_at = self.columns[kind][slot]
+        if not claimed_at:
+            return 0
+        return max(claimed_at + duration - now, 0)
+
+    def try_claim(self, slot: int, kind: int, duration: int, now: int) -> int:
+        """Claim the cooldown if it is ready. Returns 0 if claimed, else the
+        seconds left."""
+        column = self.columns[kind]
+        claimed_at = column[slot]
+        if claimed_at and claimed_at + duration > now:
+            return claimed_at + duration - now
+        column[slot] = now
+        self.extend(slot, now + duration)
+        return 0
+
+    def expire(self, now: int) -> List[int]:
+        """Free every row whose cooldowns have all ended. Returns their owners."""
+        heap, expires, owners = self._heap, self.expires, self.owners
+        freed = []
+        while heap and heap[0][0] <= now:
+            _, slot = heapq.heappop(heap)
+            # Stale entries: the slot was freed, or its row was extended since
+            if owners[slot] and expires[slot] <= now:
+                freed.append(owners[slot])
+                self.release(slot)
+        self.expired += len(freed)
+        return freed
+
+    def compact(self) -> Optional[Dict[int, int]]:
+        """Drop free slots once most of the table is free. Returns the new
+        slot of every owner, or None if nothing was compacted."""
+        free = len(self._free)
+        if free < MIN_COMPACT_SLOTS or free * 2 < len(self.owners):
+            return None
+        live = [slot for slot, owner in enumerate(self.owners) if owner]
+        self.columns = [
+            array("q", [column[slot] for slot in live]) for column in self.columns
+        ]
+        self.owners = array("q", [self.owners[slot] for slot in live])
+        self.expires = array("q", [self.expires[slot] for slot in live])
+        self.compacted_bytes += free * ROW_BYTES
+        self._free = []
+        self._heap = [(ends_at, slot) for slot, ends_at in enumerate(self.expires)]
+        heapq.heapify(self._heap)
+        self.compactions += 1
+        return {owner: slot for slot, owner in enumerate(self.owners)}
@@ -0,0 +1,176 @@
+"""
+Per-guild balance rankings for Maxis
+
+Each guild that asked for its leaderboard keeps its members' balances in a
+list sorted highest first, so a page is a slice and a member's rank is one
+binary search. The list is built from the member list once, then kept up to
+date from member join/leave events and from every balance write, instead of
+sorting all members again on each call.
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class GuildRanking:
+    """Balances of one guild's members, highest first"""
+
+    __slots__ = ("entries", "balances")
+
+    def __init__(self, members: Iterable[Tuple[int, int]] = ()):
+        self.balances: Dict[int, int] = dict(members)
+        # (-balance, user id), so the list sorts highest first
+        self.entries: List[Tuple[int, int]] = sorted(
+            (-balance, user_id) for user_id, balance in self.balances.items()
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.balances
+
+    def set(self, user_id: int, balance: int) -> Tuple[Optional[int], int]:
+        """Rank a member with a new balance. Returns their old (None if they
+        weren't ranked) and new 0-based positions"""
+        old = self.remove(user_id)
+        self.balances[user_id] = balance
+        entry = (-balance, user_id)
+        new = bisect_left(self.entries, entry)
+        self.entries.insert(new, entry)
+        return old, new
+
+    def remove(self, user_id: int) -> Optional[int]:
+        """Unrank a member. Returns the 0-based position they had"""
+        old = self.balances.pop(user_id, None)
+        if old is None:
+            return None
+        position = bisect_left(self.entries, (-old, user_id))
+        del self.entries[position]
+        return position
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based position of a member, or None if they aren't ranked"""
+        balance = self.balances.get(user_id)
+        if balance is None:
+            return None
+        return bisect_left(self.entries, (-balance, user_id)) + 1
+
+    def page(self, start: int, count: int) -> List[Tuple[int, int]]:
+        """(user id, balance) of the members ranked ``start + 1`` onwards"""
+        return [
+            (user_id, -balance)
+            for balance, user_id in self.entries[start : start + count]
+        ]
+
+
+class GuildRankings:
+    """The rankings of every guild that has one"""
+
+    def __init__(self):
+        self._guilds: Dict[int, GuildRanking] = {}
+        # Guilds with a ranking each user is a member of. A user's set is only
+        # created by looking through every ranked guild, then kept up to date;
+        # users without one are looked up on their next balance change.
+        self._user_guilds: Dict[int, Set[int]] = {}
+        # Whether a user is a member of a guild (set by the bot)
+        self.is_member: Callable[[int, int], bool] = lambda guild_id, user_id: False
+        # Called with (guild id, first, last) when the 0-based positions first
+        # to last of a ranking changed; last is None if its size changed too
+        self.on_change: Callable[[int, int, Optional[int]], None] = (
+            lambda guild_id, first, last: None
+        )
+        self.builds = 0
+        self.updates = 0
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    def get(self, guild_id: int) -> Optional[GuildRanking]:
+        return self._guilds.get(guild_id)
+
+    def build(self, guild_id: int, members: Iterable[Tuple[int, int]]) -> GuildRanking:
+        """Rank a guild's members from their (user id, balance) pairs"""
+        self.drop_guild(guild_id)
+        ranking = GuildRanking(members)
+        self._guilds[guild_id] = ranking
+        for user_id in ranking.balances:
+            guilds = self._user_guilds.get(user_id)
+            if guilds is not None:
+                guilds.add(guild_id)
+        self.builds += 1
+        self.on_change(guild_id, 0, None)
+        return ranking
+
+    def drop_guild(self, guild_id: int):
+        if self._guilds.pop(guild_id, None) is None:
+            return
+        self.on_change(guild_id, 0, None)
+        # Members without a balance are in the sets too, so look through all
+        for guilds in self._user_guilds.values():
+            guilds.discard(guild_id)
+
+    def clear(self):
+        """Forget every ranking after balances were reloaded (rebuilt on use)"""
+        self._guilds.clear()
+        self._user_guilds.clear()
+
+    def add_member(self, guild_id: int, user_id: int, balance: Optional[int]):
+        """A user joined a guild (``balance`` is None if they have none)"""
+        ranking = self._guilds.get(guild_id)
+        if ranking is None:
+            return
+        guilds = self._user_guilds.get(user_id)
+        if guilds is not None:
+            guilds.add(guild_id)
+        if balance is not None:
+            self._changed(guild_id, *ranking.set(user_id, balance))
+
+    def remove_member(self, guild_id: int, user_id: int):
+        """A user left a guild"""
+        ranking = self._guilds.get(guild_id)
+        if ranking is None:
+            return
+        position = ranking.remove(user_id)
+        if position is not None:
+            self.on_change(guild_id, position, None)
+        guilds = self._user_guilds.get(user_id)
+        if guilds is not None:
+            guilds.discard(guild_id)
+
+    def update(self, user_id: int, balance: int):
+        """Record a user's new balance in the rankings of their guilds"""
+        if not self._guilds:
+            return
+        guilds = self._user_guilds.get(user_id)
+        if guilds is None:
+            # First balance change seen for this user: find their ranked guilds
+            guilds = {
+                guild_id
+                for guild_id in self._guilds
+                if self.is_member(guild_id, user_id)
+            }
+            self._user_guilds[user_id] = guilds
+        for guild_id in guilds:
+            ranking = self._guilds.get(guild_id)
+            if ranking is not None:
+                self._changed(guild_id, *ranking.set(user_id, balance))
+                self.updates += 1
+
+    def _changed(self, guild_id: int, old: Optional[int], new: int):
+        if old is None:
+            self.on_change(guild_id, new, None)
+        else:
+            self.on_change(guild_id, min(old, new), max(old, new))
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "guilds": len(self._guilds),
+            "ranked_members": sum(len(ranking) for ranking in self._guilds.values()),
+            "builds": self.builds,
+            "updates": self.updates,
+        }
+
+
+guild_rankings = GuildRankings()
@@ -2,35 +2,31 @@
 Nitro item functionality
 """
 
-from datetime import datetime, timedelta, timezone
 import discord
 
+from bot.objects.cooldowns import DAILY, WORK
+
 
 async def use_nitro(event: discord.Message):
     """Use nitro item to reduce cooldowns"""
     from bot.main import Main
-    from bot.helper import refresh_works, refresh_dailies
+    from bot.cooldown_engine import cooldown_engine
+    from bot.helper import refresh_cooldown_times
+    from bot.objects.user_cache import user_cache
 
     user_id = event.author.id
+    guild_id = event.guild.id if event.guild else None
+    changed = []
 
-    # Reduce work cooldown
-    if user_id in Main.user_worked_times:
-        work_reduce = timedelta(seconds=30) - (
-            datetime.now(timezone.utc) - Main.user_worked_times[user_id]
-        )
-        if work_reduce.total_seconds() > 0:
-            Main.user_worked_times[user_id] = (
-                Main.user_worked_times[user_id] - work_reduce
-            )
-            refresh_works(Main.CONNSTR, Main.user_worked_times)
+    # End the work and daily cooldowns right away
+    for kind in (WORK, DAILY):
+        duration = cooldown_engine.duration(kind, guild_id, event.author)
+        left = user_cache.remaining(user_id, kind, duration)
+        if left:
+            claimed_at = user_cache.cooldown_row(user_id)[kind]
+            user_cache.set_claimed_at(user_id, kind, claimed_at - left)
+            changed.append(kind)
 
-    # Reduce daily cooldown
-    if user_id in Main.user_daily_times:
-        daily_reduce = timedelta(seconds=86400) - (
-            datetime.now(timezone.utc) - Main.user_daily_times[user_id]
-        )
-        if daily_reduce.total_seconds() > 0:
-            Main.user_daily_times[user_id] = (
-                Main.user_daily_times[user_id] - daily_reduce
-            )
-            refresh_dailies(Main.CONNSTR, Main.user_daily_times)
+    if changed:
+        # Only the shortened times, other kinds may have been claimed elsewhere
+        refresh_cooldown_times(Main.CONNSTR, user_id, *changed)
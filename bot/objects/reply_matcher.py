@@ -0,0 +1,323 @@
+"""
+Custom reply trigger matching for Maxis
+
+Every message is checked against every custom reply trigger. Instead of one
+substring search per trigger, the triggers share an Aho-Corasick automaton (a
+trie with failure links) that finds all of them in a single pass over the
+message. Adding or removing a trigger edits its path in the trie and relinks
+only the nodes whose failure links change (found through the reverse links),
+so ``/reply`` stays cheap however many triggers there are. A bulk load just
+fills the trie and links everything once, on the first match.
+
+The trigger that wins is the same one as with ``trigger in message`` over the
+replies in order: each trigger has a priority (its insertion order) and each
+node knows the best priority of every trigger ending there or at a suffix.
+A few triggers are checked with plain substring searches, which is faster
+than walking the message in Python.
+"""
+
+from array import array
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, MutableMapping, Optional
+
+# Priority of nodes where no trigger ends
+NONE = 1 << 62
+# Up to this many triggers are searched for one by one
+SMALL_SET = 32
+
+
+class ReplyMatcher:
+    """Multi-pattern substring matcher over a changing set of triggers"""
+
+    def __init__(self, triggers: Iterable[str] = ()):
+        self.clear()
+        self.relinks = 0
+        self.incremental_updates = 0
+        for trigger in triggers:
+            self.add(trigger)
+
+    def __len__(self) -> int:
+        return len(self._priorities)
+
+    def __contains__(self, trigger: str) -> bool:
+        return trigger in self._priorities
+
+    def clear(self):
+        # Node 0 is the root. Per node: children by character, failure link,
+        # priority of the trigger ending there, best priority ending there or
+        # at any node of its failure chain, and parent and character (to edit
+        # the trie). Numbers are kept in arrays to save memory.
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail = array("i", [0])
+        self._own = array("q", [NONE])
+        self._best = array("q", [NONE])
+        self._parent = array("i", [0])
+        self._char: List[str] = [""]
+        # The nodes whose failure link points at a node, as a linked list: the
+        # first one, then each one's next and previous (-1: not in a list)
+        self._first = array("i", [0])
+        self._next = array("i", [0])
+        self._previous = array("i", [-1])
+        self._free: List[int] = []
+        self._priorities: Dict[str, int] = {}
+        self._triggers: Dict[int, str] = {}
+        self._next_priority = 0
+        # Whether the failure links and best priorities are up to date (a
+        # bulk load links everything at once, on the first match)
+        self._linked = False
+
+    def _new_node(self, parent: int, char: str) -> int:
+        if self._free:
+            node = self._free.pop()
+            self._goto[node] = {}
+            self._fail[node] = 0
+            self._own[node] = NONE
+            self._parent[node] = parent
+            self._char[node] = char
+            self._first[node] = 0
+            self._previous[node] = -1
+        else:
+            node = len(self._goto)
+            self._goto.append({})
+            self._fail.append(0)
+            self._own.append(NONE)
+            self._best.append(NONE)
+            self._parent.append(parent)
+            self._char.append(char)
+            self._first.append(0)
+            self._next.append(0)
+            self._previous.append(-1)
+        self._goto[parent][char] = node
+        return node
+
+    def _detach(self, node: int):
+        previous, following = self._previous[node], self._next[node]
+        if previous < 0:
+            return
+        if previous:
+            self._next[previous] = following
+        else:
+            self._first[self._fail[node]] = following
+        if following:
+            self._previous[following] = previous
+        self._previous[node] = -1
+
+    def _set_fail(self, node: int, link: int):
+        self._detach(node)
+        self._fail[node] = link
+        following = self._first[link]
+        self._next[node] = following
+        self._previous[node] = 0
+        if following:
+            self._previous[following] = node
+        self._first[link] = node
+
+    def _failing_to(self, node: int) -> List[int]:
+        """The nodes whose failure link points at ``node``"""
+        found = []
+        node = self._first[node]
+        while node:
+            found.append(node)
+            node = self._next[node]
+        return found
+
+    def _walk(self, node: int, char: str) -> int:
+        """Where a failure link goes after ``node``'s string and a character"""
+        goto, fail = self._goto, self._fail
+        while node and char not in goto[node]:
+            node = fail[node]
+        return goto[node].get(char, 0)
+
+    def add(self, trigger: str):
+        """Add a trigger, ranked after every trigger already added"""
+        if trigger in self._priorities:
+            return
+        priority = self._next_priority
+        self._next_priority += 1
+        self._priorities[trigger] = priority
+        self._triggers[priority] = trigger
+
+        node = 0
+        created = []
+        for char in trigger:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = self._new_node(node, char)
+                created.append(child)
+            node = child
+        self._own[node] = priority
+        if self._linked:
+            self._link_added(created, node)
+
+    def remove(self, trigger: str):
+        priority = self._priorities.pop(trigger, None)
+        if priority is None:
+            return
+        del self._triggers[priority]
+
+        node = 0
+        for char in trigger:
+            node = self._goto[node][char]
+        self._own[node] = NONE
+        # Drop the nodes no other trigger goes through, deepest first
+        pruned = []
+        terminal = node
+        while node and self._own[node] == NONE and not self._goto[node]:
+            parent = self._parent[node]
+            del self._goto[parent][self._char[node]]
+            self._free.append(node)
+            pruned.append(node)
+            node = parent
+        if self._linked:
+            self._link_removed(pruned, terminal)
+
+    def _link_added(self, created: List[int], terminal: int):
+        """Link the new nodes of a trigger, and point the nodes that now have
+        a longer suffix in the trie at it"""
+        goto = self._goto
+        for node in created:
+            parent, char = self._parent[node], self._char[node]
+            self._set_fail(node, self._walk(self._fail[parent], char) if parent else 0)
+            # Nodes ending with the parent's string may now fall back to this
+            # node: the first node on each failure path below the parent that
+            # has a child with this character does (the ones below it already
+            # fall back to that node's child)
+            stack = self._failing_to(parent)
+            while stack:
+                below = stack.pop()
+                child = goto[below].get(char)
+                if child is None:
+                    stack.extend(self._failing_to(below))
+                elif child != node:
+                    self._set_fail(child, node)
+        self._refresh_best(created if terminal in created else created + [terminal])
+        self.incremental_updates += 1
+
+    def _link_removed(self, pruned: List[int], terminal: int):
+        """Point the nodes that fell back to pruned nodes at the next longest
+        suffix instead"""
+        moved = []
+        for node in pruned:
+            for below in self._failing_to(node):
+                self._set_fail(below, self._fail[node])
+                moved.append(below)
+            self._detach(node)
+        self._refresh_best(moved if pruned else [terminal])
+        self.incremental_updates += 1
+
+    def _refresh_best(self, roots: List[int]):
+        """Recompute the best priorities of the nodes falling back to the
+        given nodes (directly or through others)"""
+        own, best, fail = self._own, self._best, self._fail
+        best[0] = own[0]
+        stack = list(roots)
+        while stack:
+            node = stack.pop()
+            if node:
+                best[node] = min(own[node], best[fail[node]])
+            stack.extend(self._failing_to(node))
+
+    def _relink(self):
+        """Recompute every failure link and best priority (breadth first)"""
+        goto, fail, own, best = self._goto, self._fail, self._own, self._best
+        size = len(goto)
+        self._first = array("i", [0]) * size
+        self._next = array("i", [0]) * size
+        self._previous = array("i", [-1]) * size
+        best[0] = own[0]
+        queue = deque()
+        for child in goto[0].values():
+            self._set_fail(child, 0)
+            best[child] = min(own[child], best[0])
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            link = fail[node]
+            for char, child in goto[node].items():
+                target = self._walk(link, char)
+                self._set_fail(child, target)
+                best[child] = min(own[child], best[target])
+                queue.append(child)
+        self._linked = True
+        self.relinks += 1
+
+    def link(self):
+        """Link the automaton now instead of on the first match"""
+        if not self._linked and len(self._priorities) > SMALL_SET:
+            self._relink()
+
+    def first_match(self, text: str) -> Optional[str]:
+        """The first trigger (in the order they were added) found in ``text``"""
+        if not self._priorities:
+            return None
+        if len(self._priorities) <= SMALL_SET:
+            for trigger in self._triggers.values():
+                if trigger in text:
+                    return trigger
+            return None
+        if not self._linked:
+            self._relink()
+        goto, fail, best = self._goto, self._fail, self._best
+        # Nothing can beat the first trigger still present
+        first = next(iter(self._triggers))
+        found = best[0]
+        node = 0
+        for char in text:
+            if found == first:
+                break
+            children = goto[node]
+            while char not in children and node:
+                node = fail[node]
+                children = goto[node]
+            node = children.get(char, 0)
+            if best[node] < found:
+                found = best[node]
+        return self._triggers.get(found)
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "triggers": len(self._priorities),
+            "nodes": len(self._goto) - len(self._free),
+            "relinks": self.relinks,
+            "incremental_updates": self.incremental_updates,
+        }
+
+
+class CustomReplies(MutableMapping):
+    """Dict-like ``trigger -> reply`` map that keeps a matcher of its
+    triggers up to date"""
+
+    def __init__(self, replies: Optional[Dict[str, str]] = None):
+        self._replies: Dict[str, str] = {}
+        self.matcher = ReplyMatcher()
+        if replies:
+            self.update(replies)
+
+    def __getitem__(self, trigger: str) -> str:
+        return self._replies[trigger]
+
+    def __setitem__(self, trigger: str, reply: str):
+        self._replies[trigger] = reply
+        self.matcher.add(trigger)
+
+    def __delitem__(self, trigger: str):
+        del self._replies[trigger]
+        self.matcher.remove(trigger)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._replies)
+
+    def __len__(self) -> int:
+        return len(self._replies)
+
+    def __contains__(self, trigger) -> bool:
+        return trigger in self._replies
+
+    def clear(self):
+        self._replies.clear()
+        self.matcher.clear()
+
+    def match(self, text: str) -> Optional[str]:
+        """The trigger of the reply to send for a message, if any"""
+        return self.matcher.first_match(text)
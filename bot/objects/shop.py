@@ -3,10 +3,14 @@ Shop and ShopItem classes for the economy system
 """
 
 import asyncio
-from typing import Dict, Optional, Callable
+from typing import Dict, MutableMapping, Optional, Callable
 import discord
-from bot.helper import get_random_color, debit_balance
 
+from bot.database import USERS_COLLECTION
+from bot.helper import get_random_color, debit_balance, stage_write
+
+from bot.objects.user_cache import user_cache
+from bot.objects.user_locks import user_locks
 from bot.objects.user_settings import UserSettings
 
 
@@ -45,13 +49,13 @@ class ShopItem:
                 owned = owned_items[user_id][self.name]
                 if not self.is_persistent:
                     owned_items[user_id][self.name] = owned - 1
+                    shop_refresh_func()
                     embed = discord.Embed(
                         title=f"{interaction.user.display_name} used {self.emoji} {self.name}",
                         description=f"{self.use_message}\nYou now have {owned - 1} {self.emoji} {self.name}(s).",
                         color=get_random_color(),
                     )
                     await interaction.response.send_message(embed=embed)
-                    shop_refresh_func()
                 else:
                     embed = discord.Embed(
                         title=f"{interaction.user.display_name} used {self.emoji} {self.name}",
@@ -90,41 +94,50 @@ class ShopItem:
         """Buy an item from the shop"""
         try:
             user_id = interaction.user.id
-            if user_id not in owned_items:
-                owned_items[user_id] = {}
-            elif self.name in owned_items[user_id]:
-                if owned_items[user_id][self.name] > 0:
+            # Held until the item is added, so a double click can't buy it twice
+            async with user_locks.hold(user_id):
+                if user_id not in owned_items:
+                    owned_items[user_id] = {}
+                elif self.name in owned_items[user_id]:
+                    if owned_items[user_id][self.name] > 0:
+                        embed = discord.Embed(
+                            title="Error!",
+                            description=f"You already own this item! Use it with ```/use {self.command}```.",
+                            color=get_random_color(),
+                        )
+                        await interaction.response.send_message(
+                            embed=embed, ephemeral=True
+                        )
+                        return
+
+                if await debit_balance(
+                    self.cost,
+                    interaction,
+                    settings,
+                    user_settings_map,
+                    balance_map,
+                    "buy",
+                ):
+                    if self.name in owned_items[user_id]:
+                        owned_items[user_id][self.name] += 1
+                    else:
+                        owned_items[user_id][self.name] = 1
+                    shop_refresh_func()
+
                     embed = discord.Embed(
-                        title="Error!",
-                        description=f"You already own this item! Use it with ```/use {self.command}```.",
+                        title="Success!",
+                        description=f"{interaction.user.display_name} purchased 1 {self.emoji} {self.name}.\n"
+                        f"Now you have {owned_items[user_id][self.name]} {self.emoji} {self.name}(s).",
                         color=get_random_color(),
                     )
-                    await interaction.response.send_message(embed=embed, ephemeral=True)
-                    return
-
-            if await debit_balance(
-                self.cost, interaction, settings, user_settings_map, balance_map
-            ):
-                if self.name in owned_items[user_id]:
-                    owned_items[user_id][self.name] += 1
-                else:
-                    owned_items[user_id][self.name] = 1
-
-                embed = discord.Embed(
-                    title="Success!",
-                    description=f"{interaction.user.display_name} purchased 1 {self.emoji} {self.name}.\n"
-                    f"Now you have {owned_items[user_id][self.name]} {self.emoji} {self.name}(s).",
-                    color=get_random_color(),
-                )
-                await interaction.response.send_message(embed=embed)
-                shop_refresh_func()
+                    await interaction.response.send_message(embed=embed)
         except Exception as ex:
             print(f"Error buying item: {ex}")
 
 
 class Shop:
     items = []
-    owned_items: Dict[int, Dict[str, int]] = {}
+    owned_items: MutableMapping[int, Dict[str, int]] = user_cache.view("items")
 
     @staticmethod
     def init_shop():
@@ -208,37 +221,13 @@ class Shop:
         return 0
 
     @staticmethod
-    def refresh_ownerships(settings: str):
-        """Refresh item ownerships in database"""
-
-        def refresh():
-            try:
-                from pymongo import MongoClient
-
-                client = MongoClient(settings)
-                db = client["UnknownDatabase"]
-                collection = db["UnknownCollection"]
-
-                docs = []
-                for map_val in Shop.owned_items.values():
-                    docs.append(
-                        {"key": list(map_val.keys()), "val": list(map_val.values())}
-                    )
-
-                doc = {
-                    "name": "item",
-                    "key": list(Shop.owned_items.keys()),
-                    "val": docs,
-                }
-
-                if collection.count_documents({"name": "item"}) > 0:
-                    collection.replace_one({"name": "item"}, doc)
-                else:
-                    collection.insert_one(doc)
-                client.close()
-            except Exception as e:
-                print(f"Error refreshing ownerships: {e}")
-
-        import threading
-
-        threading.Thread(target=refresh, daemon=True).start()
+    def refresh_ownerships(settings: str, *user_ids: int):
+        """Refresh the given users' item ownerships in database"""
+        for user_id in user_ids:
+            if user_id in Shop.owned_items:
+                stage_write(
+                    settings,
+                    USERS_COLLECTION,
+                    user_id,
+                    {"items": dict(Shop.owned_items[user_id])},
+                )
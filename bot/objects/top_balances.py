@@ -0,0 +1,99 @@
+"""
+Global top balances index for Maxis
+
+Keeps the highest balances in a small sorted list that is updated on every
+balance write, so the global leaderboard reads its first entries instead of
+ranking every user. The list always holds the top ``len(list)`` users of the
+store: a user joins it when their balance beats its lowest entry, and leaves
+it when they fall below the rest (someone outside may have more by then).
+Once it gets too short to answer a query, it is refilled from the store.
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bot.objects.balance_store import BalanceStore
+
+DEFAULT_CAPACITY = 256
+
+
+class TopBalances:
+    """The highest balances of a store, highest first"""
+
+    def __init__(self, store: BalanceStore, capacity: int = DEFAULT_CAPACITY):
+        self.store = store
+        self.capacity = capacity
+        # (-balance, user id), so the list sorts highest first
+        self._entries: List[Tuple[int, int]] = []
+        self._balances: Dict[int, int] = {}
+        # Whether every user of the store is in the list
+        self._complete = False
+        # Called with (first, last) when the 0-based positions first to last
+        # of the list changed; last is None if its size changed too
+        self.on_change: Callable[[int, Optional[int]], None] = lambda first, last: None
+        self.rebuilds = 0
+        self.updates = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """Forget the list after the store was reloaded (refilled on next use)"""
+        self._entries = []
+        self._balances = {}
+        self._complete = False
+        self.on_change(0, None)
+
+    def rebuild(self):
+        """Refill the list from the store (a full scan)"""
+        kept = len(self._entries)
+        top = self.store.top_k(self.capacity)
+        self._entries = sorted((-balance, user_id) for user_id, balance in top)
+        self._balances = dict(top)
+        self._complete = len(top) == len(self.store)
+        self.rebuilds += 1
+        # Entries were the true top, so only the ones after them are new
+        self.on_change(kept, None)
+
+    def update(self, user_id: int, balance: int):
+        """Record a user's new balance"""
+        self.updates += 1
+        entries = self._entries
+        old = self._balances.pop(user_id, None)
+        if old is not None:
+            old = bisect_left(entries, (-old, user_id))
+            del entries[old]
+        new = None
+        # Users ranked below the lowest entry are unknown unless all are here
+        if self._complete or (entries and -entries[-1][0] <= balance):
+            entry = (-balance, user_id)
+            new = bisect_left(entries, entry)
+            entries.insert(new, entry)
+            self._balances[user_id] = balance
+            if len(entries) > self.capacity:
+                _, dropped = entries.pop()
+                del self._balances[dropped]
+                self._complete = False
+
+        if old is None and new is None:
+            return
+        if old is None or new is None:
+            self.on_change(new if old is None else old, None)
+        else:
+            self.on_change(min(old, new), max(old, new))
+
+    def top(self, k: int) -> List[Tuple[int, int]]:
+        """The ``k`` (at most ``capacity``) highest (user id, balance) pairs,
+        highest first"""
+        if len(self._entries) < k and not self._complete:
+            self.rebuild()
+        return [(user_id, -balance) for balance, user_id in self._entries[:k]]
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "updates": self.updates,
+            "rebuilds": self.rebuilds,
+        }
@@ -0,0 +1,406 @@
+"""
+On-demand cache of per-user economy records for Maxis
+
+Settings, owned items and cooldown times are only kept in memory for users
+who have used the bot recently. A user's record is loaded from the database
+on first touch (normally prefetched before a command runs) and evicted once
+it is the least recently used over the size budget or has been idle longer
+than the TTL. Changed records are written back when evicted.
+
+Existing code keeps using plain mappings: ``view(field)`` returns a dict-like
+view of one field across all users, e.g. ``user_cache.view("items")``.
+Cooldowns are kept in a shared ``CooldownTable``, a read-through cache of the
+stored rows: they are claimed on the database (see ``bot.cooldown_engine``)
+and the result is kept here with ``store_cooldowns``. A user only holds a row
+in it while one of their cooldowns is running; ``sweep`` frees the rows that
+have ended.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+
+import bson
+
+from bot.database import (
+    COOLDOWN_FIELDS,
+    COOLDOWNS_COLLECTION,
+    USERS_COLLECTION,
+    decode_cooldowns,
+    decode_user_settings,
+    encode_cooldowns,
+    encode_user_settings,
+    get_database,
+)
+from bot.objects.cooldowns import (
+    LONGEST_COOLDOWN,
+    ROW_BYTES,
+    CooldownTable,
+    now_epoch,
+)
+from bot.objects.user_settings import UserSettings
+from bot.persistence import flusher, storage
+
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_TTL = 3600.0
+
+# Fields a record holds (cooldowns live in the cache's cooldown table)
+USER_FIELDS = ("settings", "items")
+
+# Size of a Cooldowns document (user ids are int64, claim times int32), for
+# the write volume evicted records save
+COOLDOWN_DOC_BYTES = len(
+    bson.encode({"_id": 1 << 62, **encode_cooldowns([0] * len(COOLDOWN_FIELDS), 0)})
+)
+
+LoadedRecord = Tuple["UserRecord", List[int], int]
+
+
+class UserRecord:
+    """Cached settings and items of one user, and their cooldown table slot
+    (-1 while none of their cooldowns is running)"""
+
+    __slots__ = ("values", "slot", "dirty", "touched")
+
+    def __init__(self, values: Dict[str, Any]):
+        self.values = values
+        self.slot = -1
+        self.dirty = False
+        self.touched = time.monotonic()
+
+
+class RecordView(MutableMapping):
+    """Dict-like access to one field of every user's record.
+
+    Lookups load the user's record if it is not cached. Iterating only
+    covers users that are currently cached.
+    """
+
+    def __init__(self, cache: "UserCache", field: str):
+        self._cache = cache
+        self._field = field
+
+    def __contains__(self, user_id) -> bool:
+        return self._field in self._cache.record(user_id).values
+
+    def __getitem__(self, user_id):
+        record = self._cache.record(user_id)
+        value = record.values[self._field]
+        if self._field == "items":
+            # Item counts are changed in place by callers
+            record.dirty = True
+        return value
+
+    def __setitem__(self, user_id, value):
+        record = self._cache.record(user_id)
+        record.values[self._field] = value
+        record.dirty = True
+
+    def __delitem__(self, user_id):
+        record = self._cache.record(user_id)
+        del record.values[self._field]
+        record.dirty = True
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(
+            [
+                user_id
+                for user_id, record in self._cache.cached_items()
+                if self._field in record.values
+            ]
+        )
+
+    def __len__(self) -> int:
+        return sum(
+            1
+            for _, record in self._cache.cached_items()
+            if self._field in record.values
+        )
+
+
+class UserCache:
+    """LRU/TTL cache of user records backed by the database"""
+
+    def __init__(
+        self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.settings: Optional[str] = None
+        self._records: "OrderedDict[int, UserRecord]" = OrderedDict()
+        self.cooldowns = CooldownTable()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.blocking_loads = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.write_backs = 0
+        self.skipped_cooldown_writes = 0
+
+    def configure(
+        self,
+        settings: str,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        """Set the connection string and limits before starting"""
+        self.settings = settings
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if ttl is not None:
+            self.ttl = ttl
+
+    def view(self, field: str) -> RecordView:
+        """Dict-like view of one field ("settings" or "items")"""
+        if field not in USER_FIELDS:
+            raise ValueError(f"Unknown user record field: {field}")
+        return RecordView(self, field)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def cached_items(self) -> list:
+        """(user id, record) pairs of all cached users"""
+        with self._lock:
+            return list(self._records.items())
+
+    def record(self, user_id: int) -> UserRecord:
+        """Get a user's record, loading it now if it is not cached"""
+        with self._lock:
+            record = self._records.get(user_id)
+            if record is not None:
+                self.hits += 1
+                record.touched = time.monotonic()
+                self._records.move_to_end(user_id)
+                return record
+            self.misses += 1
+        # Not prefetched: this blocks the caller for one round trip
+        self.blocking_loads += 1
+        return self._insert(user_id, *self.fetch([user_id])[user_id])
+
+    async def prefetch(self, user_ids: Iterable[int]):
+        """Load the records of the given users in the background"""
+        with self._lock:
+            missing = [
+                user_id for user_id in set(user_ids) if user_id not in self._records
+            ]
+        if not missing:
+            return
+        records = await storage.run(self.fetch, missing, wait=True)
+        for user_id, (record, row, expires) in records.items():
+            with self._lock:
+                if user_id in self._records:
+                    # Loaded (and maybe changed) while we were fetching
+                    continue
+                self.misses += 1
+            self._insert(user_id, record, row, expires)
+
+    def prime(self, records: Dict[int, LoadedRecord]):
+        """Fill the cache with already loaded records, e.g. from a snapshot"""
+        for user_id, loaded in records.items():
+            self._insert(user_id, *loaded)
+
+    def invalidate(self, user_id: int):
+        """Drop a cached record without writing it back"""
+        with self._lock:
+            record = self._records.pop(user_id, None)
+            if record is not None and record.slot >= 0:
+                self.cooldowns.release(record.slot)
+
+    def clear(self):
+        """Drop every cached record without writing it back"""
+        with self._lock:
+            self._records.clear()
+            self.cooldowns.clear()
+
+    def cooldown_row(self, user_id: int) -> List[int]:
+        """Claim times of every cooldown kind of a user"""
+        return self.cooldown_state(user_id)[0]
+
+    def cooldown_state(self, user_id: int) -> Tuple[List[int], int]:
+        """Claim times of a user and when their last cooldown ends"""
+        slot = self.record(user_id).slot
+        if slot < 0:
+            return [0] * len(COOLDOWN_FIELDS), 0
+        return self.cooldowns.row(slot), self.cooldowns.expires[slot]
+
+    def remaining(
+        self, user_id: int, kind: int, duration: int, now: Optional[int] = None
+    ) -> int:
+        """Seconds until a user can claim a cooldown again (0 if they can now)"""
+        slot = self.record(user_id).slot
+        if slot < 0:
+            return 0
+        return self.cooldowns.remaining(slot, kind, duration, now or now_epoch())
+
+    def _slot(self, user_id: int, record: UserRecord) -> int:
+        """The record's cooldown slot, taking a fresh one if it has none"""
+        with self._lock:
+            if record.slot < 0:
+                record.slot = self.cooldowns.allocate(user_id)
+            return record.slot
+
+    def set_claimed_at(self, user_id: int, kind: int, claimed_at: int):
+        """Move a claim time (the row is kept until it surely ended)"""
+        record = self.record(user_id)
+        slot = self._slot(user_id, record)
+        self.cooldowns.set(slot, kind, claimed_at)
+        self.cooldowns.extend(slot, claimed_at + LONGEST_COOLDOWN)
+
+    def store_cooldowns(self, user_id: int, row: List[int], expires: int):
+        """Replace a user's cached cooldowns with the stored ones"""
+        record = self.record(user_id)
+        with self._lock:
+            if expires <= now_epoch():
+                if record.slot >= 0:
+                    self.cooldowns.release(record.slot)
+                    record.slot = -1
+                return
+            slot = self._slot(user_id, record)
+            self.cooldowns.store(slot, row, expires)
+
+    def fetch(self, user_ids: list) -> Dict[int, LoadedRecord]:
+        """Read the records of the given users from the database (blocking)"""
+        # Collect unconfirmed changes before reading, so none are missed
+        user_changes = flusher.unconfirmed(USERS_COLLECTION, user_ids)
+        cooldown_changes = flusher.unconfirmed(COOLDOWNS_COLLECTION, user_ids)
+
+        db = get_database(self.settings)
+        users = {user_id: {"_id": user_id} for user_id in user_ids}
+        for doc in db[USERS_COLLECTION].find(
+            {"_id": {"$in": user_ids}}, {"items": 1, "settings": 1}
+        ):
+            users[doc["_id"]] = doc
+        cooldowns = {user_id: {"_id": user_id} for user_id in user_ids}
+        for doc in db[COOLDOWNS_COLLECTION].find({"_id": {"$in": user_ids}}):
+            cooldowns[doc["_id"]] = doc
+
+        records = {}
+        for user_id in user_ids:
+            user = users[user_id]
+            for change in user_changes.get(user_id, ()):
+                user = change.apply(user)
+            cooldown = cooldowns[user_id]
+            for change in cooldown_changes.get(user_id, ()):
+                cooldown = change.apply(cooldown)
+            records[user_id] = self.decode(user, cooldown)
+        return records
+
+    @staticmethod
+    def decode(user: dict, cooldowns: dict) -> LoadedRecord:
+        """Build a record, cooldown row and its end time from a user's documents"""
+        values: Dict[str, Any] = {}
+        if user.get("settings") is not None:
+            values["settings"] = decode_user_settings(user["settings"])
+        else:
+            values["settings"] = UserSettings()
+        if user.get("items") is not None:
+            values["items"] = dict(user["items"])
+        return (UserRecord(values), *decode_cooldowns(cooldowns))
+
+    def _insert(
+        self, user_id: int, record: UserRecord, row: List[int], expires: int
+    ) -> UserRecord:
+        if not expires and any(row):
+            # Stored before end times were: keep it as long as it may matter
+            expires = max(row) + LONGEST_COOLDOWN
+        with self._lock:
+            previous = self._records.pop(user_id, None)
+            if previous is not None and previous.slot >= 0:
+                self.cooldowns.release(previous.slot)
+            if expires > now_epoch():
+                record.slot = self.cooldowns.allocate(user_id, row, expires)
+            else:
+                record.slot = -1
+            self._records[user_id] = record
+            self._evict()
+        return record
+
+    def _evict(self):
+        """Drop expired records and the least recently used over the budget"""
+        expire_before = time.monotonic() - self.ttl
+        while self._records:
+            user_id, record = next(iter(self._records.items()))
+            if len(self._records) > self.max_entries:
+                self.evictions += 1
+            elif record.touched < expire_before:
+                self.expirations += 1
+            else:
+                break
+            del self._records[user_id]
+            if record.dirty:
+                self._write_back(user_id, record)
+            if record.slot >= 0:
+                # A running cooldown row, written back before claims were
+                # made on the database
+                self.skipped_cooldown_writes += 1
+                self.cooldowns.release(record.slot)
+
+    def _expire_cooldowns(self):
+        """Free the cooldown rows that can no longer block anyone"""
+        records = self._records
+        for user_id in self.cooldowns.expire(now_epoch()):
+            record = records.get(user_id)
+            if record is not None:
+                record.slot = -1
+        slots = self.cooldowns.compact()
+        if slots is not None:
+            for user_id, slot in slots.items():
+                records[user_id].slot = slot
+
+    def sweep(self):
+        """Evict idle records (also done on every insert) and free ended
+        cooldown rows"""
+        with self._lock:
+            self._evict()
+            self._expire_cooldowns()
+
+    def _write_back(self, user_id: int, record: UserRecord):
+        """Stage the settings and items of an evicted record that was changed"""
+        values = record.values
+        user_set = {}
+        user_unset = []
+        if "settings" in values:
+            user_set["settings"] = encode_user_settings(values["settings"])
+        if "items" in values:
+            user_set["items"] = dict(values["items"])
+        else:
+            user_unset.append("items")
+        flusher.stage(USERS_COLLECTION, user_id, user_set, user_unset)
+        # Cooldowns are written when claimed, never from here: another
+        # process may have claimed one since this row was read
+        self.write_backs += 1
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._records),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "blocking_loads": self.blocking_loads,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "write_backs": self.write_backs,
+            "cooldowns": {
+                "rows": len(self.cooldowns),
+                "capacity": self.cooldowns.capacity,
+                "memory_bytes": self.cooldowns.capacity * ROW_BYTES,
+                # Rows freed by expire; their stored documents are deleted by
+                # the TTL index, not rewritten
+                "expired_rows": self.cooldowns.expired,
+                "compactions": self.cooldowns.compactions,
+                "compacted_bytes": self.cooldowns.compacted_bytes,
+                # Running cooldown rows of evicted records not rewritten
+                "skipped_writes": self.skipped_cooldown_writes,
+                "skipped_write_bytes": self.skipped_cooldown_writes
+                * COOLDOWN_DOC_BYTES,
+            },
+        }
+
+
+user_cache = UserCache()
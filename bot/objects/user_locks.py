@@ -0,0 +1,128 @@
+"""
+Striped per-user locks for Maxis
+
+Balance changes that check a balance, await something and then write it take
+the locks of the users they touch. Instead of one lock per user (which would
+have to be created and dropped as users come and go), a fixed number of
+asyncio locks is shared by hashing user ids onto them, so unrelated users
+rarely contend and the table never grows.
+
+An operation on several users takes their stripes in ascending order, which
+rules out deadlocks between two operations waiting on each other. A task that
+already holds a stripe can take it again, so helpers can lock the users they
+change even when the command calling them already holds them.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+DEFAULT_STRIPES = 256
+
+# Stripes reported as contention hotspots
+HOTSPOTS = 5
+
+
+class StripedLocks:
+    """A fixed set of asyncio locks shared by all users"""
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES):
+        self.configure(stripes)
+
+    def configure(self, stripes: int = DEFAULT_STRIPES):
+        """Set the number of stripes. Only call it while no lock is held."""
+        stripes = max(int(stripes), 1)
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self._holders: List[Optional[asyncio.Task]] = [None] * stripes
+        # Per stripe: contended acquisitions, seconds waited, last user waiting
+        self._waits = [0] * stripes
+        self._wait_seconds = [0.0] * stripes
+        self._last_waiter = [0] * stripes
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def stripes(self) -> int:
+        return len(self._locks)
+
+    def stripe(self, user_id: int) -> int:
+        # The low bits of a Discord snowflake are a per-process counter that
+        # is often zero, so fold the timestamp bits in before taking the modulo
+        return (user_id ^ (user_id >> 22)) % len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, *user_ids: int):
+        """Hold the locks of the given users for the duration of the block"""
+        task = asyncio.current_task()
+        by_stripe = {}
+        for user_id in user_ids:
+            by_stripe.setdefault(self.stripe(user_id), user_id)
+        stripes = sorted(by_stripe)
+        held = [s for s in stripes if self._holders[s] is task]
+        needed = [s for s in stripes if self._holders[s] is not task]
+        if held and needed and needed[0] < max(held):
+            # Taking a lower stripe while holding a higher one can deadlock
+            raise RuntimeError("user locks must be taken in one hold() call")
+
+        taken = []
+        try:
+            for stripe in needed:
+                await self._acquire(stripe, by_stripe[stripe])
+                taken.append(stripe)
+                self._holders[stripe] = task
+            yield
+        finally:
+            for stripe in reversed(taken):
+                self._holders[stripe] = None
+                self._locks[stripe].release()
+
+    async def _acquire(self, stripe: int, user_id: int):
+        lock = self._locks[stripe]
+        self.acquisitions += 1
+        if not lock.locked():
+            await lock.acquire()
+            return
+        started = time.perf_counter()
+        await lock.acquire()
+        waited = time.perf_counter() - started
+        self.contended += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self._waits[stripe] += 1
+        self._wait_seconds[stripe] += waited
+        self._last_waiter[stripe] = user_id
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        hottest = sorted(
+            (s for s in range(len(self._locks)) if self._waits[s]),
+            key=lambda s: self._wait_seconds[s],
+            reverse=True,
+        )[:HOTSPOTS]
+        return {
+            "stripes": len(self._locks),
+            "held": sum(lock.locked() for lock in self._locks),
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "avg_wait_ms": (
+                self.total_wait_seconds / self.contended * 1000
+                if self.contended
+                else 0.0
+            ),
+            "max_wait_ms": self.max_wait_seconds * 1000,
+            "hotspots": [
+                {
+                    "stripe": s,
+                    "waits": self._waits[s],
+                    "wait_ms": self._wait_seconds[s] * 1000,
+                    "last_user": self._last_waiter[s],
+                }
+                for s in hottest
+            ],
+        }
+
+
+user_locks = StripedLocks()
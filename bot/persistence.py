@@ -0,0 +1,629 @@
+"""
+Write-behind persistence for Maxis
+
+Command handlers never talk to MongoDB directly. They stage the fields that
+changed on a document, and the storage service flushes everything that is
+pending once per interval from the bot's event loop, running the blocking
+driver calls on a fixed-size thread pool. Staging the same document many
+times within an interval only ever results in one write for it. Staged
+changes are journaled locally until the database confirms them.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from bot.database import get_database
+from bot.journal import Journal
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_MAX_PENDING = 10000
+DEFAULT_STORAGE_WORKERS = 4
+DEFAULT_STORAGE_QUEUE = 100
+
+
+def _assign(doc, path: str, value, remove: bool = False) -> bool:
+    """Set (or unset) a dotted field of a document like MongoDB would: missing
+    parents are created, lists are padded with None and an unset list item
+    becomes None. Returns False if the path runs into a plain value."""
+    *parents, last = path.split(".")
+    target = doc
+    for name in parents:
+        if isinstance(target, list):
+            if not name.isdigit():
+                return False
+            index = int(name)
+            if index >= len(target):
+                if remove:
+                    return True
+                target.extend([None] * (index + 1 - len(target)))
+            if target[index] is None and not remove:
+                target[index] = {}
+            target = target[index]
+        elif isinstance(target, dict):
+            if name not in target:
+                if remove:
+                    return True
+                target[name] = {}
+            target = target[name]
+        else:
+            return False
+    if isinstance(target, list):
+        if not last.isdigit():
+            return False
+        index = int(last)
+        if remove:
+            if index < len(target):
+                target[index] = None
+        else:
+            if index >= len(target):
+                target.extend([None] * (index + 1 - len(target)))
+            target[index] = value
+    elif isinstance(target, dict):
+        if remove:
+            target.pop(last, None)
+        else:
+            target[last] = value
+    else:
+        return False
+    return True
+
+
+class PendingWrite:
+    """Coalesced changes of a single document"""
+
+    __slots__ = ("delete", "set_fields", "unset_fields")
+
+    def __init__(self):
+        self.delete = False
+        self.set_fields: Dict[str, Any] = {}
+        self.unset_fields: Dict[str, str] = {}
+
+    def merge(self, newer: "PendingWrite"):
+        """Apply a newer set of changes on top of this one"""
+        if newer.delete:
+            self.delete = True
+            self.set_fields.clear()
+            self.unset_fields.clear()
+        for field in newer.unset_fields:
+            self._drop_parts(field)
+            self.set_fields.pop(field, None)
+            if not self._fold(field, None, remove=True):
+                self.unset_fields[field] = ""
+        for field, value in newer.set_fields.items():
+            self._drop_parts(field)
+            self.unset_fields.pop(field, None)
+            if not self._fold(field, value):
+                self.set_fields[field] = value
+
+    def _drop_parts(self, field: str):
+        """Forget pending changes inside a field that is replaced as a whole"""
+        prefix = field + "."
+        for fields in (self.set_fields, self.unset_fields):
+            for part in [name for name in fields if name.startswith(prefix)]:
+                del fields[part]
+
+    def _fold(self, field: str, value, remove: bool = False) -> bool:
+        """Apply a change of a dotted field to a pending set of one of its
+        parents, since MongoDB refuses an update that sets both. Returns
+        False if no parent is pending."""
+        start = 0
+        while True:
+            dot = field.find(".", start)
+            if dot < 0:
+                return False
+            parent = field[:dot]
+            if parent in self.set_fields:
+                container = deepcopy(self.set_fields[parent])
+                if not _assign(container, field[dot + 1 :], value, remove):
+                    return False
+                self.set_fields[parent] = container
+                return True
+            start = dot + 1
+
+    def apply(self, doc: dict) -> dict:
+        """Apply these changes to a fetched copy of the document"""
+        if self.delete:
+            doc = {"_id": doc["_id"]}
+        for field in self.unset_fields:
+            _assign(doc, field, None, remove=True)
+        for field, value in self.set_fields.items():
+            _assign(doc, field, deepcopy(value))
+        return doc
+
+    def operations(self, _id) -> list:
+        """Build the bulk write operations for this document"""
+        ops = []
+        if self.delete:
+            ops.append(DeleteOne({"_id": _id}))
+        update = {}
+        if self.set_fields:
+            update["$set"] = self.set_fields
+        if self.unset_fields and not self.delete:
+            update["$unset"] = self.unset_fields
+        if update:
+            # Lets a warm start fetch only the documents changed since its snapshot
+            update["$currentDate"] = {"updated": True}
+            ops.append(UpdateOne({"_id": _id}, update, upsert=True))
+        return ops
+
+
+class WriteBehindFlusher:
+    """Collects staged document changes until the storage service flushes them"""
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.settings: Optional[str] = None
+        self.on_limit: Optional[Callable[[], None]] = None
+        self.journal: Optional[Journal] = None
+        self._pending: Dict[str, Dict[Any, PendingWrite]] = {}
+        # The batch being written by the current flush
+        self._inflight: Dict[str, Dict[Any, PendingWrite]] = {}
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.flushes = 0
+        self.failed_flushes = 0
+        # Changes the database refused, see _write_collection
+        self.dropped_writes = 0
+        self.recent_drops: Deque[Tuple[str, str, str]] = deque(maxlen=20)
+        self.last_flush_seconds = 0.0
+
+    def configure(
+        self,
+        settings: str,
+        interval: Optional[float] = None,
+        max_pending: Optional[int] = None,
+    ):
+        """Set the connection string and tuning knobs before starting"""
+        self.settings = settings
+        if interval is not None:
+            self.interval = interval
+        if max_pending is not None:
+            self.max_pending = max_pending
+
+    @property
+    def pending_count(self) -> int:
+        """Number of documents waiting to be written"""
+        return self._pending_count
+
+    @property
+    def over_limit(self) -> bool:
+        """Whether as many documents as allowed are waiting to be written
+        (new work should be refused until a flush gets through)"""
+        with self._lock:
+            waiting = self._pending_count + sum(map(len, self._inflight.values()))
+        return waiting >= self.max_pending
+
+    def unconfirmed(
+        self, collection: str, ids: Optional[Iterable] = None
+    ) -> Dict[Any, list]:
+        """Changes of the given documents (or of every document of the
+        collection) not yet confirmed by the database.
+
+        Returns the changes per document, oldest first. Apply them on top of
+        a copy read from the database *after* calling this to get the
+        current document.
+        """
+        changes = {}
+        with self._lock:
+            inflight = self._inflight.get(collection, {})
+            pending = self._pending.get(collection, {})
+            if ids is None:
+                ids = {**inflight, **pending}
+            for _id in ids:
+                found = [
+                    documents[_id]
+                    for documents in (inflight, pending)
+                    if _id in documents
+                ]
+                if found:
+                    changes[_id] = found
+        return changes
+
+    def staged(self, collection: str) -> List[Tuple[Any, Dict[str, Any]]]:
+        """The fields set on each document of a collection that the database
+        has not confirmed yet, as (_id, fields) pairs"""
+        with self._lock:
+            return [
+                (_id, dict(change.set_fields))
+                for documents in (
+                    self._inflight.get(collection, {}),
+                    self._pending.get(collection, {}),
+                )
+                for _id, change in documents.items()
+            ]
+
+    def stage(
+        self,
+        collection: str,
+        _id,
+        set_fields: Optional[Dict[str, Any]] = None,
+        unset_fields: Iterable[str] = (),
+        delete: bool = False,
+        journal: bool = True,
+    ):
+        """Record changes of one document, to be written on the next flush.
+
+        The change is appended to the journal (if one is attached) before
+        this returns, unless ``journal`` is False because it was read back
+        from there.
+        """
+        self.stage_many([(collection, _id, set_fields, unset_fields, delete)], journal)
+
+    def stage_many(self, changes: Iterable[tuple], journal: bool = True):
+        """Record changes of several documents as one unit: they are journaled
+        together and always end up in the same flush. Each change is a
+        ``(collection, _id, set_fields, unset_fields, delete)`` tuple."""
+        staged = []
+        for collection, _id, set_fields, unset_fields, delete in changes:
+            change = PendingWrite()
+            change.delete = delete
+            change.set_fields.update(set_fields or {})
+            for field in unset_fields:
+                change.unset_fields[field] = ""
+            staged.append((collection, _id, change))
+
+        with self._lock:
+            for collection, _id, change in staged:
+                if journal and self.journal is not None and self.journal.is_open:
+                    self.journal.append(
+                        collection,
+                        _id,
+                        change.set_fields,
+                        change.unset_fields,
+                        change.delete,
+                    )
+                documents = self._pending.setdefault(collection, {})
+                if _id in documents:
+                    documents[_id].merge(change)
+                else:
+                    documents[_id] = change
+                    self._pending_count += 1
+            over_limit = self._pending_count >= self.max_pending
+
+        if over_limit and self.on_limit is not None:
+            self.on_limit()
+
+    def flush(self) -> bool:
+        """Write everything pending now (blocking). Returns False on failure."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+                self._pending_count = 0
+                journal_seq = self.journal.last_seq if self.journal else 0
+            if not batch:
+                return True
+
+            started = time.perf_counter()
+            try:
+                db = get_database(self.settings)
+                for collection, documents in list(batch.items()):
+                    self._write_collection(db, collection, documents)
+                    with self._lock:
+                        del batch[collection]
+            except Exception as e:
+                print(f"Error flushing pending writes: {e}")
+                self.failed_flushes += 1
+                self._requeue(batch)
+                return False
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+            if self.journal is not None:
+                # Everything journaled up to the swap is now in the database
+                self.journal.checkpoint(journal_seq)
+            self.flushes += 1
+            self.last_flush_seconds = time.perf_counter() - started
+            return True
+
+    def _write_collection(self, db, collection: str, documents: dict):
+        """Write one collection's changes in order. A change the database
+        refuses (a write error, not a lost connection) would fail on every
+        retry, so it is logged and dropped and the rest is still written."""
+        operations = []
+        owners = []
+        for _id, change in documents.items():
+            for operation in change.operations(_id):
+                operations.append(operation)
+                owners.append(_id)
+        start = 0
+        while start < len(operations):
+            try:
+                db[collection].bulk_write(operations[start:], ordered=True)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors") or []
+                if not errors:
+                    raise
+                # Ordered: everything before the failed operation was written
+                failed = start + errors[0]["index"]
+                _id = owners[failed]
+                message = errors[0].get("errmsg", "write error")
+                print(f"Dropped refused write to {collection} {_id!r}: {message}")
+                with self._lock:
+                    documents.pop(_id, None)
+                    self.dropped_writes += 1
+                    self.recent_drops.append((collection, repr(_id), message))
+                start = failed + 1
+
+    def _requeue(self, batch: Dict[str, Dict[Any, PendingWrite]]):
+        """Put a failed batch back underneath anything staged since"""
+        with self._lock:
+            for collection, documents in batch.items():
+                pending = self._pending.setdefault(collection, {})
+                for _id, change in documents.items():
+                    if _id in pending:
+                        change.merge(pending[_id])
+                    else:
+                        self._pending_count += 1
+                    pending[_id] = change
+
+
+class BackpressurePolicy(Enum):
+    """What the storage service does with new work when its queue is full"""
+
+    DROP_SUPERSEDED = "drop_superseded"
+    BLOCK = "block"
+    REJECT = "reject"
+
+
+class StorageQueueFull(Exception):
+    """Raised when the storage queue is full and new work is rejected"""
+
+
+class _Job:
+    """A blocking call waiting for (or running on) a storage worker"""
+
+    __slots__ = ("func", "args", "key", "started", "lock", "future", "on_start")
+
+    def __init__(self, func: Callable, args: tuple, key, on_start: Callable):
+        self.func = func
+        self.args = args
+        self.key = key
+        self.started = False
+        self.lock = threading.Lock()
+        self.future: Optional[asyncio.Future] = None
+        self.on_start = on_start
+
+    def __call__(self):
+        with self.lock:
+            self.started = True
+            func, args = self.func, self.args
+        self.on_start(self)
+        return func(*args)
+
+
+class StorageService:
+    """Runs blocking database work for the event loop on a fixed thread pool.
+
+    Handlers either ``await storage.run(...)`` to get the result (and any
+    exception) back on the loop, or call ``storage.submit(...)`` to fire and
+    forget. Failures of fire-and-forget work are logged and counted.
+
+    At most ``max_queue`` calls wait for a worker at any time. With the
+    DROP_SUPERSEDED policy, a call given a ``key`` replaces a still-queued
+    call with the same key, and both callers get the newer call's result.
+    When the queue is full, BLOCK makes new calls wait for space while
+    REJECT and DROP_SUPERSEDED make them fail with StorageQueueFull (unless
+    the call asks to ``wait``).
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_STORAGE_WORKERS,
+        max_queue: int = DEFAULT_STORAGE_QUEUE,
+        policy: BackpressurePolicy = BackpressurePolicy.DROP_SUPERSEDED,
+    ):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._flush_now: Optional[asyncio.Event] = None
+        self._background: Set[asyncio.Task] = set()
+        self._queued_keys: Dict[Any, _Job] = {}
+        self._space_waiters: Deque[asyncio.Future] = deque()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.rejected = 0
+        self.superseded = 0
+        self.blocked = 0
+        self.operations = 0
+        self.failures = 0
+        self.total_latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """Start the pool and the periodic flush on the running event loop"""
+        if self._flush_task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="storage"
+        )
+        self._flush_now = asyncio.Event()
+        flusher.on_limit = self._request_flush
+        self._flush_task = self._loop.create_task(self._flush_loop())
+        if flusher.journal is not None:
+            self._sync_task = self._loop.create_task(self._sync_loop())
+
+    def _request_flush(self):
+        """Wake the flush loop early (safe to call from any thread)"""
+        if self._loop is not None and self._flush_now is not None:
+            self._loop.call_soon_threadsafe(self._flush_now.set)
+
+    def _job_started(self, job: _Job):
+        """Called from a worker thread when it picks up a job"""
+        self._loop.call_soon_threadsafe(self._release_slot, job)
+
+    def _release_slot(self, job: _Job):
+        self.queue_depth -= 1
+        if job.key is not None and self._queued_keys.get(job.key) is job:
+            del self._queued_keys[job.key]
+        while self._space_waiters:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def _admit(self, wait: bool):
+        """Wait for (or refuse) a place in the queue according to the policy"""
+        if self.queue_depth < self.max_queue:
+            return
+        if wait or self.policy is BackpressurePolicy.BLOCK:
+            self.blocked += 1
+            while self.queue_depth >= self.max_queue:
+                waiter = self._loop.create_future()
+                self._space_waiters.append(waiter)
+                await waiter
+            return
+        self.rejected += 1
+        raise StorageQueueFull(
+            f"Storage queue is full ({self.queue_depth}/{self.max_queue})"
+        )
+
+    async def run(self, func: Callable, *args, key=None, wait: bool = False) -> Any:
+        """Run a blocking call on the pool and await its result. With
+        ``wait``, a full queue is waited out whatever the policy, for work
+        that has no sensible fallback."""
+        if self._executor is None or self._loop is None:
+            raise RuntimeError("Storage service has not been started")
+
+        if (
+            self.policy is BackpressurePolicy.DROP_SUPERSEDED
+            and key is not None
+            and key in self._queued_keys
+        ):
+            queued = self._queued_keys[key]
+            with queued.lock:
+                replaced = not queued.started
+                if replaced:
+                    # The newest call wins and shares the queued call's result
+                    queued.func, queued.args = func, args
+            if replaced:
+                self.superseded += 1
+                return await asyncio.shield(queued.future)
+
+        await self._admit(wait)
+        job = _Job(func, args, key, self._job_started)
+        if key is not None:
+            self._queued_keys[key] = job
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        started = time.perf_counter()
+        try:
+            job.future = self._loop.run_in_executor(self._executor, job)
+            return await job.future
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{getattr(func, '__name__', func)}: {e}"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.operations += 1
+            self.total_latency_seconds += elapsed
+            self.max_latency_seconds = max(self.max_latency_seconds, elapsed)
+
+    def submit(self, func: Callable, *args, key=None) -> asyncio.Task:
+        """Run a blocking call on the pool without waiting for it"""
+        task = asyncio.get_running_loop().create_task(self.run(func, *args, key=key))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error in background storage work: {task.exception()}")
+
+    async def flush(self) -> bool:
+        """Write everything pending and wait until it is stored"""
+        return await self.run(flusher.flush, key="flush")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), flusher.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                ok = await self.flush()
+            except Exception as e:
+                print(f"Error in flush loop: {e}")
+                ok = False
+            if not ok:
+                # Back off instead of hammering an unreachable database
+                await asyncio.sleep(flusher.interval)
+
+    async def _sync_loop(self):
+        """Batch journal fsyncs instead of syncing every append"""
+        journal = flusher.journal
+        while True:
+            await asyncio.sleep(journal.fsync_interval)
+            try:
+                await self.run(journal.sync, key="journal-sync")
+            except Exception as e:
+                print(f"Error syncing journal: {e}")
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "workers": self.max_workers,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_limit": self.max_queue,
+            "policy": self.policy.value,
+            "rejected": self.rejected,
+            "superseded": self.superseded,
+            "blocked": self.blocked,
+            "operations": self.operations,
+            "failures": self.failures,
+            "avg_latency_ms": (
+                self.total_latency_seconds / self.operations * 1000
+                if self.operations
+                else 0.0
+            ),
+            "max_latency_ms": self.max_latency_seconds * 1000,
+            "last_error": self.last_error,
+            "in_flight": len(self._background),
+        }
+
+    def shutdown(self):
+        """Stop the flush loop, write whatever is pending and release the pool"""
+        for task in (self._flush_task, self._sync_task):
+            if task is not None:
+                task.cancel()
+        self._flush_task = None
+        self._sync_task = None
+        flusher.on_limit = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        flusher.flush()
+        if flusher.journal is not None:
+            flusher.journal.close()
+
+
+flusher = WriteBehindFlusher()
+storage = StorageService()
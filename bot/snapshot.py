@@ -0,0 +1,233 @@
+"""
+Warm-start snapshot file for Maxis
+
+The whole in-memory state is written to one local binary file so the next
+boot can start from it and only fetch documents changed since, instead of
+scanning every collection. Numeric data is stored as fixed-width little
+endian columns that are read straight out of a memory map; the nested,
+variable-sized maps (items, warns, replies) are stored as BSON blobs.
+
+Layout::
+
+    header   magic, format version, section count, stamp (ms), body crc32
+    table    per section: name, offset, length, item count
+    body     8-byte aligned sections
+"""
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import bson
+
+from bot.database import (
+    COOLDOWN_FIELDS,
+    decode_warn,
+    encode_warn,
+)
+from bot.objects.balance_store import BalanceStore
+from bot.objects.user_settings import UserSettings
+from bot.objects.warn import Warn
+
+MAGIC = b"MAXSNAP\0"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<8sIIqI4x")
+SECTION = struct.Struct("<16sQQQ")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+SETTING_DM = 1
+SETTING_PASSIVE = 2
+
+
+class SnapshotState:
+    """Everything the bot keeps in memory, plus the time it was taken at"""
+
+    def __init__(self, stamp: datetime):
+        self.stamp = stamp
+        self.balances = BalanceStore()
+        self.items: Dict[int, Dict[str, int]] = {}
+        self.user_settings: Dict[int, UserSettings] = {}
+        # Running cooldown rows (epoch seconds per kind) of the cached users,
+        # and when each row's last cooldown ends
+        self.cooldowns: Dict[int, List[int]] = {}
+        self.cooldown_expires: Dict[int, int] = {}
+        self.warns: Dict[int, Dict[int, Warn]] = {}
+        self.replies: Dict[str, str] = {}
+
+
+def _to_micros(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _column(typecode: str, values) -> bytes:
+    data = array(typecode, values)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _encode_sections(state: SnapshotState) -> List[Tuple[bytes, int, bytes]]:
+    """Serialize the state into (name, count, data) sections"""
+    sections = []
+
+    balance_ids, balances = state.balances.columns()
+    sections.append((b"bal.id", len(balance_ids), _column("q", balance_ids)))
+    sections.append((b"bal.val", len(balance_ids), _column("q", balances)))
+
+    settings_ids = sorted(state.user_settings)
+    flags = []
+    for user_id in settings_ids:
+        user_settings = state.user_settings[user_id]
+        flags.append(
+            (SETTING_DM if user_settings.bank_dm_enabled else 0)
+            | (SETTING_PASSIVE if user_settings.bank_passive_enabled else 0)
+        )
+    sections.append((b"set.id", len(settings_ids), _column("q", settings_ids)))
+    sections.append((b"set.flag", len(settings_ids), _column("B", flags)))
+
+    cooldown_ids = sorted(state.cooldowns)
+    sections.append((b"cd.id", len(cooldown_ids), _column("q", cooldown_ids)))
+    for kind, field in enumerate(COOLDOWN_FIELDS):
+        sections.append(
+            (
+                f"cd.{field}".encode(),
+                len(cooldown_ids),
+                _column("q", (state.cooldowns[i][kind] for i in cooldown_ids)),
+            )
+        )
+    sections.append(
+        (
+            b"cd.expires",
+            len(cooldown_ids),
+            _column("q", (state.cooldown_expires.get(i, 0) for i in cooldown_ids)),
+        )
+    )
+
+    items = {str(user_id): owned for user_id, owned in state.items.items()}
+    sections.append((b"items", len(items), bson.encode(items)))
+    warns = {
+        str(guild_id): {
+            str(user_id): encode_warn(warn) for user_id, warn in guild_warns.items()
+        }
+        for guild_id, guild_warns in state.warns.items()
+    }
+    sections.append((b"warns", len(warns), bson.encode(warns)))
+    sections.append((b"replies", len(state.replies), bson.encode(state.replies)))
+    return sections
+
+
+def write_snapshot(path: Path, state: SnapshotState) -> int:
+    """Atomically replace the snapshot file. Returns its size in bytes."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    sections = _encode_sections(state)
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    body = bytearray()
+    for name, count, data in sections:
+        padding = -(offset + len(body)) % 8
+        body.extend(b"\0" * padding)
+        table.append(SECTION.pack(name, offset + len(body), len(data), count))
+        body.extend(data)
+
+    stamp_ms = _to_micros(state.stamp) // 1000
+    crc = zlib.crc32(body)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), stamp_ms, crc)
+
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(b"".join(table))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return HEADER.size + SECTION.size * len(sections) + len(body)
+
+
+def _read_column(view: memoryview, typecode: str) -> array:
+    data = array(typecode)
+    data.frombytes(view)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data
+
+
+def load_snapshot(path: Path) -> Optional[SnapshotState]:
+    """Read a snapshot file, or None if it is missing, outdated or damaged"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            with memoryview(mm) as view:
+                return _decode(view)
+    except Exception as e:
+        print(f"Ignoring unreadable snapshot {path.name}: {e}")
+        return None
+
+
+def _decode(view: memoryview) -> Optional[SnapshotState]:
+    magic, version, section_count, stamp_ms, crc = HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("not a snapshot file")
+    if version != FORMAT_VERSION:
+        print(f"Snapshot format {version} is not supported, loading from database")
+        return None
+    body_start = HEADER.size + SECTION.size * section_count
+    if zlib.crc32(view[body_start:]) != crc:
+        raise ValueError("checksum mismatch")
+
+    sections = {}
+    for i in range(section_count):
+        name, offset, length, count = SECTION.unpack_from(
+            view, HEADER.size + SECTION.size * i
+        )
+        sections[name.rstrip(b"\0").decode()] = (view[offset : offset + length], count)
+
+    state = SnapshotState(EPOCH + timedelta(milliseconds=stamp_ms))
+
+    ids = _read_column(sections["bal.id"][0], "q")
+    values = _read_column(sections["bal.val"][0], "q")
+    state.balances = BalanceStore.from_columns(ids, values)
+
+    ids = _read_column(sections["set.id"][0], "q")
+    flags = _read_column(sections["set.flag"][0], "B")
+    state.user_settings = {
+        user_id: UserSettings(
+            bank_dm_enabled=bool(flag & SETTING_DM),
+            bank_passive_enabled=bool(flag & SETTING_PASSIVE),
+        )
+        for user_id, flag in zip(ids, flags)
+    }
+
+    ids = _read_column(sections["cd.id"][0], "q")
+    columns = [
+        _read_column(sections[f"cd.{field}"][0], "q") for field in COOLDOWN_FIELDS
+    ]
+    state.cooldowns = {user_id: list(row) for user_id, row in zip(ids, zip(*columns))}
+    expires = _read_column(sections["cd.expires"][0], "q")
+    state.cooldown_expires = dict(zip(ids, expires))
+
+    items = bson.decode(sections["items"][0])
+    state.items = {int(user_id): dict(owned) for user_id, owned in items.items()}
+    warns = bson.decode(sections["warns"][0])
+    state.warns = {
+        int(guild_id): {
+            int(user_id): decode_warn(warn) for user_id, warn in guild_warns.items()
+        }
+        for guild_id, guild_warns in warns.items()
+    }
+    state.replies = dict(bson.decode(sections["replies"][0]))
+    return state
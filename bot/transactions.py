@@ -0,0 +1,212 @@
+"""
+Transaction history pages for Maxis
+
+``/transactions`` shows a user's ledger events a page at a time, newest
+first. Pages are read with a keyset cursor, the ``(at, _id)`` of the last
+event shown, so every page is one range scan of the ``users, at, _id`` index
+however far back it is. The cursor travels in the buttons' custom ids, which
+keeps the buttons working across restarts without any state per message.
+
+Events not yet written by the write-behind flusher are merged into the page,
+and pages are cached for a short time so pressing the buttons back and forth
+does not query the database again.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import discord
+
+from bot.database import LEDGER_COLLECTION, find_ledger_page
+from bot.helper import get_random_color
+from bot.persistence import flusher, storage
+
+PAGE_SIZE = 10
+PAGE_CACHE_TTL = 30.0
+PAGE_CACHE_SIZE = 1000
+
+CUSTOM_ID_PREFIX = "transactions"
+
+KIND_LABELS = {
+    "work": "Work",
+    "daily": "Daily reward",
+    "weekly": "Weekly reward",
+    "monthly": "Monthly reward",
+    "rob": "Robbery",
+    "give": "Gift",
+    "buy": "Shop purchase",
+    "hack_win": "Hack",
+    "hack_loss": "Failed hack",
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# (at in epoch milliseconds, event id): the position of an event in a history
+Cursor = Tuple[int, int]
+
+
+def _epoch_ms(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def _position(event: dict) -> Cursor:
+    return _epoch_ms(event["at"]), event["_id"]
+
+
+class TransactionPage:
+    """One page of a user's history, newest first"""
+
+    __slots__ = ("user_id", "events", "has_newer", "has_older")
+
+    def __init__(
+        self, user_id: int, events: List[dict], has_newer: bool, has_older: bool
+    ):
+        self.user_id = user_id
+        self.events = events
+        self.has_newer = has_newer
+        self.has_older = has_older
+
+
+class TransactionPages:
+    """Reads history pages, with a short-lived cache in front of the database"""
+
+    def __init__(self):
+        self.settings: Optional[str] = None
+        self._cache: "OrderedDict[tuple, Tuple[float, TransactionPage]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, settings: str):
+        self.settings = settings
+
+    async def page(
+        self,
+        user_id: int,
+        cursor: Optional[Cursor] = None,
+        older: bool = True,
+        cached: bool = True,
+    ) -> TransactionPage:
+        """The page after (``older``) or before ``cursor``, or the newest page"""
+        key = (user_id, cursor, older)
+        now = time.monotonic()
+        if cached and key in self._cache:
+            stored_at, page = self._cache[key]
+            if now - stored_at < PAGE_CACHE_TTL:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return page
+        self.misses += 1
+
+        page = await self._read(user_id, cursor, older)
+        self._cache[key] = (now, page)
+        self._cache.move_to_end(key)
+        while len(self._cache) > PAGE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return page
+
+    async def _read(
+        self, user_id: int, cursor: Optional[Cursor], older: bool
+    ) -> TransactionPage:
+        # One more than a page tells whether there is another page after it
+        events = await storage.run(
+            find_ledger_page, self.settings, user_id, cursor, older, PAGE_SIZE + 1
+        )
+        events = self._merge_unwritten(user_id, events, cursor, older)
+        has_more = len(events) > PAGE_SIZE
+        events = events[:PAGE_SIZE]
+        if older:
+            return TransactionPage(user_id, events, cursor is not None, has_more)
+        if not has_more:
+            # Reached the newest events, show the first page in full
+            return await self.page(user_id, cached=False)
+        events.reverse()
+        return TransactionPage(user_id, events, True, True)
+
+    @staticmethod
+    def _merge_unwritten(
+        user_id: int, events: List[dict], cursor: Optional[Cursor], older: bool
+    ) -> List[dict]:
+        """Add the user's events still waiting for the flusher, in page order"""
+        merged = {event["_id"]: event for event in events}
+        for _id, fields in flusher.staged(LEDGER_COLLECTION):
+            if user_id not in fields.get("users", ()) or _id in merged:
+                continue
+            event = dict(fields, _id=_id)
+            if cursor is not None and (
+                _position(event) >= cursor if older else _position(event) <= cursor
+            ):
+                continue
+            merged[_id] = event
+        return sorted(merged.values(), key=_position, reverse=older)
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "cached_pages": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+transaction_pages = TransactionPages()
+
+
+def _describe(event: dict, user_id: int) -> str:
+    index = event["users"].index(user_id)
+    amount = event["amounts"][index]
+    label = KIND_LABELS.get(event["kind"], event["kind"].replace("_", " ").title())
+    line = (
+        f"<t:{_epoch_ms(event['at']) // 1000}:R> {label}: "
+        f"{'+' if amount >= 0 else '-'}:coin: {abs(amount)}"
+    )
+    others = [other for other in event["users"] if other != user_id]
+    if others:
+        line += f" {'from' if amount >= 0 else 'to'} <@{others[0]}>"
+    return line + f" (balance :coin: {event['closing'][index]})"
+
+
+def render_page(page: TransactionPage) -> Tuple[discord.Embed, discord.ui.View]:
+    """The embed and navigation buttons of a history page"""
+    embed = discord.Embed(title="Transactions", color=get_random_color())
+    if page.events:
+        embed.description = "\n".join(
+            _describe(event, page.user_id) for event in page.events
+        )
+    else:
+        embed.description = "No transactions yet."
+
+    view = discord.ui.View()
+    first = _position(page.events[0]) if page.events else (0, 0)
+    last = _position(page.events[-1]) if page.events else (0, 0)
+    view.add_item(
+        discord.ui.Button(
+            label="Newer",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"{CUSTOM_ID_PREFIX}_{page.user_id}_n_{first[0]}_{first[1]}",
+            disabled=not page.has_newer,
+        )
+    )
+    view.add_item(
+        discord.ui.Button(
+            label="Older",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"{CUSTOM_ID_PREFIX}_{page.user_id}_o_{last[0]}_{last[1]}",
+            disabled=not page.has_older,
+        )
+    )
+    return embed, view
+
+
+def parse_custom_id(custom_id: str) -> Optional[Tuple[int, Cursor, bool]]:
+    """The user id, cursor and direction a navigation button points at"""
+    parts = custom_id.split("_")
+    if len(parts) != 5 or parts[2] not in ("n", "o"):
+        return None
+    try:
+        return int(parts[1]), (int(parts[3]), int(parts[4])), parts[2] == "o"
+    except ValueError:
+        return None
@@ -0,0 +1,142 @@
+"""
+User lookups for Maxis listings
+
+Turns stored user ids into Discord users for leaderboards and other
+listings. The client's own cache is checked first; users that had to be
+fetched are kept in an LRU for a while, and so are ids that no longer exist,
+so a warm listing makes no HTTP requests at all. Misses of one batch are
+fetched concurrently, up to a limit shared by every batch, and an id that is
+already being fetched is awaited instead of fetched twice.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import discord
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class UserResolver:
+    """Cached, concurrency-limited ``user id -> discord.User`` lookups"""
+
+    def __init__(self):
+        self.client: Optional[discord.Client] = None
+        self.concurrency = DEFAULT_CONCURRENCY
+        self.ttl = DEFAULT_TTL
+        self.max_entries = DEFAULT_MAX_ENTRIES
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # user id -> (fetched at, user or None if the account doesn't exist)
+        self._cache: "OrderedDict[int, Tuple[float, Optional[discord.User]]]" = (
+            OrderedDict()
+        )
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.client_hits = 0
+        self.cache_hits = 0
+        self.fetches = 0
+        self.not_found = 0
+        self.errors = 0
+
+    def configure(
+        self,
+        client: discord.Client,
+        concurrency: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.client = client
+        if concurrency is not None:
+            self.concurrency = max(concurrency, 1)
+        if ttl is not None:
+            self.ttl = ttl
+        self._semaphore = None
+
+    def _cached(self, user_id: int, now: float):
+        """(True, user or None) on a hit, (False, None) on a miss"""
+        user = self.client.get_user(user_id)
+        if user is not None:
+            self.client_hits += 1
+            return True, user
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            if now - entry[0] < self.ttl:
+                self._cache.move_to_end(user_id)
+                self.cache_hits += 1
+                return True, entry[1]
+            del self._cache[user_id]
+        return False, None
+
+    def _store(self, user_id: int, user: Optional[discord.User], now: float):
+        self._cache[user_id] = (now, user)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, user_id: int) -> Optional[discord.User]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            self.fetches += 1
+            try:
+                user = await self.client.fetch_user(user_id)
+            except discord.NotFound:
+                self.not_found += 1
+                user = None
+            except discord.HTTPException as e:
+                # Not cached: the account may well exist, try again next time
+                print(f"Error fetching user {user_id}: {e}")
+                self.errors += 1
+                return None
+        self._store(user_id, user, time.monotonic())
+        return user
+
+    async def resolve_many(
+        self, user_ids: Iterable[int]
+    ) -> Dict[int, Optional[discord.User]]:
+        """Users by id, None for ids that can't be resolved"""
+        now = time.monotonic()
+        resolved: Dict[int, Optional[discord.User]] = {}
+        waiting: Dict[int, asyncio.Future] = {}
+        for user_id in user_ids:
+            if user_id in resolved or user_id in waiting:
+                continue
+            hit, user = self._cached(user_id, now)
+            if hit:
+                resolved[user_id] = user
+                continue
+            future = self._inflight.get(user_id)
+            if future is None:
+                future = asyncio.ensure_future(self._fetch(user_id))
+                self._inflight[user_id] = future
+                future.add_done_callback(
+                    lambda _, user_id=user_id: self._inflight.pop(user_id, None)
+                )
+            waiting[user_id] = future
+
+        if waiting:
+            # Shielded: other batches may be waiting on the same fetches
+            users = await asyncio.gather(*map(asyncio.shield, waiting.values()))
+            resolved.update(zip(waiting, users))
+        return resolved
+
+    async def resolve(self, user_id: int) -> Optional[discord.User]:
+        return (await self.resolve_many((user_id,)))[user_id]
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict"""
+        return {
+            "cached": len(self._cache),
+            "client_hits": self.client_hits,
+            "cache_hits": self.cache_hits,
+            "fetches": self.fetches,
+            "not_found": self.not_found,
+            "errors": self.errors,
+            "in_flight": len(self._inflight),
+            "concurrency": self.concurrency,
+        }
+
+
+user_resolver = UserResolver()
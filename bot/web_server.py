@@ -3,12 +3,30 @@ Flask web server for bot status page
 """
 
 import threading
-from flask import Flask, send_from_directory
+from datetime import date
+
+from flask import Flask, abort, jsonify, request, send_from_directory
 from bs4 import BeautifulSoup
 from discord.ext import commands
 
 from bot.main import Main
-from bot.helper import resource_path
+from bot.cooldown_engine import cooldown_engine
+from bot.helper import balance_index, custom_replies, resource_path, top_balances
+from bot.database import pool_stats
+from bot.leaderboard_history import (
+    EPOCH,
+    GLOBAL_BOARD,
+    day_date,
+    leaderboard_history,
+    today,
+)
+from bot.leaderboards import leaderboard_cache
+from bot.objects.guild_rankings import guild_rankings
+from bot.objects.user_cache import user_cache
+from bot.objects.user_locks import user_locks
+from bot.persistence import flusher, storage
+from bot.transactions import transaction_pages
+from bot.user_resolver import user_resolver
 
 app = Flask(__name__, static_folder=str(resource_path("public")), static_url_path="/")
 
@@ -55,6 +73,97 @@ def index():
     return str(soup)
 
 
+@app.route("/stats")
+def stats():
+    """Serve persistence statistics for capacity planning"""
+    return jsonify(
+        {
+            "mongo_pool": pool_stats.snapshot(),
+            "flusher": {
+                "pending": flusher.pending_count,
+                "flushes": flusher.flushes,
+                "failed_flushes": flusher.failed_flushes,
+                "dropped_writes": flusher.dropped_writes,
+                "recent_drops": list(flusher.recent_drops),
+                "last_flush_ms": flusher.last_flush_seconds * 1000,
+            },
+            "storage": storage.snapshot(),
+            "journal": flusher.journal.snapshot() if flusher.journal else None,
+            "startup_ms": Main.startup_timings,
+            "user_cache": user_cache.snapshot(),
+            "cooldowns": cooldown_engine.snapshot(),
+            "user_locks": user_locks.snapshot(),
+            "transactions": transaction_pages.snapshot(),
+            "top_balances": top_balances.snapshot(),
+            "guild_rankings": guild_rankings.snapshot(),
+            "leaderboard_cache": leaderboard_cache.snapshot(),
+            "leaderboard_history": leaderboard_history.snapshot(),
+            "balance_index": balance_index.snapshot(),
+            "user_resolver": user_resolver.snapshot(),
+            "reply_matcher": custom_replies.matcher.snapshot(),
+        }
+    )
+
+
+def _board(board: str) -> int:
+    """A board id from a URL: ``global`` or a guild id"""
+    if board == "global":
+        return GLOBAL_BOARD
+    if not board.isdigit():
+        abort(404)
+    return int(board)
+
+
+@app.route("/history/<board>")
+def history(board):
+    """Serve a recorded leaderboard (``?date=YYYY-MM-DD``, default: latest)"""
+    board_id = _board(board)
+    if "date" in request.args:
+        try:
+            days = [(date.fromisoformat(request.args["date"]) - EPOCH).days]
+        except ValueError:
+            abort(400)
+    else:
+        days = [today(), today() - 1]
+    for day in days:
+        ranking = leaderboard_history.load(board_id, day)
+        if ranking is not None:
+            return jsonify(
+                {
+                    "board": board,
+                    "date": day_date(day).isoformat(),
+                    "ranking": [
+                        {"user": str(user_id), "balance": balance}
+                        for user_id, balance in ranking.entries
+                    ],
+                }
+            )
+    abort(404)
+
+
+@app.route("/history/<board>/<int:user_id>")
+def user_history(board, user_id):
+    """Serve a user's daily rank on a leaderboard (``?days=N``, default 30)"""
+    board_id = _board(board)
+    days = min(max(request.args.get("days", 30, type=int), 1), 365)
+    last = today()
+    rankings = leaderboard_history.load_range(board_id, last - days + 1, last)
+    return jsonify(
+        {
+            "board": board,
+            "user": str(user_id),
+            "days": [
+                {
+                    "date": day_date(day).isoformat(),
+                    "rank": ranking.rank(user_id),
+                    "balance": ranking.balance(user_id),
+                }
+                for day, ranking in sorted(rankings.items())
+            ],
+        }
+    )
+
+
 @app.route("/<path:filename>")
 def public_files(filename):
     """Serve static files from public directory"""